@@ -0,0 +1,159 @@
+"""Per-update cost of the delivery analytics, to show recording events stays off the handlers' latency
+
+Runs /start with a content link through the handler for new users, a share of whom are not in the main
+channel and get the gate (a request and a denial) while the rest get the content (a request and a
+delivery). It runs once with the analytics writing to a SQLite file, flushed every --flush-interval
+seconds during the run, and once with a stand-in that records nothing. Also times each record call and
+how long a flush of --rollups rollups takes and holds up the event loop, since it writes on a thread.
+The simulated Bot API answers at once, so the overhead is also given as a share of a /start whose two
+Bot API calls take --api-latency seconds each, as they do against Telegram.
+
+    python benchmarks/analytics_overhead.py --updates 20000 --repeats 5 --flush-interval 0.05
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import timeit
+from types import SimpleNamespace
+
+from harness import MAIN_CHANNEL_ID, SimulatedBot, main, make_context, print_table, reset_state
+
+
+class NullAnalytics:
+    def record_request(self, image_id: str) -> None:
+        pass
+
+    def record_denial(self, image_id: str, user_id: int) -> None:
+        pass
+
+    def record_delivery(self, image_id: str, user_id: int) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
+
+
+def start_update(user_id: int):
+    user = SimpleNamespace(id=user_id, username=None, first_name="User")
+    return SimpleNamespace(effective_user=user, effective_chat=SimpleNamespace(id=user_id, type="private"),
+                           callback_query=None)
+
+
+async def flush_every(analytics, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        await analytics.flush()
+
+
+async def handle_updates(analytics, updates: int, link: str, denied_share: float, flush_interval: float) -> float:
+    """Seconds per /start, each from a new user so none is throttled"""
+    reset_state()
+    await main.state_backend.add_media("photo", "photo-file")
+    bot = SimulatedBot()
+    for user_id in range(1, int(updates * denied_share) + 1):
+        bot.statuses[(MAIN_CHANNEL_ID, user_id)] = "left"
+    context = make_context(bot)
+    context.args = [link]
+    main.delivery_analytics = analytics
+    flusher = asyncio.create_task(flush_every(analytics, flush_interval))
+    started = time.perf_counter()
+    try:
+        for user_id in range(1, updates + 1):
+            await main.start(start_update(user_id), context)
+            if user_id % 100 == 0:
+                # Nothing in the handler waits on I/O here, give the flusher its turn as a busy bot would
+                await asyncio.sleep(0)
+        return (time.perf_counter() - started) / updates
+    finally:
+        flusher.cancel()
+
+
+async def measure_updates(args) -> dict:
+    link = main.make_link_token("1")
+    saved = main.delivery_analytics
+    best = {"on": float("inf"), "off": float("inf")}
+    try:
+        # Alternate the modes so both see the same machine noise, keep the best run of each
+        for _ in range(args.repeats):
+            with tempfile.TemporaryDirectory() as directory:
+                analytics = main.DeliveryAnalytics(os.path.join(directory, "analytics.db"), 100_000)
+                try:
+                    seconds = await handle_updates(analytics, args.updates, link, args.denied_share,
+                                                   args.flush_interval)
+                finally:
+                    await analytics.close()
+            best["on"] = min(best["on"], seconds)
+            seconds = await handle_updates(NullAnalytics(), args.updates, link, args.denied_share,
+                                           args.flush_interval)
+            best["off"] = min(best["off"], seconds)
+    finally:
+        main.delivery_analytics = saved
+    return best
+
+
+def operation_costs(number: int) -> list:
+    analytics = main.DeliveryAnalytics(":memory:", 100_000)
+    user_ids = iter(range(10 ** 9))
+    operations = [
+        ("record_request", lambda: analytics.record_request("1")),
+        ("record_denial", lambda: analytics.record_denial("1", next(user_ids))),
+        ("record_delivery", lambda: analytics.record_delivery("1", next(user_ids))),
+    ]
+    try:
+        return [{"operation": name, "ns": round(min(timeit.repeat(call, number=number, repeat=5)) / number * 1e9, 1)}
+                for name, call in operations]
+    finally:
+        analytics.conn.close()
+
+
+async def measure_flush(rollups: int) -> dict:
+    """Wall time of flushing `rollups` rollups and the longest the event loop went without running meanwhile"""
+    with tempfile.TemporaryDirectory() as directory:
+        analytics = main.DeliveryAnalytics(os.path.join(directory, "analytics.db"), 100_000)
+        for image_id in range(1, rollups + 1):
+            analytics.record_request(str(image_id))
+        lag = 0.0
+
+        async def tick():
+            nonlocal lag
+            while True:
+                before = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lag = max(lag, time.perf_counter() - before - 0.001)
+
+        ticker = asyncio.create_task(tick())
+        await asyncio.sleep(0.01)
+        started = time.perf_counter()
+        await analytics.flush()
+        seconds = time.perf_counter() - started
+        ticker.cancel()
+        await analytics.close()
+    return {"rollups": rollups, "flush_ms": round(seconds * 1000, 1), "max_loop_lag_ms": round(lag * 1000, 2)}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--denied-share", type=float, default=0.3, help="share of users who get the gate")
+    parser.add_argument("--flush-interval", type=float, default=0.05, help="seconds between flushes during a run")
+    parser.add_argument("--rollups", type=int, default=1000, help="rollups in the timed flush")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="real Bot API latency in seconds")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    best = asyncio.run(measure_updates(args))
+    overhead = best["on"] - best["off"]
+    print_table([{"analytics": mode, "us_per_update": round(best[mode] * 1e6, 2)} for mode in ("off", "on")],
+                ("us_per_update",), first="analytics")
+    print(f"overhead: {overhead * 1e6:.2f} us per update ({overhead / best['off']:.1%})")
+    with_api = best["off"] + 2 * args.api_latency
+    print(f"with {args.api_latency * 1000:.0f} ms Bot API calls: {overhead / with_api:.3%} of a /start\n")
+
+    print_table(operation_costs(200_000), ("ns",), first="operation")
+    print()
+    print_table([asyncio.run(measure_flush(args.rollups))], ("flush_ms", "max_loop_lag_ms"), first="rollups")
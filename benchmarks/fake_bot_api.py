@@ -0,0 +1,302 @@
+"""Local stand-in for the Telegram Bot API, for load tests
+
+Answers the methods the bot uses with well-formed objects, after a configurable latency, and can
+reject a share of calls with 429 Too Many Requests. With enforce_limits it also rejects calls over
+Telegram's limits: about 30 requests per second in total and 1 message per second to the same chat.
+Membership answers come from fixtures: explicit (chat, user) statuses, falling back to a deterministic
+share of members per chat. The fixture status "inaccessible" answers getChatMember with 400 Bad Request,
+which the bot treats as an inconclusive check. Updates queued with push_update are served by getUpdates,
+which long-polls like Telegram's.
+"""
+import asyncio
+import collections
+import inspect
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "Study Bot", "username": "study_test_bot"}
+
+# Telegram's documented limits, each as (requests per second, burst)
+GLOBAL_LIMIT = (30, 30)
+PER_CHAT_LIMIT = (1, 3)
+
+
+class BotAPIError(Exception):
+    def __init__(self, code: int, description: str):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+
+
+class Bucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait(self) -> float:
+        """Take a token and return 0, or return the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 retry_after: int = 1, member_ratio: float = 1.0, enforce_limits: bool = False, seed: int = 0):
+        self.latency = latency  # seconds added to every call
+        self.jitter = jitter  # up to this many seconds more, uniformly
+        self.error_rate = error_rate  # share of calls answered with 429
+        self.retry_after = retry_after
+        self.member_ratio = member_ratio  # share of users who are members of any chat without a fixture
+        self.enforce_limits = enforce_limits  # answer calls over Telegram's rate limits with 429
+        self.global_bucket = Bucket(*GLOBAL_LIMIT)
+        self.chat_buckets = {}
+        self.random = random.Random(seed)
+        self.statuses = {}  # (chat_id, user_id) -> status
+        self.calls = collections.Counter()  # method -> calls answered normally
+        self.rejected = collections.Counter()  # method -> calls answered with 429
+        self.failed = collections.Counter()  # method -> calls answered with another error
+        self.message_ids = itertools.count(1)
+        self.updates = collections.deque()  # waiting for getUpdates
+        self.update_ready = None
+        self.server = None
+        self.writers = set()  # open keep-alive connections
+        self.port = None
+        self.loop = None
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def reset(self, **settings) -> None:
+        """Clear fixtures and counters between scenarios, optionally changing settings"""
+        for name, value in settings.items():
+            setattr(self, name, value)
+        self.statuses.clear()
+        self.calls.clear()
+        self.rejected.clear()
+        self.failed.clear()
+        self.global_bucket = Bucket(*GLOBAL_LIMIT)
+        self.chat_buckets.clear()
+
+    def set_status(self, chat_id, user_id: int, status: str) -> None:
+        self.statuses[(str(chat_id), int(user_id))] = status
+
+    def status(self, chat_id, user_id: int) -> str:
+        status = self.statuses.get((str(chat_id), int(user_id)))
+        if status is not None:
+            return status
+        # Stable per (chat, user) so repeated checks agree
+        bucket = zlib.crc32(f"{chat_id}:{user_id}".encode()) % 10_000
+        return "member" if bucket < self.member_ratio * 10_000 else "left"
+
+    def push_update(self, update: dict) -> None:
+        """Queue an update for getUpdates; safe to call from any thread"""
+        if self.loop is not None and threading.current_thread() is not self.thread:
+            self.loop.call_soon_threadsafe(self.push_update, update)
+            return
+        self.updates.append(update)
+        self.update_ready.set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.update_ready = asyncio.Event()
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        # Idle keep-alive connections would otherwise outlive the loop
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+
+    def start_thread(self) -> None:
+        """Serve from a thread with its own event loop, so the server does not compete with the bot"""
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="fake-bot-api", daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+
+    def stop_thread(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """HTTP/1.1 with keep-alive, so the bot's connection pool is used like against Telegram"""
+        self.writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+
+                status, payload = await self.call(path.rsplit("/", 1)[-1], self.parse_body(headers, body))
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def parse_body(headers: dict, body: bytes) -> dict:
+        if headers.get("content-type", "").startswith("application/json"):
+            return json.loads(body or b"{}")
+        params = {}
+        # Form values are JSON encoded, except plain strings
+        for name, value in parse_qsl(body.decode()):
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                params[name] = value
+        return params
+
+    async def call(self, method: str, params: dict):
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            return self.too_many_requests(method, self.retry_after)
+        if self.enforce_limits:
+            wait = self.limit_wait(method, params)
+            if wait:
+                return self.too_many_requests(method, math.ceil(wait))
+        handler = getattr(self, f"api_{method.lower()}", None)
+        if handler is None:
+            return "404 Not Found", {"ok": False, "error_code": 404, "description": "Not Found: method not found"}
+        try:
+            result = handler(params)
+            if inspect.isawaitable(result):
+                result = await result
+        except BotAPIError as e:
+            self.failed[method] += 1
+            return f"{e.code} Error", {"ok": False, "error_code": e.code, "description": e.description}
+        self.calls[method] += 1
+        return "200 OK", {"ok": True, "result": result}
+
+    def too_many_requests(self, method: str, retry_after: int):
+        self.rejected[method] += 1
+        return "429 Too Many Requests", {
+            "ok": False,
+            "error_code": 429,
+            "description": f"Too Many Requests: retry after {retry_after}",
+            "parameters": {"retry_after": retry_after},
+        }
+
+    def limit_wait(self, method: str, params: dict) -> float:
+        """Seconds the call came too early by, 0 if it is within the limits (and then counted against them)"""
+        wait = self.global_bucket.wait()
+        if wait or not method.startswith(("send", "edit")) or "chat_id" not in params:
+            return wait
+        bucket = self.chat_buckets.get(str(params["chat_id"]))
+        if bucket is None:
+            bucket = self.chat_buckets[str(params["chat_id"])] = Bucket(*PER_CHAT_LIMIT)
+        wait = bucket.wait()
+        if wait:
+            # Rejected calls don't count against the global limit either
+            self.global_bucket.tokens += 1
+        return wait
+
+    def message(self, chat_id, **fields) -> dict:
+        chat_id = int(chat_id)
+        chat = {"id": chat_id, "type": "channel" if chat_id < 0 else "private"}
+        return {"message_id": next(self.message_ids), "date": int(time.time()), "chat": chat, "from": BOT_USER,
+                **fields}
+
+    def api_getme(self, params):
+        return {**BOT_USER, "can_join_groups": True, "can_read_all_group_messages": False,
+                "supports_inline_queries": False}
+
+    def api_getchatmember(self, params):
+        user = {"id": int(params["user_id"]), "is_bot": False, "first_name": "User"}
+        status = self.status(params["chat_id"], params["user_id"])
+        if status == "inaccessible":
+            raise BotAPIError(400, "Bad Request: member list is inaccessible")
+        if status == "kicked":
+            return {"status": status, "user": user, "until_date": 0}
+        return {"status": status, "user": user}
+
+    def api_getchat(self, params):
+        chat_id = params["chat_id"]
+        return {
+            "id": chat_id if isinstance(chat_id, int) else -1000000000000 - zlib.crc32(chat_id.encode()),
+            "type": "channel", "title": str(chat_id), "accent_color_id": 0, "max_reaction_count": 11,
+            "accepted_gift_types": {"unlimited_gifts": False, "limited_gifts": False, "unique_gifts": False,
+                                    "premium_subscription": False, "gifts_from_channels": False},
+        }
+
+    def api_getchatadministrators(self, params):
+        return [{"status": "administrator", "user": BOT_USER, "can_be_edited": False, "is_anonymous": False,
+                 "can_manage_chat": True, "can_delete_messages": True, "can_manage_video_chats": True,
+                 "can_restrict_members": True, "can_promote_members": False, "can_change_info": True,
+                 "can_invite_users": True, "can_post_stories": False, "can_edit_stories": False,
+                 "can_delete_stories": False}]
+
+    def api_sendmessage(self, params):
+        return self.message(params["chat_id"], text=params.get("text", ""))
+
+    def api_sendphoto(self, params):
+        photo = [{"file_id": params["photo"], "file_unique_id": "u", "width": 1280, "height": 720}]
+        return self.message(params["chat_id"], photo=photo)
+
+    def api_sendvideo(self, params):
+        video = {"file_id": params["video"], "file_unique_id": "u", "width": 1280, "height": 720, "duration": 1}
+        return self.message(params["chat_id"], video=video)
+
+    def api_sendmediagroup(self, params):
+        group_id = str(next(self.message_ids))
+        return [self.message(params["chat_id"], media_group_id=group_id) for _ in params["media"]]
+
+    def api_editmessagetext(self, params):
+        return self.message(params.get("chat_id", 1), text=params.get("text", ""))
+
+    def api_answercallbackquery(self, params):
+        return True
+
+    def api_deletewebhook(self, params):
+        return True
+
+    def api_setwebhook(self, params):
+        return True
+
+    async def api_getupdates(self, params):
+        offset = params.get("offset")
+        # Like Telegram, asking for an offset confirms every update before it
+        while offset is not None and self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates and params.get("timeout"):
+            self.update_ready.clear()
+            try:
+                await asyncio.wait_for(self.update_ready.wait(), params["timeout"])
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self.updates, params.get("limit", 100)))
@@ -0,0 +1,79 @@
+"""Cost of building the membership gate reply (text and keyboard) under a 10k requests/s burst
+
+A synthetic burst of /start requests for content links (a few popular links get most requests) is
+answered with the gate reply, either rebuilt for every request as the handlers used to do, or taken
+from the gate_text / gate_keyboard caches. Some content has a two-channel gating policy. Reports the
+build cost per reply, with and without serializing it for the Bot API, and the share of one core the
+burst's replies take at the requested rate.
+
+    python benchmarks/gate_construction.py --rate 10000 --seconds 3 --links 2000
+"""
+import argparse
+import random
+import time
+
+from harness import main, percentile, print_table
+
+POLICY_GATES = [(True, ("@study_main", "@study_notes")), (False, ("@study_notes", "@study_archive"))]
+
+
+def build_burst(requests: int, links: int, policy_share: float, seed: int) -> list:
+    """(link, gate) per request, link popularity following Zipf's law"""
+    rng = random.Random(seed)
+    tokens = [main.make_link_token(str(media_id)) for media_id in range(1, links + 1)]
+    gates = [rng.choice(POLICY_GATES) if rng.random() < policy_share else main.MAIN_GATE for _ in tokens]
+    picks = rng.choices(range(links), weights=[1 / rank for rank in range(1, links + 1)], k=requests)
+    return [(tokens[pick], gates[pick]) for pick in picks]
+
+
+def rebuilt(link: str, gate: tuple) -> tuple:
+    """The reply built from scratch, as before the caches"""
+    require_all, channels = gate
+    names = (" and " if require_all else " or ").join(channels) if channels else main.MAIN_CHANNEL_USERNAME
+    names = main.escape_markdown(names, version=1)
+    text = main.TEMPLATES[main.LANGUAGE]["access_denied"].replace("{channel}", names)
+    return text, main.gate_keyboard.__wrapped__("gate", link, channels)
+
+
+def cached(link: str, gate: tuple) -> tuple:
+    return main.gate_text("access_denied", gate), main.gate_keyboard("gate", link, gate[1])
+
+
+def measure(mode: str, build, burst: list, seconds: float, serialize: bool) -> dict:
+    main.gate_text.cache_clear()
+    main.gate_keyboard.cache_clear()
+    latencies = []
+    for link, gate in burst:
+        started = time.perf_counter()
+        text, markup = build(link, gate)
+        if serialize:
+            markup.to_json()
+        latencies.append(time.perf_counter() - started)
+    busy = sum(latencies)
+    info = main.gate_keyboard.cache_info()
+    return {
+        "mode": mode + (" + json" if serialize else ""),
+        "replies": len(burst),
+        "p50_us": round(percentile(latencies, 0.50) * 1e6, 2),
+        "p99_us": round(percentile(latencies, 0.99) * 1e6, 2),
+        "core_share": f"{busy / seconds:.1%}",
+        "hit_ratio": f"{info.hits / (info.hits + info.misses):.1%}" if mode == "cached" else "-",
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=int, default=10000, help="gate replies per second in the burst")
+    parser.add_argument("--seconds", type=float, default=3, help="length of the burst")
+    parser.add_argument("--links", type=int, default=2000, help="distinct content links requested")
+    parser.add_argument("--policy-share", type=float, default=0.2, help="share of content with a gating policy")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    burst = build_burst(int(args.rate * args.seconds), args.links, args.policy_share, args.seed)
+    rows = [measure(mode, build, burst, args.seconds, serialize)
+            for serialize in (False, True) for mode, build in (("rebuilt", rebuilt), ("cached", cached))]
+    print_table(rows, ("replies", "p50_us", "p99_us", "core_share", "hit_ratio"), first="mode")
@@ -0,0 +1,105 @@
+"""Shared setup for the benchmarks: imports main.py with test settings and offers an in-process bot
+
+Benchmarks that need real HTTP traffic use fake_bot_api.FakeBotAPI instead of SimulatedBot.
+"""
+import asyncio
+import collections
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+MAIN_CHANNEL_ID = -1001000000001
+CONTENT_CHANNEL_ID = -1001000000002
+MAIN_CHANNEL_USERNAME = "@study_main"
+BOT_USERNAME = "study_test_bot"
+
+# main.py reads its settings at import
+os.environ.setdefault("STUDY_BOT_CONFIG", os.path.join(os.path.dirname(__file__), "missing-config.json"))
+os.environ.update({
+    "STUDY_BOT_BOT_TOKEN": "123456:loadtest-token-loadtest-token-000",
+    "STUDY_BOT_MAIN_CHANNEL_ID": str(MAIN_CHANNEL_ID),
+    "STUDY_BOT_CONTENT_CHANNEL_ID": str(CONTENT_CHANNEL_ID),
+    "STUDY_BOT_MAIN_CHANNEL_USERNAME": MAIN_CHANNEL_USERNAME,
+    "STUDY_BOT_BOT_USERNAME": BOT_USERNAME,
+    "STUDY_BOT_STATE_BACKEND": "memory",
+    "STUDY_BOT_ANALYTICS_DB_PATH": ":memory:",
+    "STUDY_BOT_LOG_LEVEL": os.environ.get("STUDY_BOT_LOG_LEVEL", "WARNING"),
+})
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram_study_bot"))
+
+import main  # noqa: E402
+
+
+class SimulatedBot:
+    """Stands in for context.bot: getChatMember answers from statuses after `latency` seconds, other calls
+    return a message at once; every call is counted by method"""
+
+    id = 1000
+
+    def __init__(self, latency: float = 0.0, default_status: str = "member"):
+        self.latency = latency
+        self.default_status = default_status
+        self.statuses = {}  # (chat_id, user_id) -> status
+        self.calls = collections.Counter()
+
+    async def get_chat_member(self, chat_id, user_id, **kwargs):
+        self.calls["get_chat_member"] += 1
+        # Telegram answers with the status at the time it receives the request
+        status = self.statuses.get((chat_id, user_id), self.default_status)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return SimpleNamespace(status=status)
+
+    def __getattr__(self, method):
+        async def call(*args, **kwargs):
+            self.calls[method] += 1
+            return SimpleNamespace(message_id=1)
+        return call
+
+
+class DiscardingJobQueue:
+    """Job queue that accepts jobs and never runs them"""
+
+    def run_once(self, callback, when, data=None, name=None):
+        return SimpleNamespace(schedule_removal=lambda: None)
+
+    def get_jobs_by_name(self, name):
+        return []
+
+
+def make_context(bot, args=()):
+    return SimpleNamespace(bot=bot, args=list(args), job_queue=DiscardingJobQueue())
+
+
+def reset_state() -> None:
+    """Cold caches and a fresh memory backend, as after a restart"""
+    main.membership_cache.clear()
+    main.membership_index.clear()
+    main.pending_membership_checks.clear()
+    main.pending_albums.clear()
+    main.request_throttle = main.RequestThrottle(main.FLOOD_MAX_REQUESTS, main.FLOOD_WINDOW, main.DEDUP_WINDOW)
+    main.state_backend = main.MemoryBackend()
+
+
+def percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+async def timed(awaitable, latencies: list):
+    """Await and append the elapsed seconds to latencies"""
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        latencies.append(time.perf_counter() - started)
+
+
+def print_table(rows: list, columns: tuple, first: str = "scenario") -> None:
+    """Print dict rows, the first column from row[first]"""
+    print(f"{first:<22}" + "".join(f"{column:>16}" for column in columns))
+    for row in rows:
+        print(f"{row[first]:<22}" + "".join(f"{row[column]:>16}" for column in columns))
@@ -0,0 +1,78 @@
+"""Cost of making and verifying signed content links, next to the storage lookup a bad link no longer needs
+
+Times make_link_token and resolve_content_link for valid, tampered, malformed and expired links, and
+a get_media on a SQLite store of --items entries for comparison. Also checks the longest token (largest
+ID, with an expiry) against Telegram's 64-character limit for start parameters.
+
+    python benchmarks/link_tokens.py --number 200000 --items 100000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import timeit
+
+from harness import main, print_table
+from media_store import populate
+
+START_PARAMETER_LIMIT = 64
+
+
+def tampered(token: str) -> str:
+    """The token with its last signature character changed"""
+    return token[:-1] + ("A" if token[-1] != "A" else "B")
+
+
+def time_call(name: str, call, number: int, expected=...) -> dict:
+    result = call()
+    if expected is not ... and result != expected:
+        raise AssertionError(f"{name}: expected {expected!r}, got {result!r}")
+    seconds = min(timeit.repeat(call, number=number, repeat=5)) / number
+    return {"operation": name, "us": round(seconds * 1e6, 3), "per_second": f"{1 / seconds:,.0f}"}
+
+
+def get_media_cost(items: int, number: int) -> dict:
+    async def measure(path: str) -> float:
+        populate(path, items)
+        backend = main.SQLiteBackend(path)
+        media_id = str(items // 2)
+        started = time.perf_counter()
+        for _ in range(number):
+            await backend.get_media(media_id)
+        seconds = (time.perf_counter() - started) / number
+        await backend.close()
+        return seconds
+
+    with tempfile.TemporaryDirectory() as directory:
+        seconds = asyncio.run(measure(os.path.join(directory, "media.db")))
+    return {"operation": "SQLite get_media", "us": round(seconds * 1e6, 3), "per_second": f"{1 / seconds:,.0f}"}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200000, help="calls per timing")
+    parser.add_argument("--items", type=int, default=100000, help="entries in the SQLite store")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    token = main.make_link_token("123456")
+    expiring = main.make_link_token("123456", ttl=3600)
+    expired = main.make_link_token("123456", ttl=-3600)
+    forged = tampered(token)
+    rows = [
+        time_call("make token", lambda: main.make_link_token("123456"), args.number),
+        time_call("make token with expiry", lambda: main.make_link_token("123456", ttl=3600), args.number),
+        time_call("verify valid", lambda: main.resolve_content_link(token), args.number, "123456"),
+        time_call("verify valid, expiring", lambda: main.resolve_content_link(expiring), args.number, "123456"),
+        time_call("verify tampered", lambda: main.resolve_content_link(forged), args.number, None),
+        time_call("verify expired", lambda: main.resolve_content_link(expired), args.number, None),
+        time_call("verify malformed", lambda: main.resolve_content_link("s12_x"), args.number, None),
+        get_media_cost(args.items, min(args.number, 20000)),
+    ]
+    print_table(rows, ("us", "per_second"), first="operation")
+
+    longest = main.make_link_token(str(10 ** 18 - 1), ttl=10 ** 8)
+    print(f"\nlongest token: {len(longest)} characters (limit {START_PARAMETER_LIMIT})")
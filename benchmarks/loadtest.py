@@ -0,0 +1,352 @@
+"""Replay synthetic or recorded traffic through the bot's real handlers against a fake Bot API
+
+Every scenario is a trace of timed events: Telegram updates, processed exactly as in production
+(same handlers, rate limiter and concurrency limit), and fixture changes such as a user joining
+the main channel. For each scenario it reports throughput, p50/p99 update latency and API-call
+amplification (Bot API calls per update). The bot keeps its configured outgoing rate limits unless
+--lift-rate-limits is given, which measures the bot alone with the fake server's 429s as the only brake.
+
+    python benchmarks/loadtest.py                       # all profiles
+    python benchmarks/loadtest.py --lift-rate-limits    # no outgoing rate limits
+    python benchmarks/loadtest.py member_start --users 2000 --latency 0.05
+    python benchmarks/loadtest.py --output baseline.json
+    python benchmarks/loadtest.py --baseline baseline.json   # exits 1 on a regression
+    python benchmarks/loadtest.py --replay trace.jsonl      # {"at": seconds, "update": {...}} per line
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import sys
+import time
+
+from fake_bot_api import BOT_USER, FakeBotAPI
+from harness import CONTENT_CHANNEL_ID, MAIN_CHANNEL_ID, main, percentile, print_table, reset_state
+from telegram import Update
+
+CONTENT_ITEMS = 50
+RATE_LIMITS = ("GLOBAL_RATE_LIMIT", "PER_CHAT_RATE_LIMIT", "PER_CHAT_BURST")
+# Settings a run changes, put back when it ends
+RUN_SETTINGS = RATE_LIMITS + ("ALBUM_COLLECT_DELAY", "BOT_API_BASE_URL", "rate_limiter", "request_throttle",
+                              "state_backend")
+
+
+class TraceBuilder:
+    """Builds Telegram update JSON the way the Bot API sends it"""
+
+    def __init__(self, links: list, rate: float, seed: int = 0):
+        self.links = links
+        self.interval = 1 / rate
+        self.random = random.Random(seed)
+        self.events = []
+        self.update_ids = iter(range(1, 10_000_000))
+        self.clock = 0.0
+
+    def tick(self) -> float:
+        at = self.clock
+        self.clock += self.interval
+        return at
+
+    def user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def start(self, user_id: int, link: str, at: float = None) -> None:
+        text = f"/start {link}"
+        self.events.append({"at": self.tick() if at is None else at, "update": {
+            "update_id": next(self.update_ids),
+            "message": {
+                "message_id": next(self.update_ids), "date": int(time.time()), "text": text,
+                "chat": {"id": user_id, "type": "private"}, "from": self.user(user_id),
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            },
+        }})
+
+    def button(self, user_id: int, data: str, at: float = None) -> None:
+        self.events.append({"at": self.tick() if at is None else at, "update": {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.update_ids)), "from": self.user(user_id), "chat_instance": "1", "data": data,
+                "message": {"message_id": 1, "date": int(time.time()), "text": "gate",
+                            "chat": {"id": user_id, "type": "private"}, "from": BOT_USER},
+            },
+        }})
+
+    def channel_photo(self, file_id: str, group_id: str = None) -> None:
+        post = {
+            "message_id": next(self.update_ids), "date": int(time.time()),
+            "chat": {"id": CONTENT_CHANNEL_ID, "type": "channel"},
+            "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720}],
+        }
+        if group_id:
+            post["media_group_id"] = group_id
+        self.events.append({"at": self.tick(), "update": {"update_id": next(self.update_ids), "channel_post": post}})
+
+    def join(self, user_id: int, at: float) -> None:
+        """The user joins the main channel: Telegram answers "member" from then on and sends the bot a
+        chat_member update"""
+        self.fixture(user_id, "member", at)
+        user = self.user(user_id)
+        self.events.append({"at": at, "update": {
+            "update_id": next(self.update_ids),
+            "chat_member": {
+                "chat": {"id": MAIN_CHANNEL_ID, "type": "channel", "title": "Study"}, "from": user,
+                "date": int(time.time()), "old_chat_member": {"status": "left", "user": user},
+                "new_chat_member": {"status": "member", "user": user},
+            },
+        }})
+
+    def fixture(self, user_id: int, status: str, at: float) -> None:
+        """Change what the fake API answers for the user's main channel membership from `at` on"""
+        self.events.append({"at": at, "fixture": {"chat_id": MAIN_CHANNEL_ID, "user_id": user_id, "status": status}})
+
+    def link(self) -> str:
+        return self.random.choice(self.links)
+
+
+# Traffic profiles: name -> (description, fake API settings, trace builder)
+def member_start(trace: TraceBuilder, users: int) -> None:
+    for user_id in range(1, users + 1):
+        trace.start(user_id, trace.link())
+
+
+def gate_denied(trace: TraceBuilder, users: int) -> None:
+    for user_id in range(1, users + 1):
+        trace.start(user_id, trace.link())
+
+
+def join_then_check(trace: TraceBuilder, users: int) -> None:
+    for user_id in range(1, users + 1):
+        link = trace.link()
+        trace.start(user_id, link)
+        if user_id % 2:
+            # Joins a moment later and taps "I Joined, Check Again"
+            trace.join(user_id, trace.clock + 0.5)
+            trace.button(user_id, f"check_membership_{link}", at=trace.clock + 1.0)
+        else:
+            # Taps before the join went through, a background re-check picks it up
+            trace.button(user_id, f"check_membership_{link}", at=trace.clock + 0.5)
+            trace.join(user_id, trace.clock + 1.0)
+
+
+def repeat_visitors(trace: TraceBuilder, users: int) -> None:
+    visitors = max(1, users // 5)
+    for _ in range(5):
+        for user_id in range(1, visitors + 1):
+            trace.start(user_id, trace.link())
+
+
+def flood(trace: TraceBuilder, users: int) -> None:
+    spammers = max(1, users // 20)
+    for _ in range(10):
+        for user_id in range(1, spammers + 1):
+            link = trace.links[user_id % len(trace.links)]
+            trace.start(user_id, link)
+            trace.button(user_id, f"force_check_{link}")
+
+
+def album_upload(trace: TraceBuilder, users: int) -> None:
+    for album in range(max(1, users // 10)):
+        for item in range(5):
+            trace.channel_photo(f"album{album}_photo{item}", group_id=f"group{album}")
+
+
+def rate_limited(trace: TraceBuilder, users: int) -> None:
+    member_start(trace, users)
+
+
+def telegram_limits(trace: TraceBuilder, users: int) -> None:
+    visitors = max(1, users // 3)
+    for _ in range(3):
+        for user_id in range(1, visitors + 1):
+            trace.start(user_id, trace.link())
+
+
+PROFILES = {
+    "member_start": ("members open a link", {}, member_start),
+    "gate_denied": ("non-members open a link and get the gate", {"member_ratio": 0.0}, gate_denied),
+    "join_then_check": ("gate, join and 'I Joined, Check Again', half tap too early and wait for a re-check",
+                        {"member_ratio": 0.0}, join_then_check),
+    "repeat_visitors": ("members open five links each", {}, repeat_visitors),
+    "flood": ("a few users spam the same link and Force Refresh", {}, flood),
+    "album_upload": ("5-photo albums posted to the content channel", {}, album_upload),
+    "rate_limited": ("members open a link while 5% of calls get 429", {"error_rate": 0.05}, rate_limited),
+    # Always runs with the bot's own rate limits, the fake server rejects whatever goes over Telegram's
+    "telegram_limits": ("members open three links each, Telegram's rate limits enforced",
+                        {"enforce_limits": True}, telegram_limits),
+}
+
+
+@contextlib.contextmanager
+def bot_settings(api: FakeBotAPI):
+    """Point the bot at the fake API for a run and yield its configured rate limits; every setting a
+    run changes is put back afterwards"""
+    saved = {name: getattr(main, name) for name in RUN_SETTINGS}
+    main.BOT_API_BASE_URL = api.base_url
+    # Albums are stored once no item arrived for this long; short, so album_upload doesn't wait for nothing
+    main.ALBUM_COLLECT_DELAY = 0.2
+    try:
+        yield {name: saved[name] for name in RATE_LIMITS}
+    finally:
+        for name, value in saved.items():
+            setattr(main, name, value)
+
+
+def reset_bot_state(limits: dict, lift_rate_limits: bool) -> None:
+    """Give every scenario a cold bot, as after a restart, with the configured rate limits or none"""
+    reset_state()
+    for name in RATE_LIMITS:
+        setattr(main, name, 1_000_000 if lift_rate_limits else limits[name])
+    main.rate_limiter = main.PriorityRateLimiter()
+
+
+async def wait_until_idle(application, api: FakeBotAPI) -> None:
+    """Wait for album and re-check jobs still scheduled, then for the API calls of the last ones to end"""
+    while main.pending_albums or application.job_queue.jobs():
+        await asyncio.sleep(0.05)
+    calls = -1
+    while sum(api.calls.values()) != calls:
+        calls = sum(api.calls.values())
+        await asyncio.sleep(0.1)
+
+
+async def run_scenario(api: FakeBotAPI, events: list, limits: dict, lift_rate_limits: bool = False) -> dict:
+    """Replay a trace through a freshly built application and measure it"""
+    reset_bot_state(limits, lift_rate_limits)
+    application = main.build_application(with_updater=False)
+    await application.initialize()
+    await application.start()
+    for item in range(CONTENT_ITEMS):
+        await main.state_backend.add_media("photo", f"photo{item}")
+    api.calls.clear()
+    api.rejected.clear()
+
+    latencies = []
+    handled = []
+
+    async def handle(update: Update) -> None:
+        started = time.perf_counter()
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for event in sorted(events, key=lambda event: event["at"]):
+        delay = event["at"] - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if "fixture" in event:
+            fixture = event["fixture"]
+            api.set_status(fixture["chat_id"], fixture["user_id"], fixture["status"])
+        else:
+            handled.append(asyncio.create_task(handle(Update.de_json(event["update"], application.bot))))
+    await asyncio.gather(*handled)
+    seconds = time.perf_counter() - started
+    # Albums are stored and gates re-checked by jobs that run after the updates; count their calls too
+    await wait_until_idle(application, api)
+
+    await application.stop()
+    await application.shutdown()
+    api_calls = sum(api.calls.values())
+    return {
+        "updates": len(latencies),
+        "seconds": round(seconds, 3),
+        "throughput": round(len(latencies) / seconds, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "api_calls": api_calls,
+        "amplification": round(api_calls / max(1, len(latencies)), 3),
+        "rejected_429": sum(api.rejected.values()),
+        "calls_by_method": dict(sorted(api.calls.items())),
+    }
+
+
+def build_trace(profile: str, users: int, rate: float, seed: int = 0) -> list:
+    links = [main.make_link_token(str(item)) for item in range(1, CONTENT_ITEMS + 1)]
+    trace = TraceBuilder(links, rate, seed)
+    PROFILES[profile][2](trace, users)
+    return trace.events
+
+
+async def run(args) -> dict:
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, seed=args.seed)
+    api.start_thread()
+    results = {}
+    try:
+        with bot_settings(api) as limits:
+            if args.replay:
+                with open(args.replay, encoding="utf-8") as trace_file:
+                    events = [json.loads(line) for line in trace_file if line.strip()]
+                api.reset(member_ratio=args.member_ratio, error_rate=args.error_rate, enforce_limits=False)
+                results["replay"] = await run_scenario(api, events, limits, args.lift_rate_limits)
+            for profile in args.profiles or list(PROFILES):
+                settings = {"member_ratio": args.member_ratio, "error_rate": args.error_rate,
+                            "enforce_limits": False, **PROFILES[profile][1]}
+                api.reset(**settings)
+                events = build_trace(profile, args.users, args.rate, args.seed)
+                results[profile] = await run_scenario(api, events, limits,
+                                                      args.lift_rate_limits and not settings["enforce_limits"])
+    finally:
+        api.stop_thread()
+    return results
+
+
+def print_report(results: dict) -> None:
+    print_table([{"scenario": scenario, **result} for scenario, result in results.items()],
+                ("updates", "throughput", "p50_ms", "p99_ms", "api_calls", "amplification", "rejected_429"))
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Scenarios that got slower or make more API calls than the baseline"""
+    problems = []
+    for scenario, result in results.items():
+        before = baseline.get(scenario)
+        if before is None:
+            continue
+        if result["throughput"] < before["throughput"] * (1 - tolerance):
+            problems.append(f"{scenario}: throughput {result['throughput']}/s, was {before['throughput']}/s")
+        if result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            problems.append(f"{scenario}: p99 {result['p99_ms']}ms, was {before['p99_ms']}ms")
+        # Call counts are deterministic, any increase is a regression
+        if result["amplification"] > before["amplification"] + 0.001:
+            problems.append(f"{scenario}: {result['amplification']} API calls per update, "
+                            f"was {before['amplification']}")
+    return problems
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("profiles", nargs="*", metavar="profile",
+                        help=f"traffic profiles to run (default: all): {', '.join(PROFILES)}")
+    parser.add_argument("--users", type=int, default=500, help="users per profile")
+    parser.add_argument("--rate", type=float, default=1000, help="updates sent per second")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="extra random latency, up to this")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API calls answered with 429")
+    parser.add_argument("--member-ratio", type=float, default=1.0, help="share of users in the main channel")
+    parser.add_argument("--lift-rate-limits", action="store_true",
+                        help="lift the bot's outgoing rate limits (except in telegram_limits) to measure it alone")
+    parser.add_argument("--replay", help="JSONL trace of {\"at\": seconds, \"update\": {...}} events to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON, e.g. to use as a baseline")
+    parser.add_argument("--baseline", help="results JSON to compare against; exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed throughput/p99 change vs baseline")
+    args = parser.parse_args(argv)
+    unknown = set(args.profiles) - set(PROFILES)
+    if unknown:
+        parser.error(f"unknown profile: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            problems = regressions(results, json.load(baseline_file), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        sys.exit(1 if problems else 0)
@@ -0,0 +1,119 @@
+"""Handler throughput with logging off, written synchronously on the event loop, or through the queue
+
+Runs /start with a content link from new users (each logs several lines, membership ones sampled) with:
+  off    -- nothing below CRITICAL is logged
+  sync   -- a StreamHandler writing plain text on the event loop thread, like logging.basicConfig
+  queue  -- the bot's pipeline: records go through a bounded queue to a thread that formats JSON and writes
+Log output goes to a temporary file; --write-delay makes every write that much slower, like a busy disk
+or a slow log collector on the other end of a pipe. Reports updates/s, microseconds per update and
+dropped records. On a single core the queue's writer thread competes with the handlers for the CPU, so
+it pays off once writes block or there are cores to spare.
+
+    python benchmarks/logging_overhead.py --updates 20000 --repeats 3 --write-delay 0.0005
+"""
+import argparse
+import asyncio
+import logging
+import queue
+import tempfile
+import time
+from types import SimpleNamespace
+
+from harness import SimulatedBot, main, make_context, print_table, reset_state
+
+
+class SlowOutput:
+    """File wrapper whose writes block for `delay` seconds"""
+
+    def __init__(self, output, delay: float):
+        self.output = output
+        self.delay = delay
+
+    def write(self, text: str) -> int:
+        if self.delay:
+            time.sleep(self.delay)
+        return self.output.write(text)
+
+    def flush(self) -> None:
+        self.output.flush()
+
+
+def start_update(user_id: int):
+    user = SimpleNamespace(id=user_id, username=f"user{user_id}", first_name="User")
+    return SimpleNamespace(effective_user=user, effective_chat=SimpleNamespace(id=user_id, type="private"),
+                           callback_query=None)
+
+
+def install(mode: str, output):
+    """Point the root logger at the mode's handler; returns (handler, listener or None)"""
+    root = logging.getLogger()
+    if mode == "off":
+        root.setLevel(logging.CRITICAL)
+        return None, None
+    root.setLevel(logging.INFO)
+    stream_handler = logging.StreamHandler(output)
+    if mode == "sync":
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        root.addHandler(stream_handler)
+        return stream_handler, None
+    stream_handler.setFormatter(main.JsonFormatter())
+    queue_handler = main.DroppingQueueHandler(queue.Queue(main.LOG_BUFFER_SIZE))
+    listener = main.DrainingQueueListener(queue_handler.queue, stream_handler)
+    listener.start()
+    root.addHandler(queue_handler)
+    return queue_handler, listener
+
+
+async def handle_updates(updates: int, link: str) -> float:
+    reset_state()
+    await main.state_backend.add_media("photo", "photo-file")
+    context = make_context(SimulatedBot())
+    context.args = [link]
+    started = time.perf_counter()
+    for user_id in range(1, updates + 1):
+        await main.start(start_update(user_id), context)
+    return time.perf_counter() - started
+
+
+async def measure(mode: str, updates: int, repeats: int, write_delay: float) -> dict:
+    link = main.make_link_token("1")
+    root = logging.getLogger()
+    saved = (root.level, root.handlers[:])
+    best, dropped = float("inf"), 0
+    try:
+        for _ in range(repeats):
+            root.handlers = []
+            with tempfile.TemporaryFile("w", encoding="utf-8") as output:
+                handler, listener = install(mode, SlowOutput(output, write_delay))
+                best = min(best, await handle_updates(updates, link))
+                if listener is not None:
+                    # Writing what is still queued happens off the loop, it isn't part of the handler time
+                    listener.stop()
+                    dropped += handler.dropped
+    finally:
+        root.setLevel(saved[0])
+        root.handlers = saved[1]
+    return {
+        "logging": mode,
+        "updates": updates,
+        "updates_per_s": round(updates / best),
+        "us_per_update": round(best / updates * 1e6, 2),
+        "dropped": dropped,
+    }
+
+
+async def run(args) -> list:
+    return [await measure(mode, args.updates, args.repeats, args.write_delay) for mode in ("off", "sync", "queue")]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--write-delay", type=float, default=0.0, help="seconds each log write blocks")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    print_table(asyncio.run(run(parse_args())), ("updates", "updates_per_s", "us_per_update", "dropped"),
+                first="logging")
@@ -0,0 +1,85 @@
+"""Startup time and lookup latency of the SQLite media store with many stored items
+
+Fills a database with --items media entries, then measures opening it the way a worker does at startup,
+get_media latency for random IDs and group-committed add_media throughput. For comparison it also times
+loading the whole table into a dict, which is what a store that keeps its history in RAM pays at startup.
+
+    python benchmarks/media_store.py --items 1000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from harness import main, percentile, print_table, timed
+
+
+def populate(path: str, items: int) -> float:
+    backend = main.SQLiteBackend(path)
+    started = time.perf_counter()
+    with backend.conn:
+        backend.conn.execute("BEGIN")
+        backend.conn.executemany(
+            "INSERT INTO media (media_type, file_id, created_at, policy) VALUES (?, ?, ?, ?)",
+            (("photo", f"file{item}", time.time(), None) for item in range(items))
+        )
+    backend.conn.close()
+    return time.perf_counter() - started
+
+
+async def measure(path: str, items: int, lookups: int, writes: int, seed: int) -> list:
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    backend = main.SQLiteBackend(path)
+    count = await backend.media_count()
+    startup = time.perf_counter() - started
+    assert count == items
+
+    latencies = []
+    for _ in range(lookups):
+        await timed(backend.get_media(str(rng.randint(1, items))), latencies)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(backend.add_media("photo", f"new{item}") for item in range(writes)))
+    write_seconds = time.perf_counter() - started
+    await backend.close()
+
+    started = time.perf_counter()
+    conn = main.sqlite3.connect(path)
+    in_memory = {str(row[0]): row[1:] for row in conn.execute("SELECT id, media_type, file_id, policy FROM media")}
+    full_load = time.perf_counter() - started
+    conn.close()
+    dict_latencies = []
+    for _ in range(lookups):
+        started = time.perf_counter()
+        in_memory.get(str(rng.randint(1, items)))
+        dict_latencies.append(time.perf_counter() - started)
+
+    return [
+        {"store": "sqlite", "startup_ms": round(startup * 1000, 2),
+         "p50_us": round(percentile(latencies, 0.50) * 1e6, 1), "p99_us": round(percentile(latencies, 0.99) * 1e6, 1),
+         "writes_per_s": round(writes / write_seconds)},
+        {"store": "dict (full load)", "startup_ms": round(full_load * 1000, 2),
+         "p50_us": round(percentile(dict_latencies, 0.50) * 1e6, 2),
+         "p99_us": round(percentile(dict_latencies, 0.99) * 1e6, 2), "writes_per_s": "-"},
+    ]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1_000_000, help="media entries stored before measuring")
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--writes", type=int, default=10_000, help="concurrent add_media calls")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "media.db")
+        print(f"Stored {args.items} items in {populate(path, args.items):.1f}s")
+        print_table(asyncio.run(measure(path, args.items, args.lookups, args.writes, args.seed)),
+                    ("startup_ms", "p50_us", "p99_us", "writes_per_s"), first="store")
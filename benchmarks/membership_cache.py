@@ -0,0 +1,104 @@
+"""Memory and lookup cost of MembershipCache against the plain dict it replaced, at 1M users
+
+The old cache was {f"user_{user_id}": (cached_at, is_member)} checked against one TTL on every lookup.
+Memory is measured with tracemalloc after filling each cache; inserts and random lookups are timed per call.
+A third row fills MembershipCache sized by CACHE_MAX_SIZE to show where eviction caps it.
+
+    python benchmarks/membership_cache.py --users 1000000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from harness import MAIN_CHANNEL_ID, main, print_table
+
+CACHE_DURATION = 30
+
+
+class OldDictCache:
+    """The dict cache as it was, behind the same get/set calls"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, user_id: int):
+        cache_key = f"user_{user_id}"
+        if cache_key in self.entries:
+            cached_time, cached_result = self.entries[cache_key]
+            if time.time() - cached_time < CACHE_DURATION:
+                return cached_result
+        return None
+
+    def set(self, user_id: int, is_member: bool) -> None:
+        self.entries[f"user_{user_id}"] = (time.time(), is_member)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class BoundedCache:
+    def __init__(self, max_size: int):
+        self.cache = main.MembershipCache(max_size, main.CACHE_DURATION, main.NEGATIVE_CACHE_DURATION)
+
+    def get(self, user_id: int):
+        return self.cache.get((MAIN_CHANNEL_ID, user_id))
+
+    def set(self, user_id: int, is_member: bool) -> None:
+        self.cache.set((MAIN_CHANNEL_ID, user_id), is_member)
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+
+def fill(cache, users: int) -> float:
+    started = time.perf_counter()
+    for user_id in range(users):
+        cache.set(user_id, user_id % 3 != 0)
+    return time.perf_counter() - started
+
+
+def measure(name: str, make_cache, users: int, lookups: int, rng: random.Random) -> dict:
+    # Memory of one filled cache; timings on another, as tracing slows allocation down
+    tracemalloc.start()
+    traced = make_cache()
+    fill(traced, users)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del traced
+
+    cache = make_cache()
+    insert_seconds = fill(cache, users)
+    user_ids = [rng.randrange(users) for _ in range(lookups)]
+    started = time.perf_counter()
+    for user_id in user_ids:
+        cache.get(user_id)
+    lookup_seconds = time.perf_counter() - started
+    return {
+        "cache": name,
+        "entries": len(cache),
+        "memory_mb": round(memory / 2**20, 1),
+        "bytes_per_user": round(memory / users),
+        "insert_ns": round(insert_seconds / users * 1e9),
+        "lookup_ns": round(lookup_seconds / lookups * 1e9),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    rng = random.Random(args.seed)
+    rows = [
+        measure("dict (old)", OldDictCache, args.users, args.lookups, rng),
+        measure("MembershipCache", lambda: BoundedCache(args.users), args.users, args.lookups, rng),
+        measure(f"MembershipCache({main.CACHE_MAX_SIZE})", lambda: BoundedCache(main.CACHE_MAX_SIZE), args.users,
+                args.lookups, rng),
+    ]
+    print_table(rows, ("entries", "memory_mb", "bytes_per_user", "insert_ns", "lookup_ns"), first="cache")
@@ -0,0 +1,96 @@
+"""Replay a join/leave stream with gate checks, answering from the membership index vs polling getChatMember
+
+In "index" mode the bot receives the main channel's chat_member updates; in "polling" mode it doesn't and
+relies on getChatMember plus the membership cache. Reports gate latency, Bot API calls (and how many the
+index avoided) and stale answers, i.e. gate decisions that disagree with the user's status at that moment.
+
+    python benchmarks/membership_index.py --users 5000 --events 20000 --latency 0.02
+"""
+import argparse
+import asyncio
+import random
+from types import SimpleNamespace
+
+from harness import MAIN_CHANNEL_ID, SimulatedBot, main, make_context, percentile, print_table, reset_state, timed
+
+
+def build_stream(users: int, events: int, update_share: float, member_ratio: float, seed: int) -> tuple:
+    """Initial statuses and a list of ("update", user_id, status) / ("check", user_id) events"""
+    rng = random.Random(seed)
+    initial = {user_id: "member" if rng.random() < member_ratio else "left" for user_id in range(1, users + 1)}
+    stream = []
+    for _ in range(events):
+        user_id = rng.randint(1, users)
+        if rng.random() < update_share:
+            stream.append(("update", user_id, rng.choice(("member", "left"))))
+        else:
+            stream.append(("check", user_id))
+    return initial, stream
+
+
+def chat_member_update(user_id: int, status: str):
+    chat = SimpleNamespace(id=MAIN_CHANNEL_ID, username=None)
+    member = SimpleNamespace(user=SimpleNamespace(id=user_id), status=status)
+    return SimpleNamespace(chat_member=SimpleNamespace(chat=chat, new_chat_member=member))
+
+
+async def replay(mode: str, initial: dict, stream: list, latency: float, concurrency: int) -> dict:
+    reset_state()
+    bot = SimulatedBot(latency)
+    bot.statuses = {(MAIN_CHANNEL_ID, user_id): status for user_id, status in initial.items()}
+    context = make_context(bot)
+    latencies = []
+    stale = 0
+
+    async def check(user_id: int, truth: bool) -> None:
+        nonlocal stale
+        if await timed(main.check_gate(user_id, context), latencies) != truth:
+            stale += 1
+
+    for i in range(0, len(stream), concurrency):
+        tasks = []
+        for event in stream[i:i + concurrency]:
+            user_id = event[1]
+            if event[0] == "update":
+                bot.statuses[(MAIN_CHANNEL_ID, user_id)] = event[2]
+                if mode == "index":
+                    await main.track_chat_member(chat_member_update(user_id, event[2]), context)
+            else:
+                truth = bot.statuses[(MAIN_CHANNEL_ID, user_id)] in main.MEMBER_STATUSES
+                tasks.append(asyncio.create_task(check(user_id, truth)))
+        await asyncio.gather(*tasks)
+
+    return {
+        "mode": mode,
+        "checks": len(latencies),
+        "api_calls": bot.calls["get_chat_member"],
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "stale": stale,
+    }
+
+
+async def run(args) -> list:
+    initial, stream = build_stream(args.users, args.events, args.update_share, args.member_ratio, args.seed)
+    results = [await replay(mode, initial, stream, args.latency, args.concurrency) for mode in ("polling", "index")]
+    polling_calls = results[0]["api_calls"]
+    for result in results:
+        result["calls_avoided"] = polling_calls - result["api_calls"]
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=20000, help="join/leave updates and gate checks in total")
+    parser.add_argument("--update-share", type=float, default=0.2, help="share of events that are join/leave")
+    parser.add_argument("--member-ratio", type=float, default=0.7, help="share of users in the channel at start")
+    parser.add_argument("--latency", type=float, default=0.02, help="getChatMember latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=100, help="events in flight at once")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    print_table(asyncio.run(run(parse_args())),
+                ("checks", "api_calls", "calls_avoided", "p50_ms", "p99_ms", "stale"), first="mode")
@@ -0,0 +1,76 @@
+"""Latency of a 5-channel gating policy, checked concurrently by check_gate vs one channel after another
+
+Every check is for a new user, so each channel costs one getChatMember call of --latency seconds. The
+sequential baseline stops at the first channel that decides the outcome, just as check_gate does; the
+concurrent checks still make the remaining calls in the background, which is reported as calls per check.
+
+    python benchmarks/multi_channel_gate.py --users 20 --latency 0.05
+"""
+import argparse
+import asyncio
+
+from harness import SimulatedBot, main, make_context, percentile, print_table, reset_state, timed
+
+CHANNELS = ("@study_notes", "@study_archive", "@study_exams", "@study_videos", "@study_extra")
+
+# name: (require_all, channels the users are not in)
+CASES = {
+    "all-of, in all": (True, ()),
+    "all-of, not in 1st": (True, CHANNELS[:1]),
+    "all-of, not in 5th": (True, CHANNELS[4:]),
+    "any-of, in 5th only": (False, CHANNELS[:4]),
+}
+
+
+async def sequential_gate(user_id: int, context, gate: tuple):
+    """check_gate without the concurrency: one membership check at a time, stopping once the outcome is known"""
+    require_all, channels = gate
+    inconclusive = False
+    for channel in main.gate_targets(channels):
+        is_member = await main.check_membership_with_fallback(user_id, context, channel=channel)
+        if is_member is None:
+            inconclusive = True
+        elif is_member != require_all:
+            return is_member
+    return None if inconclusive else require_all
+
+
+async def measure(mode: str, check, case: str, users: int, latency: float) -> dict:
+    require_all, missing = CASES[case]
+    reset_state()
+    bot = SimulatedBot(latency)
+    context = make_context(bot)
+    gate = (require_all, CHANNELS)
+    latencies = []
+    for user_id in range(1, users + 1):
+        for channel in missing:
+            bot.statuses[(channel, user_id)] = "left"
+        await timed(check(user_id, context, gate), latencies)
+    # Let the checks check_gate left running finish so their calls are counted
+    await asyncio.sleep(latency * 2)
+    return {
+        "case": case,
+        "mode": mode,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "calls_per_check": round(bot.calls["get_chat_member"] / users, 2),
+    }
+
+
+async def run(args) -> list:
+    rows = []
+    for case in CASES:
+        for mode, check in (("sequential", sequential_gate), ("concurrent", main.check_gate)):
+            rows.append(await measure(mode, check, case, args.users, args.latency))
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="gate checks per case and mode")
+    parser.add_argument("--latency", type=float, default=0.05, help="getChatMember latency in seconds")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    print_table(asyncio.run(run(parse_args())), ("mode", "p50_ms", "p99_ms", "calls_per_check"), first="case")
@@ -0,0 +1,100 @@
+"""Startup cost of loading and checking the configuration, and of the channel checks against the Bot API
+
+Times, each in a fresh interpreter: importing python-telegram-bot alone, importing main.py with a valid
+configuration and importing it with an invalid one, which exits before anything is built. In-process it
+times load_config (which validates) and the startup channel checks (getChat and getChatAdministrators
+for both channels) against the fake Bot API, run concurrently as verify_channels does or one by one.
+
+    python benchmarks/startup.py --repeats 5 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import timeit
+
+from fake_bot_api import FakeBotAPI
+from harness import main, print_table
+from telegram import Bot
+
+BOT_DIR = os.path.join(os.path.dirname(__file__), "..", "telegram_study_bot")
+
+
+def time_process(code: str, repeats: int, env: dict = None) -> tuple:
+    """Best wall time of running `code` in a new interpreter, and its exit code"""
+    best, returncode = float("inf"), None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], cwd=BOT_DIR, capture_output=True,
+                                env={**os.environ, **(env or {})})
+        best = min(best, time.perf_counter() - started)
+        returncode = result.returncode
+    return best, returncode
+
+
+def process_rows(repeats: int) -> list:
+    cases = [
+        ("import telegram only", "import telegram.ext", None),
+        ("import main, valid", "import main", None),
+        ("import main, invalid", "import main", {"STUDY_BOT_LOG_LEVEL": "LOUD", "STUDY_BOT_LANGUAGE": "xx"}),
+    ]
+    rows = []
+    for name, code, env in cases:
+        seconds, returncode = time_process(code, repeats, env)
+        rows.append({"step": name, "ms": round(seconds * 1000, 1), "exit_code": returncode})
+    return rows
+
+
+def load_config_row(number: int) -> dict:
+    saved = {name: getattr(main, name) for name in main.SETTINGS}
+    missing = os.path.join(os.path.dirname(__file__), "missing-config.json")
+    try:
+        seconds = min(timeit.repeat(lambda: main.load_config(missing, os.environ), number=number, repeat=5)) / number
+    finally:
+        for name, value in saved.items():
+            setattr(main, name, value)
+    return {"step": "load_config + validation", "ms": round(seconds * 1000, 3), "exit_code": "-"}
+
+
+async def channel_rows(latency: float, repeats: int) -> list:
+    api = FakeBotAPI(latency=latency)
+    api.start_thread()
+    main_channel_id = main.MAIN_CHANNEL_ID
+    bot = Bot(main.BOT_TOKEN, base_url=api.base_url)
+    try:
+        await bot.initialize()
+
+        async def one_by_one():
+            for channel_id in (main.MAIN_CHANNEL_ID, main.CONTENT_CHANNEL_ID):
+                await main.check_channel_access(bot, channel_id)
+
+        rows = []
+        for name, check in (("channel checks, concurrent", lambda: main.verify_channels(bot)),
+                            ("channel checks, one by one", one_by_one)):
+            best = float("inf")
+            for _ in range(repeats):
+                started = time.perf_counter()
+                await check()
+                best = min(best, time.perf_counter() - started)
+            rows.append({"step": name, "ms": round(best * 1000, 1), "exit_code": "-"})
+        return rows
+    finally:
+        main.MAIN_CHANNEL_ID = main_channel_id
+        await bot.shutdown()
+        api.stop_thread()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake API latency in seconds")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    rows = process_rows(args.repeats) + [load_config_row(1000)]
+    rows += asyncio.run(channel_rows(args.latency, args.repeats))
+    print_table(rows, ("ms", "exit_code"), first="step")
@@ -0,0 +1,65 @@
+"""Updates per second while many users are stuck in the membership re-check path
+
+A share of the users get an inconclusive getChatMember answer (400 Bad Request) every time, so each of
+their /start requests leaves background re-check jobs behind. The re-check delays are shortened so the
+jobs fire while the rest of the traffic is still coming in. Handlers never wait for a re-check, so
+throughput and latency should stay close to the run without stuck users, until the extra re-check calls
+use up the CPU (the fake server runs in the same process). Like loadtest.py, the bot keeps its
+configured outgoing rate limits unless --lift-rate-limits is given.
+
+    python benchmarks/stuck_rechecks.py --users 400 --rate 40 --stuck 0 0.5 0.9 --lift-rate-limits
+"""
+import argparse
+import asyncio
+
+from loadtest import TraceBuilder, bot_settings, build_trace, main, run_scenario
+from fake_bot_api import FakeBotAPI
+from harness import print_table
+
+
+def stuck_trace(users: int, stuck_share: float, rate: float, seed: int) -> list:
+    events = build_trace("member_start", users, rate, seed)
+    trace = TraceBuilder([], rate, seed)
+    for user_id in range(1, int(users * stuck_share) + 1):
+        trace.fixture(user_id, "inaccessible", at=0.0)
+    return trace.events + events
+
+
+async def run(args) -> list:
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, seed=args.seed)
+    api.start_thread()
+    saved_delays = main.MEMBERSHIP_RECHECK_DELAYS
+    main.MEMBERSHIP_RECHECK_DELAYS = tuple(args.recheck_delays)
+    rows = []
+    try:
+        with bot_settings(api) as limits:
+            for share in args.stuck:
+                api.reset()
+                result = await run_scenario(api, stuck_trace(args.users, share, args.rate, args.seed), limits,
+                                            args.lift_rate_limits)
+                rows.append({"stuck_share": share, **result, "inconclusive": api.failed["getChatMember"]})
+    finally:
+        main.MEMBERSHIP_RECHECK_DELAYS = saved_delays
+        api.stop_thread()
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=400)
+    parser.add_argument("--stuck", type=float, nargs="+", default=[0.0, 0.5, 0.9],
+                        help="shares of users whose membership check is always inconclusive")
+    parser.add_argument("--rate", type=float, default=40, help="updates sent per second")
+    parser.add_argument("--recheck-delays", type=float, nargs="+", default=[0.5, 1, 2],
+                        help="MEMBERSHIP_RECHECK_DELAYS for the run")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--lift-rate-limits", action="store_true", help="lift the bot's outgoing rate limits")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    print_table(asyncio.run(run(parse_args())),
+                ("updates", "throughput", "p50_ms", "p99_ms", "api_calls", "inconclusive"),
+                first="stuck_share")
@@ -0,0 +1,129 @@
+"""Update delivery latency with a webhook vs long-polling getUpdates, against the fake Bot API
+
+The same /start updates go to the bot both ways: posted to serve_webhook's endpoint like Telegram
+does, or queued in the fake API for poll_updates to fetch. Reports the delay until the update
+reaches the bot (delivery), until its handler finished (handled), the webhook POST round trip and
+the Bot API calls each mode needed.
+
+    python benchmarks/webhook_vs_polling.py --updates 500 --rate 50
+"""
+import argparse
+import asyncio
+import json
+import socket
+import time
+
+from fake_bot_api import FakeBotAPI
+from harness import main, percentile, print_table
+from telegram import Update
+
+SECRET = "benchmark-secret"
+
+
+def start_update(update_id: int) -> dict:
+    user = {"id": update_id, "is_bot": False, "first_name": f"User{update_id}"}
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": "/start",
+        "chat": {"id": update_id, "type": "private"}, "from": user,
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    }}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def post(port: int, data: bytes) -> str:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"POST {main.WEBHOOK_PATH} HTTP/1.1\r\nHost: bot\r\nContent-Type: application/json\r\n"
+        f"X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    writer.close()
+    return status_line.decode()
+
+
+async def measure(mode: str, api: FakeBotAPI, updates: int, rate: float) -> dict:
+    application = main.build_application(with_updater=False)
+    await application.initialize()
+    await application.start()
+    api.calls.clear()
+    sent_at, delivered, handled, posts = {}, [], [], []
+    handlers = []
+
+    async def handle(update_id: int, update: Update) -> None:
+        await application.update_processor.process_update(update, application.process_update(update))
+        handled.append(time.perf_counter() - sent_at[update_id])
+
+    async def dispatch(data: dict) -> None:
+        delivered.append(time.perf_counter() - sent_at[data["update_id"]])
+        handlers.append(asyncio.create_task(handle(data["update_id"], Update.de_json(data, application.bot))))
+
+    async def send_post(update_id: int, data: bytes) -> None:
+        await post(main.WEBHOOK_PORT, data)
+        posts.append(time.perf_counter() - sent_at[update_id])
+
+    stop_event = asyncio.Event()
+    if mode == "webhook":
+        server = asyncio.create_task(main.serve_webhook(application.bot, dispatch, stop_event))
+    else:
+        server = asyncio.create_task(main.poll_updates(application.bot, dispatch, stop_event))
+    await asyncio.sleep(0.5)  # webhook listening / first getUpdates waiting
+
+    requests = []
+    for update_id in range(1, updates + 1):
+        update = start_update(update_id)
+        sent_at[update_id] = time.perf_counter()
+        if mode == "webhook":
+            requests.append(asyncio.create_task(send_post(update_id, json.dumps(update).encode())))
+        else:
+            api.push_update(update)
+        await asyncio.sleep(1 / rate)
+    while len(handled) < updates:
+        await asyncio.sleep(0.05)
+    await asyncio.gather(*requests, *handlers)
+
+    stop_event.set()
+    await server
+    await application.stop()
+    await application.shutdown()
+    return {
+        "mode": mode,
+        "updates": len(handled),
+        "delivery_p50_ms": round(percentile(delivered, 0.50) * 1000, 2),
+        "delivery_p99_ms": round(percentile(delivered, 0.99) * 1000, 2),
+        "handled_p99_ms": round(percentile(handled, 0.99) * 1000, 2),
+        "post_p99_ms": round(percentile(posts, 0.99) * 1000, 2) if posts else "-",
+        "api_calls": sum(api.calls.values()),
+    }
+
+
+async def run(args) -> list:
+    api = FakeBotAPI(latency=args.latency)
+    api.start_thread()
+    saved = (main.BOT_API_BASE_URL, main.WEBHOOK_LISTEN, main.WEBHOOK_PORT, main.WEBHOOK_SECRET)
+    main.BOT_API_BASE_URL = api.base_url
+    main.WEBHOOK_LISTEN, main.WEBHOOK_PORT, main.WEBHOOK_SECRET = "127.0.0.1", free_port(), SECRET
+    try:
+        return [await measure(mode, api, args.updates, args.rate) for mode in ("webhook", "polling")]
+    finally:
+        main.BOT_API_BASE_URL, main.WEBHOOK_LISTEN, main.WEBHOOK_PORT, main.WEBHOOK_SECRET = saved
+        api.stop_thread()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=50, help="updates sent per second")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API latency in seconds")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    print_table(asyncio.run(run(parse_args())),
+                ("updates", "delivery_p50_ms", "delivery_p99_ms", "handled_p99_ms", "post_p99_ms", "api_calls"),
+                first="mode")
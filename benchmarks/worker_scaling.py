@@ -0,0 +1,109 @@
+"""Throughput of the bot run as 1..N worker processes, against the fake Bot API
+
+Starts main.py as a separate process for each worker count, with the SQLite backend and the fake API
+serving /start updates through getUpdates. Every update is a member opening a content link, so each one
+costs a getChatMember and a sendPhoto. The outgoing rate limits are lifted, so this measures the bot's
+own processing. Even on one core, N workers can beat one: a single process with hundreds of requests in
+flight spends much of its time in the HTTP client's connection-pool bookkeeping, which sharding splits up.
+
+    python benchmarks/worker_scaling.py --workers 1 2 4 --updates 2000
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_bot_api import FakeBotAPI
+from harness import main, print_table
+
+MAIN_PY = os.path.join(os.path.dirname(__file__), "..", "telegram_study_bot", "main.py")
+CONTENT_ITEMS = 50
+
+
+def start_update(update_id: int, link: str) -> dict:
+    user = {"id": update_id, "is_bot": False, "first_name": f"User{update_id}"}
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": f"/start {link}",
+        "chat": {"id": update_id, "type": "private"}, "from": user,
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    }}
+
+
+async def wait_for(condition, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("the bot did not finish in time")
+        await asyncio.sleep(0.02)
+
+
+async def measure(api: FakeBotAPI, workers: int, updates: int, directory: str) -> dict:
+    database = os.path.join(directory, f"media-{workers}.db")
+    backend = main.SQLiteBackend(database)
+    links = [main.make_link_token(await backend.add_media("photo", f"photo{item}")) for item in range(CONTENT_ITEMS)]
+    await backend.close()
+
+    api.reset()
+    env = {
+        **os.environ,
+        "STUDY_BOT_BOT_API_BASE_URL": api.base_url,
+        "STUDY_BOT_WORKER_COUNT": str(workers),
+        "STUDY_BOT_STATE_BACKEND": "sqlite",
+        "STUDY_BOT_MEDIA_DB_PATH": database,
+        "STUDY_BOT_METRICS_PORT": "0",
+        "STUDY_BOT_GLOBAL_RATE_LIMIT": "1000000",
+        "STUDY_BOT_PER_CHAT_RATE_LIMIT": "1000000",
+        "STUDY_BOT_PER_CHAT_BURST": "1000000",
+    }
+    bot = subprocess.Popen([sys.executable, MAIN_PY], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # The bot is ready once it long-polls for updates
+        await wait_for(lambda: api.calls["getUpdates"] or bot.poll() is not None, 60)
+        if bot.poll() is not None:
+            raise RuntimeError(f"the bot exited with code {bot.returncode}")
+        started = time.perf_counter()
+        for update_id in range(1, updates + 1):
+            api.push_update(start_update(update_id, links[update_id % CONTENT_ITEMS]))
+        await wait_for(lambda: api.calls["sendPhoto"] >= updates, 300)
+        seconds = time.perf_counter() - started
+    finally:
+        bot.terminate()
+        bot.wait(30)
+    return {
+        "workers": workers,
+        "updates": updates,
+        "seconds": round(seconds, 2),
+        "throughput": round(updates / seconds, 1),
+        "speedup": None,
+        "api_calls": sum(api.calls.values()),
+    }
+
+
+async def run(args) -> list:
+    api = FakeBotAPI(latency=args.latency)
+    api.start_thread()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            rows = [await measure(api, workers, args.updates, directory) for workers in args.workers]
+    finally:
+        api.stop_thread()
+    for row in rows:
+        row["speedup"] = round(row["throughput"] / rows[0]["throughput"], 2)
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to compare")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API latency in seconds")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    print(f"{os.cpu_count()} CPU cores")
+    print_table(asyncio.run(run(parse_args())), ("updates", "seconds", "throughput", "speedup", "api_calls"),
+                first="workers")
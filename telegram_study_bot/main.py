@@ -1,123 +1,1464 @@
 import logging
+import logging.handlers
 import asyncio
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters, CallbackQueryHandler
-from telegram.error import TelegramError, BadRequest, Forbidden
+import atexit
+import base64
+import hashlib
+import queue
+import random
+import bisect
+import functools
+import heapq
+import hmac
+import itertools
+import json
+import os
+import re
+import signal
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from datetime import timedelta
+from typing import Optional
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, InputMediaVideo
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters, CallbackQueryHandler, \
+    ChatMemberHandler, BaseRateLimiter
+from telegram.error import TelegramError, BadRequest, Forbidden, RetryAfter
+from telegram.helpers import escape_markdown
 import time
+import multiprocessing
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
 
+# Settings. Each one can be overridden from the JSON config file (STUDY_BOT_CONFIG, default config.json)
+# or from an environment variable of the same name prefixed with STUDY_BOT_, e.g. STUDY_BOT_BOT_TOKEN
 BOT_TOKEN = "your "
-MAIN_CHANNEL_ID = "your"  # Using username instead of ID for better compatibility
+MAIN_CHANNEL_ID = "your"  # ID (-100...) or @username; a username is resolved to the numeric ID at startup
 CONTENT_CHANNEL_ID = -100123444555  #  content channel ID it will start with -100 always 
 MAIN_CHANNEL_USERNAME = "@abc"
 BOT_USERNAME = "ya"  # Your bot username
-
-media_store = {}
+VERIFY_CHANNELS_ON_STARTUP = True  # check both channels and the bot's admin rights before serving
+# Bot API endpoint; point these at a local Bot API server (or a fake one for load tests)
+BOT_API_BASE_URL = "https://api.telegram.org/bot"
+BOT_API_FILE_URL = "https://api.telegram.org/file/bot"
+MEDIA_DB_PATH = "media_store.db"  # SQLite file that keeps content links working across restarts
+GROUP_COMMIT_DELAY = 0.05  # seconds to wait for more media before committing a batch
+# Per-content delivery stats (/stats), counted in memory and written to their own SQLite file in batches
+ANALYTICS_DB_PATH = "analytics.db"
+ANALYTICS_FLUSH_INTERVAL = 10  # seconds between batch writes
+ANALYTICS_MAX_PENDING_JOINS = 100_000  # denied users remembered for time-to-join, oldest are forgotten
+
+# Serving mode: "polling" or "webhook" (webhook lets several instances sit behind a load balancer)
+BOT_MODE = "polling"
+WEBHOOK_URL = "https://example.com/telegram"  # public URL Telegram posts updates to
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET = "change-me"  # sent back by Telegram in X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_BODY_SIZE = 1024 * 1024  # bytes, updates are only a few KB
+WEBHOOK_READ_TIMEOUT = 10  # seconds to receive a full request
+
+# Shared state: "memory" (single process only), "sqlite" (workers on one machine) or "redis" (any machine)
+STATE_BACKEND = "sqlite"
+REDIS_URL = "redis://localhost:6379/0"
+# Worker processes; updates are routed by user_id so each user is always served by the same worker
+WORKER_COUNT = 1
+MAX_CONCURRENT_UPDATES = 256  # updates processed in parallel
+# Membership pre-warming of recent requesters (/prewarm and a repeating job)
+ADMIN_USER_IDS = set()  # user IDs allowed to run /prewarm and /stats
+PREWARM_MAX_USERS = 50_000  # most recent requesters to warm
+PREWARM_CONCURRENCY = 20  # membership checks in flight at once; the rate limiter paces them further
+PREWARM_INTERVAL = 0  # seconds between scheduled pre-warms (0 disables the job)
+PREWARM_PROGRESS_INTERVAL = 10  # seconds between progress message edits
+# Prometheus-style /metrics endpoint (0 disables it); worker N listens on METRICS_PORT + N
+METRICS_LISTEN = "127.0.0.1"
+METRICS_PORT = 9100
+
+LOG_LEVEL = "INFO"
+LOG_JSON = True  # one JSON object per line; set False for plain text
+LOG_BUFFER_SIZE = 10_000  # records waiting to be written; more are dropped instead of blocking
+# Share of membership-check records kept per level; these lines are logged several times per request
+MEMBERSHIP_LOG_SAMPLE_RATES = {"DEBUG": 0.0, "INFO": 0.1}
+
+# Outgoing Bot API requests
+GLOBAL_RATE_LIMIT = 30  # requests per second across all chats
+PER_CHAT_RATE_LIMIT = 1  # messages per second to the same chat
+PER_CHAT_BURST = 3
+MAX_RATE_LIMIT_RETRIES = 3
+# Flood protection for content requests and gate buttons, checked before any Bot API call
+FLOOD_MAX_REQUESTS = 5  # per user within FLOOD_WINDOW
+FLOOD_WINDOW = 30  # seconds
+DEDUP_WINDOW = 5  # seconds in which an identical request (same link or button) is ignored
 # Cache to store recent membership checks to avoid API spam
-membership_cache = {}
-CACHE_DURATION = 30  # seconds
+CACHE_DURATION = 30  # seconds, for users confirmed as members
+NEGATIVE_CACHE_DURATION = 10  # seconds, short so users who just joined are re-checked soon
+CACHE_MAX_SIZE = 100_000  # least recently used entries are evicted beyond this
+CACHE_PRUNE_INTERVAL = 60  # seconds between background sweeps of expired entries
+MEMBERSHIP_INDEX_MAX_SIZE = 1_000_000  # users whose join/leave updates are kept; least recently used are dropped
+# Background re-checks after a failed check; Telegram can lag a few seconds behind a join
+MEMBERSHIP_RECHECK_DELAYS = (3, 5, 8)  # seconds before each attempt
+# Albums arrive as one message per item; wait this long for the rest before storing the bundle
+ALBUM_COLLECT_DELAY = 2  # seconds
+
+LANGUAGE = "en"  # key into TEMPLATES
+SUPPORT_URL = "https://t.me/YOURSUPPORTUSERNAME"  # Replace with your support
+KEYBOARD_CACHE_SIZE = 4096  # gate keyboards kept per (kind, link)
+LINK_SECRET = "change-me-too"  # HMAC key for content links; changing it invalidates every posted link
+LINK_TTL = 0  # seconds a new content link stays valid (0 = never expires)
+LINK_SIGNATURE_BYTES = 12  # truncated HMAC-SHA256 (8-24), keeps links and buttons under Telegram's 64-byte limits
+ACCEPT_LEGACY_LINKS = True  # also accept old unsigned img<ID> links; disable to stop ID enumeration
+
+SETTINGS = [name for name in globals() if name.isupper()]
+CONFIG_FILE = os.environ.get("STUDY_BOT_CONFIG", "config.json")
+ENV_PREFIX = "STUDY_BOT_"
+
+
+def parse_setting(value, default):
+    """Convert an override to the type of the setting's default; environment values are always strings"""
+    if isinstance(default, bool):
+        if isinstance(value, str):
+            if value.lower() not in ("1", "true", "yes", "on", "0", "false", "no", "off"):
+                raise ValueError(f"expected true or false, got {value!r}")
+            return value.lower() in ("1", "true", "yes", "on")
+        return bool(value)
+    if isinstance(default, (int, float)):
+        return type(default)(value)
+    if isinstance(default, (set, tuple)):
+        if isinstance(value, str):
+            value = [item for item in value.replace(" ", "").split(",") if item]
+        return type(default)(int(item) for item in value)
+    if isinstance(default, dict):
+        if isinstance(value, str):
+            value = json.loads(value)
+        return {key: float(rate) for key, rate in value.items()}
+    return value if isinstance(value, str) else str(value)
+
+
+def load_config(path: str = CONFIG_FILE, environ=os.environ):
+    """Apply overrides from the config file, then from the environment, to the settings above"""
+    overrides = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as config_file:
+            overrides.update(json.load(config_file))
+    unknown = sorted(set(overrides) - set(SETTINGS))
+    if unknown:
+        raise ValueError(f"Unknown settings in {path}: {', '.join(unknown)}")
+    for name in SETTINGS:
+        if ENV_PREFIX + name in environ:
+            overrides[name] = environ[ENV_PREFIX + name]
+
+    settings = globals()
+    for name, value in overrides.items():
+        try:
+            settings[name] = parse_setting(value, settings[name])
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid value for {name}: {e}") from None
+
+    global MAIN_CHANNEL_ID
+    if isinstance(MAIN_CHANNEL_ID, str) and MAIN_CHANNEL_ID.lstrip("-").isdigit():
+        MAIN_CHANNEL_ID = int(MAIN_CHANNEL_ID)
+
+    # Checked before anything (loggers, backends, texts) is built from the settings
+    errors = validate_config()
+    if errors:
+        raise ValueError("Invalid configuration:\n" + "\n".join(f"  - {error}" for error in errors))
+
+
+# Used by validate_config, which runs at import as soon as the settings are loaded
+CALLBACK_DATA_LIMIT = 64  # bytes of callback_data per inline button (Telegram's maximum)
+
+# User-facing texts per language; {channel} is filled in once at startup, {user_id} per message
+TEMPLATES = {
+    "en": {
+        "access_denied": (
+            "🚫 **Access Denied!**\n\n"
+            "You need to join {channel} first to access this content.\n\n"
+            "**Steps:**\n"
+            "1️⃣ Click 'Join Channel'\n"
+            "2️⃣ Join the channel\n"
+            "3️⃣ Wait 10 seconds\n"
+            "4️⃣ Click 'I Joined, Check Again'\n\n"
+            "⚠️ If still not working, try 'Force Refresh'"
+        ),
+        "welcome": (
+            "👋 **Welcome to Study Material Bot!**\n\n"
+            "Send me a valid content link to access media files.\n\n"
+            "Make sure you're a member of {channel} first!\n\n"
+            "🔗 Tap a content link posted in the channel to get your files."
+        ),
+        "link_invalid": "❌ This link is invalid or has expired. Please get a new link from the channel.",
+        "checking": "🔄 **Checking membership...**\n\nPlease wait while we verify your status...",
+        "check_success": "✅ **Success!** Membership verified! Sending your content now...",
+        "force_refreshing": "🔄 **Force Refreshing...**\n\nClearing cache and doing deep verification...",
+        "force_success": "🎉 **Force Refresh Successful!** Sending content...",
+        "still_not_member": (
+            "❌ **Still Not Detected as Member**\n\n"
+            "This can happen due to Telegram's caching. Please:\n\n"
+            "1️⃣ Make sure you actually joined {channel}\n"
+            "2️⃣ Wait 30 seconds after joining\n"
+            "3️⃣ Try 'Force Refresh' button\n"
+            "4️⃣ If still failing, leave and rejoin the channel\n\n"
+            "⚠️ **Note:** Telegram sometimes takes time to update membership status."
+        ),
+        "force_failed": (
+            "❌ **Force Refresh Failed**\n\n"
+            "We still can't detect your membership in {channel}.\n\n"
+            "**Possible solutions:**\n"
+            "• Leave the channel completely\n"
+            "• Wait 2 minutes\n"
+            "• Join again\n"
+            "• Try again after 5 minutes\n\n"
+            "**Or contact support with your User ID:** `{user_id}`"
+        ),
+        "button_join": "📢 Join Channel",
+        "button_check": "✅ I Joined, Check Again",
+        "button_force": "🔄 Force Refresh",
+        "button_support": "🆘 Contact Support",
+    },
+}
+
+
+def to_base36(number: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    text = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        text = digits[remainder] + text
+        if not number:
+            return text
+
+
+def sign_link(payload: str) -> str:
+    digest = hmac.new(LINK_SECRET.encode(), payload.encode(), hashlib.sha256).digest()[:LINK_SIGNATURE_BYTES]
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def make_link_token(media_id: str, ttl: Optional[int] = None) -> str:
+    """Signed start parameter for a media ID: s<id>_<expiry>_<signature>, IDs and expiry in base36
+
+    ttl defaults to LINK_TTL.
+    """
+    if ttl is None:
+        ttl = LINK_TTL
+    expires = to_base36(int(time.time()) + ttl) if ttl else "0"
+    payload = f"{to_base36(int(media_id))}_{expires}"
+    return f"s{payload}_{sign_link(payload)}"
+
+
+def validate_config() -> list:
+    """Check the settings without touching the network; returns a list of problems (empty if none)"""
+    errors = []
+    if not re.fullmatch(r"\d+:[\w-]{30,}", BOT_TOKEN):
+        errors.append("BOT_TOKEN does not look like a token from @BotFather (<bot id>:<secret>)")
+    if not isinstance(MAIN_CHANNEL_ID, int) and not re.fullmatch(r"@\w{4,}", MAIN_CHANNEL_ID):
+        errors.append(f"MAIN_CHANNEL_ID must be a -100... ID or an @username, got {MAIN_CHANNEL_ID!r}")
+    for name in ("MAIN_CHANNEL_ID", "CONTENT_CHANNEL_ID"):
+        value = globals()[name]
+        if isinstance(value, int) and not str(value).startswith("-100"):
+            errors.append(f"{name} must be a channel ID starting with -100, got {value}")
+    if not re.fullmatch(r"@\w{4,}", MAIN_CHANNEL_USERNAME):
+        errors.append(f"MAIN_CHANNEL_USERNAME must be an @username, got {MAIN_CHANNEL_USERNAME!r}")
+    if not re.fullmatch(r"\w{4,}", BOT_USERNAME):
+        errors.append(f"BOT_USERNAME must be the bot's username without @, got {BOT_USERNAME!r}")
+
+    if LANGUAGE not in TEMPLATES:
+        errors.append(f"LANGUAGE must be one of {', '.join(TEMPLATES)}, got {LANGUAGE!r}")
+
+    if BOT_MODE not in ("polling", "webhook"):
+        errors.append(f"BOT_MODE must be 'polling' or 'webhook', got {BOT_MODE!r}")
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL.startswith("https://"):
+            errors.append("WEBHOOK_URL must be an https:// URL")
+        if not WEBHOOK_PATH.startswith("/"):
+            errors.append("WEBHOOK_PATH must start with /")
+        if WEBHOOK_SECRET == "change-me":
+            # Anyone who finds the URL could post forged updates
+            errors.append("WEBHOOK_SECRET must be changed from the default value in webhook mode")
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET):
+        errors.append("WEBHOOK_SECRET may only contain A-Z, a-z, 0-9, _ and - (1-256 characters)")
+    if STATE_BACKEND not in ("memory", "sqlite", "redis"):
+        errors.append(f"STATE_BACKEND must be 'memory', 'sqlite' or 'redis', got {STATE_BACKEND!r}")
+    if STATE_BACKEND == "redis" and redis is None:
+        errors.append("STATE_BACKEND 'redis' needs the redis package (pip install redis)")
+    if WORKER_COUNT > 1 and STATE_BACKEND == "memory":
+        errors.append("WORKER_COUNT > 1 needs a shared STATE_BACKEND ('sqlite' or 'redis')")
+
+    for name in ("WORKER_COUNT", "MAX_CONCURRENT_UPDATES", "PREWARM_MAX_USERS", "PREWARM_CONCURRENCY",
+                 "PREWARM_PROGRESS_INTERVAL", "LOG_BUFFER_SIZE", "GLOBAL_RATE_LIMIT", "PER_CHAT_RATE_LIMIT",
+                 "PER_CHAT_BURST", "FLOOD_MAX_REQUESTS", "FLOOD_WINDOW", "CACHE_DURATION",
+                 "NEGATIVE_CACHE_DURATION", "CACHE_MAX_SIZE", "CACHE_PRUNE_INTERVAL", "MEMBERSHIP_INDEX_MAX_SIZE",
+                 "KEYBOARD_CACHE_SIZE",
+                 "WEBHOOK_MAX_BODY_SIZE", "WEBHOOK_READ_TIMEOUT", "ANALYTICS_FLUSH_INTERVAL",
+                 "ANALYTICS_MAX_PENDING_JOINS"):
+        if globals()[name] <= 0:
+            errors.append(f"{name} must be greater than 0, got {globals()[name]}")
+    for name in ("GROUP_COMMIT_DELAY", "PREWARM_INTERVAL", "METRICS_PORT", "MAX_RATE_LIMIT_RETRIES",
+                 "DEDUP_WINDOW", "ALBUM_COLLECT_DELAY", "LINK_TTL"):
+        if globals()[name] < 0:
+            errors.append(f"{name} must not be negative, got {globals()[name]}")
+    if any(delay <= 0 for delay in MEMBERSHIP_RECHECK_DELAYS):
+        errors.append("MEMBERSHIP_RECHECK_DELAYS must all be greater than 0")
+    if not 8 <= LINK_SIGNATURE_BYTES <= 24:
+        errors.append(f"LINK_SIGNATURE_BYTES must be between 8 and 24, got {LINK_SIGNATURE_BYTES}")
+    else:
+        # Gate buttons carry the link in callback_data, which Telegram caps at 64 bytes
+        callback_data = f"check_membership_{make_link_token(str(2**31 - 1), LINK_TTL)}"
+        if len(callback_data.encode()) > CALLBACK_DATA_LIMIT:
+            errors.append(f"LINK_SIGNATURE_BYTES {LINK_SIGNATURE_BYTES} with LINK_TTL {LINK_TTL} makes gate buttons "
+                          f"{len(callback_data.encode())} bytes, over Telegram's {CALLBACK_DATA_LIMIT}")
+    if not isinstance(logging.getLevelName(LOG_LEVEL.upper()), int):
+        errors.append(f"LOG_LEVEL must be a logging level name, got {LOG_LEVEL!r}")
+    for level, rate in MEMBERSHIP_LOG_SAMPLE_RATES.items():
+        if not isinstance(logging.getLevelName(level.upper()), int) or not 0 <= rate <= 1:
+            errors.append(f"MEMBERSHIP_LOG_SAMPLE_RATES needs level names and rates from 0 to 1, got {level}: {rate}")
+    return errors
+
+
+try:
+    load_config()
+except ValueError as e:
+    raise SystemExit(str(e)) from None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including fields passed via extra="""
+
+    STANDARD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self.STANDARD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the logging thread without blocking, dropping them if the buffer is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener runs in this process, so formatting can wait until it is off the event loop
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
 
-async def check_membership_with_fallback(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    """Enhanced membership check with multiple strategies and caching"""
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """Waits for room in a full buffer to send the stop signal, instead of failing with queue.Full"""
 
-    # Check cache first
-    cache_key = f"user_{user_id}"
-    current_time = time.time()
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a share of records per level"""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = {logging.getLevelName(level.upper()): rate for level, rate in rates.items()}
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+def setup_logging():
+    """Route all logging through a bounded queue to a background thread that does the writing"""
+    stream_handler = logging.StreamHandler()
+    if LOG_JSON:
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_BUFFER_SIZE))
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL.upper())
+    root.addHandler(queue_handler)
+
+    listener = DrainingQueueListener(queue_handler.queue, stream_handler)
+    listener.start()
+    # Flush whatever is still buffered on exit
+    atexit.register(listener.stop)
+    return queue_handler
+
+
+log_queue_handler = setup_logging()
+logger = logging.getLogger(__name__)
+# Noisy per-attempt membership lines are sampled
+membership_logger = logging.getLogger(f"{__name__}.membership")
+membership_log_filter = SamplingFilter(MEMBERSHIP_LOG_SAMPLE_RATES)
+membership_logger.addFilter(membership_log_filter)
+
+worker_shard = 0  # set in worker processes
+
+
+class StateBackend:
+    """State shared by every worker process: stored media and membership results"""
+
+    async def add_media(self, media_type: str, file_id: str, policy: Optional[str] = None) -> str:
+        """Store media with its gating policy (JSON, None for the main channel) and return its new ID once durable"""
+        raise NotImplementedError
+
+    async def get_media(self, media_id: str):
+        """Look up (media_type, file_id, policy) by ID, or None if unknown"""
+        raise NotImplementedError
 
-    if cache_key in membership_cache:
-        cached_time, cached_result = membership_cache[cache_key]
-        if current_time - cached_time < CACHE_DURATION:
-            logger.info(f"Using cached membership result for user {user_id}: {cached_result}")
-            return cached_result
+    async def media_count(self) -> int:
+        raise NotImplementedError
 
-    logger.info(f"Starting comprehensive membership check for user {user_id}")
+    async def get_membership(self, user_id: int, channel: str) -> Optional[bool]:
+        """Membership result in a channel stored by any worker, or None if missing or expired"""
+        raise NotImplementedError
 
-    # Strategy 1: Direct getChatMember with retries
-    for attempt in range(4):  # Increased attempts
+    async def set_membership(self, user_id: int, channel: str, is_member: bool, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def delete_membership(self, user_id: int, channel: str) -> None:
+        raise NotImplementedError
+
+    async def record_requester(self, user_id: int) -> None:
+        """Remember that a user requested content, for membership pre-warming"""
+        raise NotImplementedError
+
+    async def recent_requesters(self, limit: int) -> list:
+        """User IDs of the most recent requesters, newest first"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """Process-local state, only suitable for a single worker (nothing survives a restart)"""
+
+    def __init__(self):
+        self.media = {}
+        self.ids = itertools.count(1)
+        self.requesters = OrderedDict()
+
+    async def add_media(self, media_type: str, file_id: str, policy: Optional[str] = None) -> str:
+        media_id = str(next(self.ids))
+        self.media[media_id] = (media_type, file_id, policy)
+        return media_id
+
+    async def get_media(self, media_id: str):
+        return self.media.get(media_id)
+
+    async def media_count(self) -> int:
+        return len(self.media)
+
+    async def get_membership(self, user_id: int, channel: str) -> Optional[bool]:
+        # membership_cache already holds everything this process knows
+        return None
+
+    async def set_membership(self, user_id: int, channel: str, is_member: bool, ttl: float) -> None:
+        pass
+
+    async def delete_membership(self, user_id: int, channel: str) -> None:
+        pass
+
+    async def record_requester(self, user_id: int) -> None:
+        self.requesters[user_id] = None
+        self.requesters.move_to_end(user_id)
+        if len(self.requesters) > PREWARM_MAX_USERS:
+            self.requesters.popitem(last=False)
+
+    async def recent_requesters(self, limit: int) -> list:
+        return list(itertools.islice(reversed(self.requesters), limit))
+
+
+class SQLiteBackend(StateBackend):
+    """Durable state in SQLite (WAL mode), shared by worker processes on the same machine
+
+    Media entries, membership results and requesters arriving within GROUP_COMMIT_DELAY are
+    written in one transaction, and IDs are assigned by SQLite at commit time so concurrent
+    processes never collide. Commits and reads run on worker threads, so waiting for another
+    process's write lock never blocks the event loop.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = self.connect()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            "id INTEGER PRIMARY KEY, media_type TEXT NOT NULL, file_id TEXT NOT NULL, created_at REAL NOT NULL, "
+            "policy TEXT)"
+        )
+        if "policy" not in self.columns("media"):
+            self.conn.execute("ALTER TABLE media ADD COLUMN policy TEXT")
+        if "channel" not in self.columns("membership"):
+            # Older files keyed results by user only; they expire within seconds, so just start over
+            self.conn.execute("DROP TABLE IF EXISTS membership")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS membership ("
+            "user_id INTEGER NOT NULL, channel TEXT NOT NULL, is_member INTEGER NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (user_id, channel))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS requesters (user_id INTEGER PRIMARY KEY, last_seen REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS requesters_last_seen ON requesters (last_seen)")
+        self.readers = threading.local()  # one read connection per worker thread
+        self.reader_connections = []
+        self.write_lock = asyncio.Lock()  # one commit at a time on self.conn
+        self.pending = []  # (future, media_type, file_id, created_at, policy)
+        self.pending_requesters = {}  # user_id -> last_seen
+        self.pending_memberships = {}  # (user_id, channel) -> (is_member, expires_at), None to delete
+        self.committing_memberships = {}  # the part of pending_memberships being written right now
+        self.flush_scheduled = False
+        self.flush_task = None
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")  # other workers may hold the write lock briefly
+        return conn
+
+    def columns(self, table: str) -> set:
+        return {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+
+    def read(self, sql: str, params: tuple) -> list:
+        conn = getattr(self.readers, "conn", None)
+        if conn is None:
+            conn = self.readers.conn = self.connect()
+            self.reader_connections.append(conn)
+        return conn.execute(sql, params).fetchall()
+
+    async def query(self, sql: str, params: tuple = ()) -> list:
+        return await asyncio.to_thread(self.read, sql, params)
+
+    def schedule_flush(self) -> None:
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_later(GROUP_COMMIT_DELAY, self.start_flush)
+
+    def start_flush(self) -> None:
+        self.flush_task = asyncio.ensure_future(self.flush())
+
+    async def add_media(self, media_type: str, file_id: str, policy: Optional[str] = None) -> str:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((future, media_type, file_id, time.time(), policy))
+        self.schedule_flush()
+        return await asyncio.shield(future)
+
+    def write(self, batch: list, requesters: dict, memberships: dict) -> list:
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO requesters (user_id, last_seen) VALUES (?, ?)", requesters.items()
+            )
+            self.conn.executemany(
+                "DELETE FROM membership WHERE user_id = ? AND channel = ?",
+                [key for key, value in memberships.items() if value is None]
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO membership (user_id, channel, is_member, expires_at) VALUES (?, ?, ?, ?)",
+                [(*key, int(value[0]), value[1]) for key, value in memberships.items() if value is not None]
+            )
+            return [
+                self.conn.execute(
+                    "INSERT INTO media (media_type, file_id, created_at, policy) VALUES (?, ?, ?, ?)", entry[1:]
+                ).lastrowid
+                for entry in batch
+            ]
+
+    async def flush(self) -> None:
+        """Write all pending media, membership results and requesters in a single transaction"""
+        self.flush_scheduled = False
+        batch, self.pending = self.pending, []
+        requesters, self.pending_requesters = self.pending_requesters, {}
+        memberships, self.pending_memberships = self.pending_memberships, {}
+        if not batch and not requesters and not memberships:
+            return
         try:
-            member = await context.bot.get_chat_member(MAIN_CHANNEL_ID, user_id)
-            status = member.status
-            logger.info(f"User {user_id} status: {status} (attempt {attempt + 1})")
-
-            # Check for valid membership statuses
-            if status in ["member", "administrator", "creator"]:
-                membership_cache[cache_key] = (current_time, True)
-                return True
-            elif status in ["left", "kicked", "restricted"]:
-                # If user left/kicked, they're definitely not a member
-                membership_cache[cache_key] = (current_time, False)
-                return False
-
-            # Wait before retry, with increasing delays
-            if attempt < 3:
-                wait_time = (attempt + 1) * 2  # 2, 4, 6 seconds
-                logger.info(f"Waiting {wait_time} seconds before retry...")
-                await asyncio.sleep(wait_time)
-
-        except BadRequest as e:
-            if "user not found" in str(e).lower():
-                logger.error(f"User {user_id} not found: {e}")
-                membership_cache[cache_key] = (current_time, False)
-                return False
-            logger.error(f"BadRequest error checking membership (attempt {attempt + 1}): {e}")
-        except Forbidden as e:
-            logger.error(f"Forbidden error - bot might not have access: {e}")
-            # If bot doesn't have access, we can't verify membership
-            # In this case, we might want to allow access or handle differently
-            return False
-        except TelegramError as e:
-            logger.error(f"Telegram error checking membership (attempt {attempt + 1}): {e}")
+            async with self.write_lock:
+                self.committing_memberships = memberships
+                try:
+                    media_ids = await asyncio.to_thread(self.write, batch, requesters, memberships)
+                finally:
+                    self.committing_memberships = {}
+            if batch:
+                logger.info("Committed %s media entries", len(batch))
         except Exception as e:
-            logger.error(f"Unexpected error checking membership (attempt {attempt + 1}): {e}")
+            logger.error("Failed to commit batch of %s media entries: %s", len(batch), e)
+            for future, *_ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            # Requesters and membership results go out with the next commit, unless newer ones arrived meanwhile
+            self.pending_requesters = {**requesters, **self.pending_requesters}
+            self.pending_memberships = {**memberships, **self.pending_memberships}
+            return
+        for (future, *_), media_id in zip(batch, media_ids):
+            if not future.done():
+                future.set_result(str(media_id))
+
+    async def get_media(self, media_id: str):
+        # Longer IDs would overflow SQLite's INTEGER and were never issued anyway
+        if not re.fullmatch(r"[0-9]{1,18}", media_id):
+            return None
+        rows = await self.query("SELECT media_type, file_id, policy FROM media WHERE id = ?", (int(media_id),))
+        return rows[0] if rows else None
+
+    async def media_count(self) -> int:
+        # IDs are never deleted, so this avoids a full COUNT(*) scan
+        return (await self.query("SELECT MAX(id) FROM media"))[0][0] or 0
+
+    async def get_membership(self, user_id: int, channel: str) -> Optional[bool]:
+        # Results and deletions not committed yet take precedence over the table
+        for uncommitted in (self.pending_memberships, self.committing_memberships):
+            if (user_id, channel) in uncommitted:
+                pending = uncommitted[(user_id, channel)]
+                return pending[0] if pending is not None and pending[1] > time.time() else None
+        rows = await self.query(
+            "SELECT is_member FROM membership WHERE user_id = ? AND channel = ? AND expires_at > ?",
+            (user_id, channel, time.time())
+        )
+        return bool(rows[0][0]) if rows else None
+
+    async def set_membership(self, user_id: int, channel: str, is_member: bool, ttl: float) -> None:
+        self.pending_memberships[(user_id, channel)] = (is_member, time.time() + ttl)
+        self.schedule_flush()
+
+    async def delete_membership(self, user_id: int, channel: str) -> None:
+        self.pending_memberships[(user_id, channel)] = None
+        self.schedule_flush()
+
+    async def record_requester(self, user_id: int) -> None:
+        # Batched with the media writes, a /start shouldn't wait for a commit
+        self.pending_requesters[user_id] = time.time()
+        self.schedule_flush()
+
+    async def recent_requesters(self, limit: int) -> list:
+        rows = await self.query("SELECT user_id FROM requesters ORDER BY last_seen DESC LIMIT ?", (limit,))
+        return [row[0] for row in rows]
+
+    async def close(self) -> None:
+        if self.flush_task is not None:
+            await self.flush_task
+        await self.flush()
+        for conn in self.reader_connections:
+            conn.close()
+        self.conn.close()
+
+
+class RedisBackend(StateBackend):
+    """State in Redis (or anything speaking its protocol), shared by workers on any machine"""
+
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("STATE_BACKEND = 'redis' needs the redis package (pip install redis)")
+        self.client = redis.from_url(url)
+
+    async def add_media(self, media_type: str, file_id: str, policy: Optional[str] = None) -> str:
+        media_id = await self.client.incr("media:next_id")
+        mapping = {"type": media_type, "file_id": file_id}
+        if policy is not None:
+            mapping["policy"] = policy
+        await self.client.hset(f"media:{media_id}", mapping=mapping)
+        return str(media_id)
+
+    async def get_media(self, media_id: str):
+        if not re.fullmatch(r"[0-9]{1,18}", media_id):
+            return None
+        entry = await self.client.hmget(f"media:{media_id}", "type", "file_id", "policy")
+        if entry[0] is None:
+            return None
+        return entry[0].decode(), entry[1].decode(), entry[2] and entry[2].decode()
+
+    async def media_count(self) -> int:
+        return int(await self.client.get("media:next_id") or 0)
+
+    async def get_membership(self, user_id: int, channel: str) -> Optional[bool]:
+        value = await self.client.get(f"member:{channel}:{user_id}")
+        return None if value is None else value == b"1"
+
+    async def set_membership(self, user_id: int, channel: str, is_member: bool, ttl: float) -> None:
+        await self.client.set(f"member:{channel}:{user_id}", "1" if is_member else "0", px=int(ttl * 1000))
+
+    async def delete_membership(self, user_id: int, channel: str) -> None:
+        await self.client.delete(f"member:{channel}:{user_id}")
+
+    async def record_requester(self, user_id: int) -> None:
+        await self.client.zadd("requesters", {str(user_id): time.time()})
+
+    async def recent_requesters(self, limit: int) -> list:
+        return [int(user_id) for user_id in await self.client.zrevrange("requesters", 0, limit - 1)]
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def create_state_backend() -> StateBackend:
+    if STATE_BACKEND == "memory":
+        return MemoryBackend()
+    if STATE_BACKEND == "redis":
+        return RedisBackend(REDIS_URL)
+    return SQLiteBackend(MEDIA_DB_PATH)
+
+
+class DeliveryAnalytics:
+    """Per-content request, denial, delivery and time-to-join counts
+
+    Recording an event only updates an in-memory hourly rollup. flush() adds the rollups to SQLite
+    in one transaction on a worker thread, so handlers never wait for a write. Workers sharing
+    the file just add to the same rows.
+    """
+
+    COLUMNS = ("requests", "denials", "deliveries", "joins", "join_seconds")
+
+    def __init__(self, path: str, max_pending_joins: int):
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        counts = ", ".join(f"{column} {'REAL' if column == 'join_seconds' else 'INTEGER'} NOT NULL"
+                           for column in self.COLUMNS)
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS content_stats_hourly ("
+            f"image_id INTEGER NOT NULL, hour INTEGER NOT NULL, {counts}, PRIMARY KEY (image_id, hour))"
+        )
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS content_stats (image_id INTEGER PRIMARY KEY, {counts})")
+        self.pending = {}  # (image_id, hour) -> [requests, denials, deliveries, joins, join_seconds]
+        self.denied_at = OrderedDict()  # (user_id, image_id) -> time of the first denial
+        self.max_pending_joins = max_pending_joins
+        self.lock = asyncio.Lock()  # one thread uses the connection at a time
+        self.events = 0
+
+    def rollup(self, image_id: str, now: float) -> list:
+        return self.pending.setdefault((int(image_id), int(now // 3600) * 3600), [0, 0, 0, 0, 0.0])
+
+    def record_request(self, image_id: str) -> None:
+        self.rollup(image_id, time.time())[0] += 1
+        self.events += 1
+
+    def record_denial(self, image_id: str, user_id: int) -> None:
+        now = time.time()
+        self.rollup(image_id, now)[1] += 1
+        self.events += 1
+        # Keep the first denial, time-to-join runs from there
+        self.denied_at.setdefault((user_id, image_id), now)
+        if len(self.denied_at) > self.max_pending_joins:
+            self.denied_at.popitem(last=False)
+
+    def record_delivery(self, image_id: str, user_id: int) -> None:
+        now = time.time()
+        counts = self.rollup(image_id, now)
+        counts[2] += 1
+        self.events += 1
+        denied_at = self.denied_at.pop((user_id, image_id), None)
+        if denied_at is not None:
+            counts[3] += 1
+            counts[4] += now - denied_at
+
+    def write(self, batch: dict) -> None:
+        rows = [(*key, *counts) for key, counts in batch.items()]
+        updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in self.COLUMNS)
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                f"INSERT INTO content_stats_hourly (image_id, hour, {', '.join(self.COLUMNS)}) "
+                f"VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (image_id, hour) DO UPDATE SET {updates}",
+                rows
+            )
+            self.conn.executemany(
+                f"INSERT INTO content_stats (image_id, {', '.join(self.COLUMNS)}) "
+                f"VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (image_id) DO UPDATE SET {updates}",
+                [(row[0], *row[2:]) for row in rows]
+            )
+
+    async def flush(self) -> None:
+        """Add the pending rollups to the database"""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        async with self.lock:
+            try:
+                await asyncio.to_thread(self.write, batch)
+            except Exception as e:
+                logger.error("Failed to write analytics batch: %s", e)
+                # Keep the counts for the next flush
+                for key, counts in batch.items():
+                    pending = self.pending.setdefault(key, [0, 0, 0, 0, 0.0])
+                    for i, value in enumerate(counts):
+                        pending[i] += value
+
+    def read(self, image_id: int, since: float) -> dict:
+        sums = ", ".join(f"SUM({column})" for column in self.COLUMNS)
+        total = self.conn.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM content_stats WHERE image_id = ?", (image_id,)
+        ).fetchone()
+        recent = self.conn.execute(
+            f"SELECT {sums} FROM content_stats_hourly WHERE image_id = ? AND hour >= ?", (image_id, since)
+        ).fetchone()
+        return {
+            period: dict(zip(self.COLUMNS, [value or 0 for value in row or (0,) * len(self.COLUMNS)]))
+            for period, row in (("total", total), ("last_24h", recent))
+        }
+
+    async def stats(self, image_id: str) -> dict:
+        """All-time and last-24h counts of a content ID, read from the rollups"""
+        await self.flush()
+        async with self.lock:
+            return await asyncio.to_thread(self.read, int(image_id), time.time() - 24 * 3600)
+
+    async def close(self) -> None:
+        await self.flush()
+        self.conn.close()
+
+
+class MembershipCache:
+    """Size-bounded LRU cache of membership results with separate TTLs for members and non-members"""
+
+    def __init__(self, max_size: int, positive_ttl: float, negative_ttl: float):
+        self.max_size = max_size
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()  # (channel, user_id) -> (expires_at, is_member, cached_at)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: tuple):
+        """Return the cached result, or None if missing or expired"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: tuple, is_member: bool) -> None:
+        now = time.monotonic()
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        self.entries[key] = (now + ttl, is_member, now)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: tuple) -> None:
+        self.entries.pop(key, None)
+
+    def age(self, key: tuple):
+        """Seconds since the entry was cached, or None if not cached"""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return time.monotonic() - entry[2]
+
+    def prune_expired(self) -> int:
+        now = time.monotonic()
+        expired = [key for key, entry in self.entries.items() if entry[0] <= now]
+        for key in expired:
+            del self.entries[key]
+        self.expirations += len(expired)
+        return len(expired)
+
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class MembershipIndex:
+    """Main channel membership reported by chat_member updates, bounded to the most recently used users
+
+    Only push updates write here; a result polled with getChatMember may be outdated by the time
+    it arrives, so it goes to MembershipCache with a TTL instead.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # user_id -> is_member
+        self.evictions = 0
+
+    def get(self, user_id: int) -> Optional[bool]:
+        is_member = self.entries.get(user_id)
+        if is_member is not None:
+            self.entries.move_to_end(user_id)
+        return is_member
+
+    def set(self, user_id: int, is_member: bool) -> None:
+        self.entries[user_id] = is_member
+        self.entries.move_to_end(user_id)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, user_id: int) -> None:
+        self.entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class Counter:
+    """Prometheus-style counter, optionally split by one label"""
+
+    def __init__(self, name: str, help_text: str, label: str = None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.values = {}
+
+    def inc(self, label_value: str = "", amount: float = 1) -> None:
+        self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_value, value in self.values.items():
+            labels = f'{{{self.label}="{label_value}"}}' if self.label else ""
+            lines.append(f"{self.name}{labels} {value}")
+        return "\n".join(lines)
+
+
+class Histogram:
+    """Prometheus-style histogram with fixed buckets; observe() is a bisect and two additions"""
+
+    def __init__(self, name: str, help_text: str, buckets=(0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return "\n".join(lines)
+
+
+membership_check_seconds = Histogram("membership_check_seconds", "Time spent in check_membership_with_fallback")
+media_delivery_seconds = Histogram("media_delivery_seconds", "Time spent in send_media_content")
+api_requests_total = Counter("bot_api_requests_total", "Bot API requests sent", "method")
+api_errors_total = Counter("bot_api_errors_total", "Bot API requests that failed", "method")
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        self.refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        self.refill()
+        return self.tokens >= self.capacity
+
+
+# Priority lanes for outgoing requests, lower value is sent first
+PRIORITY_CONTENT = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_ADMIN = 2
+PRIORITY_BACKGROUND = 3
+
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """Throttles Bot API calls with global and per-chat token buckets, serving higher priority first
+
+    The global limit is Telegram's for the whole bot, so with sharded workers each one gets an equal share.
+    """
+
+    def __init__(self):
+        rate = GLOBAL_RATE_LIMIT / WORKER_COUNT
+        self.global_bucket = TokenBucket(rate, rate)
+        self.chat_buckets = {}
+        self.waiters = []  # heap of (priority, seq, future)
+        self.seq = itertools.count()
+        self.dispatcher = None
+        self.paused_until = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.max_queue_depth = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+        for _, _, future in self.waiters:
+            future.cancel()
+        self.waiters.clear()
+
+    def queue_depth(self) -> int:
+        return len(self.waiters)
+
+    async def acquire(self, priority: int) -> None:
+        """Wait for a global token; waiting requests are released in priority order"""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.seq), future))
+        self.max_queue_depth = max(self.max_queue_depth, len(self.waiters))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self.dispatch())
+        await future
+
+    async def dispatch(self) -> None:
+        while self.waiters:
+            delay = max(self.paused_until - time.monotonic(), self.global_bucket.delay())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                self.global_bucket.take()
+                future.set_result(None)
+
+    async def acquire_chat(self, chat_id) -> None:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10_000:
+                # Idle chats have full buckets again, so dropping them loses nothing
+                for key in [key for key, b in self.chat_buckets.items() if b.is_full()]:
+                    del self.chat_buckets[key]
+            bucket = self.chat_buckets[chat_id] = TokenBucket(PER_CHAT_RATE_LIMIT, PER_CHAT_BURST)
+        while (delay := bucket.delay()) > 0:
+            await asyncio.sleep(delay)
+        bucket.take()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = PRIORITY_DEFAULT if rate_limit_args is None else rate_limit_args
+        # Only outgoing messages count against a chat's limit, not lookups like getChatMember
+        chat_id = data.get("chat_id") if endpoint.startswith(("send", "edit", "copy", "forward")) else None
+
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            if chat_id is not None:
+                await self.acquire_chat(chat_id)
+            await self.acquire(priority)
+            self.requests += 1
+            api_requests_total.inc(endpoint)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                api_errors_total.inc(endpoint)
+                if attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning("Rate limited on %s, pausing all requests for %ss", endpoint, retry_after)
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                self.retries += 1
+            except TelegramError:
+                api_errors_total.inc(endpoint)
+                raise
+
+
+class RequestThrottle:
+    """Per-user sliding-window limiter that also drops repeats of the same request within a short window"""
+
+    def __init__(self, max_requests: int, window: float, dedup_window: float):
+        self.max_requests = max_requests
+        self.window = window
+        self.dedup_window = dedup_window
+        self.requests = {}  # user_id -> deque of request times
+        self.last_seen = {}  # (user_id, request_key) -> time
+        self.allowed = 0
+        self.throttled = 0
+        self.deduplicated = 0
+
+    def allow(self, user_id: int, request_key: str) -> bool:
+        now = time.monotonic()
+        last = self.last_seen.get((user_id, request_key))
+        if last is not None and now - last < self.dedup_window:
+            self.deduplicated += 1
+            return False
+
+        times = self.requests.get(user_id)
+        if times is None:
+            times = self.requests[user_id] = deque()
+        while times and times[0] <= now - self.window:
+            times.popleft()
+        if len(times) >= self.max_requests:
+            self.throttled += 1
+            return False
+
+        times.append(now)
+        self.last_seen[(user_id, request_key)] = now
+        self.allowed += 1
+        return True
+
+    def prune(self) -> None:
+        """Forget users whose windows have passed"""
+        now = time.monotonic()
+        self.last_seen = {key: last for key, last in self.last_seen.items() if now - last < self.dedup_window}
+        self.requests = {
+            user_id: times for user_id, times in self.requests.items() if times and times[-1] > now - self.window
+        }
 
-        if attempt < 3:
-            await asyncio.sleep(2)
 
-    # Strategy 2: Try alternative approach - check if user can receive messages
-    # This is a fallback when getChatMember fails consistently
+state_backend = create_state_backend()
+delivery_analytics = DeliveryAnalytics(ANALYTICS_DB_PATH, ANALYTICS_MAX_PENDING_JOINS)
+rate_limiter = PriorityRateLimiter()
+request_throttle = RequestThrottle(FLOOD_MAX_REQUESTS, FLOOD_WINDOW, DEDUP_WINDOW)
+# Cache to store recent membership checks to avoid API spam
+membership_cache = MembershipCache(CACHE_MAX_SIZE, CACHE_DURATION, NEGATIVE_CACHE_DURATION)
+# Membership index kept up to date from chat_member updates of the main channel
+membership_index = MembershipIndex(MEMBERSHIP_INDEX_MAX_SIZE)
+# In-flight membership checks: user_id -> task, so concurrent callers share one API check
+pending_membership_checks = {}
+MEMBER_STATUSES = ("member", "administrator", "creator")
+MEDIA_GROUP_LIMIT = 10  # items per send_media_group call (Telegram's maximum)
+# Album items being collected: media_group_id -> {"items": [(media_type, file_id), ...], "policy": ...}
+pending_albums = {}
+
+
+def load_messages(language: str) -> dict:
+    """Render the templates of a language with everything known at startup"""
+    if language not in TEMPLATES:
+        raise ValueError(f"LANGUAGE must be one of {', '.join(TEMPLATES)}, got {language!r}")
+    # Texts are sent as Markdown, where the underscores of a username would start italics
+    channel = escape_markdown(MAIN_CHANNEL_USERNAME, version=1)
+    return {key: text.replace("{channel}", channel) for key, text in TEMPLATES[language].items()}
+
+
+MESSAGES = load_messages(LANGUAGE)
+CHANNEL_URL = f"https://t.me/{MAIN_CHANNEL_USERNAME.lstrip('@')}"
+
+
+def resolve_content_link(link: str, from_button: bool = False) -> Optional[str]:
+    """Media ID a start parameter points to, or None if it is malformed, forged or expired
+
+    Only does an HMAC, so bad links are rejected without touching storage. from_button is set for
+    links taken from gate button callback data, where old gate messages carry a bare ID.
+    """
+    if link.startswith("s"):
+        # The signature is base64 and may itself contain "_", so split at most twice
+        parts = link[1:].split("_", 2)
+        if len(parts) != 3:
+            return None
+        media_id, expires, signature = parts
+        if not hmac.compare_digest(signature.encode(), sign_link(f"{media_id}_{expires}").encode()):
+            return None
+        expires = int(expires, 36)
+        if expires and expires < time.time():
+            return None
+        return str(int(media_id, 36))
+
+    if ACCEPT_LEGACY_LINKS:
+        # img<ID> from old links, or a bare ID from the buttons of old gate messages
+        if link.startswith("img"):
+            legacy_id = link[3:]
+        elif from_button:
+            legacy_id = link
+        else:
+            return None
+        if re.fullmatch(r"[0-9]{1,18}", legacy_id):
+            return legacy_id
+    return None
+
+
+def parse_gate_policy(caption: Optional[str]) -> Optional[str]:
+    """Gating policy from a "gate: all|any @channel ..." line of a content caption, as JSON for storage
+
+    all needs membership in every listed channel, any in at least one. None (no such line) means
+    the content is gated by the main channel only.
+    """
+    for line in (caption or "").splitlines():
+        words = line.split()
+        if len(words) < 3 or words[0].lower() != "gate:" or words[1].lower() not in ("all", "any"):
+            continue
+        channels = [word.lower() for word in words[2:] if re.fullmatch(r"@\w{4,}", word)]
+        if len(channels) != len(words) - 2:
+            logger.warning("Ignoring invalid channels in gate line: %s", line)
+        if channels:
+            return json.dumps({"mode": words[1].lower(), "channels": list(dict.fromkeys(channels))})
+    return None
+
+
+MAIN_GATE = (True, ())  # (require_all, channels) of content without a policy
+
+
+def policy_gate(policy: Optional[str]) -> tuple:
+    """(require_all, channels) of a stored policy; channels are @usernames, empty for the main channel"""
+    if policy is None:
+        return MAIN_GATE
+    policy = json.loads(policy)
+    return policy["mode"] == "all", tuple(policy["channels"])
+
+
+def gate_targets(channels: tuple) -> list:
+    """Chats to check for a gate's channels; the main channel is checked by MAIN_CHANNEL_ID so the index applies"""
+    if not channels:
+        return [MAIN_CHANNEL_ID]
+    main_username = MAIN_CHANNEL_USERNAME.lower()
+    return [MAIN_CHANNEL_ID if channel == main_username else channel for channel in channels]
+
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def gate_text(key: str, gate: tuple = MAIN_GATE) -> str:
+    """Gate text naming the channels a gate needs; texts for the main channel come prerendered from MESSAGES"""
+    require_all, channels = gate
+    if not channels:
+        return MESSAGES[key]
+    separator = " and " if require_all else " or "
+    names = separator.join(escape_markdown(channel, version=1) for channel in channels)
+    return TEMPLATES[LANGUAGE][key].replace("{channel}", names)
+
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def gate_keyboard(kind: str, link: str = "", channels: tuple = ()) -> InlineKeyboardMarkup:
+    """Inline keyboard shown on the membership gate; markups are immutable so they can be shared
+
+    kind "gate" offers the re-check buttons, "support" is the last resort after a failed force refresh.
+    channels adds one join button per channel of a gating policy instead of the main channel's.
+    """
+    if channels:
+        keyboard = [
+            [InlineKeyboardButton(f"{MESSAGES['button_join']} {channel}", url=f"https://t.me/{channel[1:]}")]
+            for channel in channels
+        ]
+    else:
+        keyboard = [[InlineKeyboardButton(MESSAGES["button_join"], url=CHANNEL_URL)]]
+    if kind == "support":
+        keyboard.append([InlineKeyboardButton(MESSAGES["button_support"], url=SUPPORT_URL)])
+    else:
+        keyboard.append([InlineKeyboardButton(MESSAGES["button_check"], callback_data=f"check_membership_{link}")])
+        keyboard.append([InlineKeyboardButton(MESSAGES["button_force"], callback_data=f"force_check_{link}")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def is_main_channel(chat) -> bool:
+    """Check if a chat is the main channel (MAIN_CHANNEL_ID may be an ID or a username)"""
+    if chat.id == MAIN_CHANNEL_ID:
+        return True
+    return bool(chat.username) and f"@{chat.username}".lower() == MAIN_CHANNEL_USERNAME.lower()
+
+
+async def track_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Apply join/leave updates from the main channel to the membership index"""
+    result = update.chat_member
+    if not is_main_channel(result.chat):
+        return
+
+    user_id = result.new_chat_member.user.id
+    is_member = result.new_chat_member.status in MEMBER_STATUSES
+    membership_index.set(user_id, is_member)
+    membership_logger.info("Membership update for user %s: %s", user_id, result.new_chat_member.status)
+
+
+async def track_my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop the membership index when the bot loses access to the main channel"""
+    result = update.my_chat_member
+    if not is_main_channel(result.chat):
+        return
+
+    status = result.new_chat_member.status
+    membership_logger.info("Bot status in main channel changed to: %s", status)
+    if status != "administrator":
+        # Without admin rights we stop receiving chat_member updates, so the index would go stale
+        membership_index.clear()
+        logger.warning("Bot is no longer admin in main channel, cleared membership index")
+
+
+async def check_gate(user_id: int, context: ContextTypes.DEFAULT_TYPE, gate: tuple = MAIN_GATE,
+                     priority: int = PRIORITY_DEFAULT, recheck_denied: bool = False) -> Optional[bool]:
+    """Check a user against a gate, with the membership checks of all its channels running concurrently
+
+    Stops waiting as soon as the outcome is decided: at the first channel the user is not in for
+    all-of gates, the first one they are in for any-of gates. The other checks still finish in the
+    background and are cached. None if the outcome hinges on an inconclusive check.
+    recheck_denied is passed on to check_membership_with_fallback.
+    """
+    require_all, channels = gate
+    targets = gate_targets(channels)
+    if len(targets) == 1:
+        return await check_membership_with_fallback(user_id, context, priority, targets[0], recheck_denied)
+
+    checks = [asyncio.create_task(check_membership_with_fallback(user_id, context, priority, channel, recheck_denied))
+              for channel in targets]
+    inconclusive = False
     try:
-        logger.info(f"Trying alternative verification for user {user_id}")
-
-        # Send a test message that we immediately delete
-        # If user is not in channel, this will fail
-        test_msg = await context.bot.send_message(
-            chat_id=user_id,
-            text="⚡ Verifying access...",
-            disable_notification=True
-        )
-        await context.bot.delete_message(chat_id=user_id, message_id=test_msg.message_id)
+        for check in asyncio.as_completed(checks):
+            is_member = await check
+            if is_member is None:
+                inconclusive = True
+            elif is_member != require_all:
+                return is_member
+        return None if inconclusive else require_all
+    finally:
+        for check in checks:
+            check.cancel()
+
+
+async def check_membership_with_fallback(user_id: int, context: ContextTypes.DEFAULT_TYPE,
+                                        priority: int = PRIORITY_DEFAULT, channel=None,
+                                        recheck_denied: bool = False) -> Optional[bool]:
+    """Check membership in a channel (the main one by default), timing the whole lookup for /metrics
+
+    recheck_denied ignores a "not a member" entry of the membership index, for users who say they
+    just joined: the chat_member update of the join may have been missed or gone to another instance.
+    """
+    start_time = time.perf_counter()
+    try:
+        return await lookup_membership(user_id, context, priority, MAIN_CHANNEL_ID if channel is None else channel,
+                                       recheck_denied)
+    finally:
+        membership_check_seconds.observe(time.perf_counter() - start_time)
 
-        # If we got here, user exists and can receive messages
-        # Now do a final membership check
-        try:
-            member = await context.bot.get_chat_member(MAIN_CHANNEL_ID, user_id)
-            is_member = member.status in ["member", "administrator", "creator"]
-            membership_cache[cache_key] = (current_time, is_member)
-            return is_member
-        except:
-            # If still failing, be more lenient for better UX
-            logger.warning(f"Final membership check failed for user {user_id}, defaulting to False")
-            membership_cache[cache_key] = (current_time, False)
+
+async def lookup_membership(user_id: int, context: ContextTypes.DEFAULT_TYPE, priority: int,
+                            channel, recheck_denied: bool = False) -> Optional[bool]:
+    """Enhanced membership check with multiple strategies and caching"""
+
+    # Membership index is kept current by chat_member updates of the main channel, no API call needed
+    if channel == MAIN_CHANNEL_ID:
+        indexed = membership_index.get(user_id)
+        if indexed or (indexed is not None and not recheck_denied):
+            return indexed
+
+    # Check cache first
+    key = (channel, user_id)
+    cached_result = membership_cache.get(key)
+    if cached_result is not None:
+        membership_logger.info("Using cached membership result for user %s in %s: %s", user_id, channel,
+                               cached_result)
+        return cached_result
+
+    # Join a check that is already running for this user instead of starting another one
+    task = pending_membership_checks.get(key)
+    if task is None:
+        task = asyncio.create_task(verify_membership(user_id, context, priority, channel))
+        pending_membership_checks[key] = task
+        task.add_done_callback(lambda _: pending_membership_checks.pop(key, None))
+    else:
+        membership_logger.info("Joining in-flight membership check for user %s in %s", user_id, channel)
+    # Shield so one caller being cancelled doesn't cancel the check for the others
+    return await asyncio.shield(task)
+
+
+async def verify_membership(user_id: int, context: ContextTypes.DEFAULT_TYPE,
+                            priority: int = PRIORITY_DEFAULT, channel=None) -> Optional[bool]:
+    """Check membership against the Bot API once and cache it; None means the result was inconclusive
+
+    Retries are not done here but by recheck_membership_job, so handlers never sleep.
+    """
+    if channel is None:
+        channel = MAIN_CHANNEL_ID
+    # Another worker may already have checked this user
+    shared_result = await state_backend.get_membership(user_id, str(channel))
+    if shared_result is not None:
+        membership_cache.set((channel, user_id), shared_result)
+        return shared_result
+
+    membership_logger.info("Starting membership check for user %s in %s", user_id, channel)
+
+    try:
+        member = await context.bot.get_chat_member(channel, user_id, rate_limit_args=priority)
+        status = member.status
+        membership_logger.info("User %s status in %s: %s", user_id, channel, status)
+
+        # Check for valid membership statuses
+        if status in MEMBER_STATUSES:
+            await remember_membership(user_id, True, channel)
+            return True
+        elif status in ["left", "kicked", "restricted"]:
+            # If user left/kicked, they're definitely not a member
+            await remember_membership(user_id, False, channel)
             return False
 
+    except BadRequest as e:
+        if "user not found" in str(e).lower():
+            membership_logger.error("User %s not found: %s", user_id, e)
+            await remember_membership(user_id, False, channel)
+            return False
+        membership_logger.error("BadRequest error checking membership: %s", e)
+    except Forbidden as e:
+        membership_logger.error("Forbidden error - bot might not have access: %s", e)
+        # If bot doesn't have access, we can't verify membership
+        # In this case, we might want to allow access or handle differently
+        return False
+    except TelegramError as e:
+        membership_logger.error("Telegram error checking membership: %s", e)
     except Exception as e:
-        logger.error(f"Alternative verification failed for user {user_id}: {e}")
+        membership_logger.error("Unexpected error checking membership: %s", e)
+
+    membership_logger.warning("Membership check for user %s was inconclusive", user_id)
+    return None
 
-    # All strategies failed
-    logger.error(f"All membership verification strategies failed for user {user_id}")
-    membership_cache[cache_key] = (current_time, False)
-    return False
 
+async def remember_membership(user_id: int, is_member: bool, channel=None) -> None:
+    """Cache a membership result locally and in the shared backend for other workers"""
+    if channel is None:
+        channel = MAIN_CHANNEL_ID
+    membership_cache.set((channel, user_id), is_member)
+    ttl = membership_cache.positive_ttl if is_member else membership_cache.negative_ttl
+    await state_backend.set_membership(user_id, str(channel), is_member, ttl)
 
-async def force_membership_refresh(user_id: int) -> None:
-    """Force refresh of membership cache"""
-    cache_key = f"user_{user_id}"
-    if cache_key in membership_cache:
-        del membership_cache[cache_key]
-    logger.info(f"Cleared membership cache for user {user_id}")
+
+async def force_membership_refresh(user_id: int, drop_index: bool = False, channels: tuple = ()) -> None:
+    """Force refresh of membership cache for a gate's channels (and optionally the membership index entry)"""
+    for channel in gate_targets(channels):
+        membership_cache.pop((channel, user_id))
+        await state_backend.delete_membership(user_id, str(channel))
+    if drop_index:
+        # Only needed if an update was missed (e.g. while the bot was offline)
+        membership_index.pop(user_id)
+    membership_logger.info("Cleared membership cache for user %s", user_id)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -125,90 +1466,115 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     args = context.args
 
-    logger.info(f"Start command from user {user.id} (@{user.username}) with args: {args}")
+    logger.info("Start command from user %s (@%s) with args: %s", user.id, user.username, args)
 
     # Check if this is a media request
-    if args and args[0].startswith("img"):
-        image_id = args[0][3:]  # Remove 'img' prefix
-        logger.info(f"Media request for ID: {image_id}")
-
-        # Force refresh cache for this request
-        await force_membership_refresh(user.id)
-
-        # Check membership with enhanced method
-        is_member = await check_membership_with_fallback(user.id, context)
+    if args:
+        link = args[0]
+        if not request_throttle.allow(user.id, f"start:{link}"):
+            # Flood or repeated tap: drop it without spending any API calls
+            logger.info("Throttled /start from user %s", user.id)
+            return
+        image_id = resolve_content_link(link)
+        if image_id is None:
+            logger.warning("Rejected invalid or expired link from user %s", user.id)
+            await context.bot.send_message(chat_id=chat_id, text=MESSAGES["link_invalid"])
+            return
+        logger.info("Media request for ID: %s", image_id)
+        await state_backend.record_requester(user.id)
+        entry = await state_backend.get_media(image_id)
+        if entry is not None:
+            # Only content that exists is counted, so a forged ID never reaches the analytics tables
+            delivery_analytics.record_request(image_id)
+        gate = policy_gate(entry[2] if entry else None)
+
+        # Fresh cached or shared results (e.g. from a pre-warm on another worker) are trusted here;
+        # the gate's Check Again button drops them if the user says they just joined
+        is_member = await check_gate(user.id, context, gate)
 
         if not is_member:
-            # Create inline keyboard with join button and check membership button
-            keyboard = [
-                [InlineKeyboardButton("📢 Join Channel", url=f"https://t.me/{MAIN_CHANNEL_USERNAME.lstrip('@')}")],
-                [InlineKeyboardButton("✅ I Joined, Check Again", callback_data=f"check_membership_{image_id}")],
-                [InlineKeyboardButton("🔄 Force Refresh", callback_data=f"force_check_{image_id}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            await context.bot.send_message(
+            if entry is not None:
+                delivery_analytics.record_denial(image_id, user.id)
+            gate_message = await context.bot.send_message(
                 chat_id=chat_id,
-                text=(
-                    f"🚫 **Access Denied!**\n\n"
-                    f"You need to join {MAIN_CHANNEL_USERNAME} first to access this content.\n\n"
-                    f"**Steps:**\n"
-                    f"1️⃣ Click 'Join Channel'\n"
-                    f"2️⃣ Join the channel\n"
-                    f"3️⃣ Wait 10 seconds\n"
-                    f"4️⃣ Click 'I Joined, Check Again'\n\n"
-                    f"⚠️ If still not working, try 'Force Refresh'"
-                ),
-                reply_markup=reply_markup,
+                text=gate_text("access_denied", gate),
+                reply_markup=gate_keyboard("gate", link, gate[1]),
                 parse_mode='Markdown'
             )
+
+            if is_member is None:
+                # Telegram didn't give a clear answer, keep checking without blocking this handler
+                schedule_membership_recheck(context, user.id, chat_id, gate_message.message_id, link, gate, "start")
             return
 
         # User is a member, send the content
-        logger.info(f"User {user.id} verified as member, sending content...")
-        await send_media_content(chat_id, image_id, context)
+        logger.info("User %s verified as member, sending content...", user.id)
+        await send_media_content(chat_id, image_id, context, entry)
     else:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=(
-                "👋 **Welcome to Study Material Bot!**\n\n"
-                "Send me a valid content link to access media files.\n\n"
-                f"Make sure you're a member of {MAIN_CHANNEL_USERNAME} first!\n\n"
-                "🔗 Links look like: `/start img1`"
-            ),
-            parse_mode='Markdown'
-        )
+        await context.bot.send_message(chat_id=chat_id, text=MESSAGES["welcome"], parse_mode='Markdown')
+
+
+async def send_media_content(chat_id: int, image_id: str, context: ContextTypes.DEFAULT_TYPE, entry=None):
+    """Send media content to user, timing the delivery for /metrics"""
+    start_time = time.perf_counter()
+    try:
+        await deliver_media_content(chat_id, image_id, context, entry)
+    finally:
+        media_delivery_seconds.observe(time.perf_counter() - start_time)
 
 
-async def send_media_content(chat_id: int, image_id: str, context: ContextTypes.DEFAULT_TYPE):
-    """Send media content to user"""
-    if image_id in media_store:
-        media_type, file_id = media_store[image_id]
+async def deliver_media_content(chat_id: int, image_id: str, context: ContextTypes.DEFAULT_TYPE, entry=None):
+    """Send media content to user; entry is the stored media if the caller already looked it up"""
+    if entry is None:
+        entry = await state_backend.get_media(image_id)
+    if entry:
+        media_type, file_id, _ = entry
         try:
             if media_type == "photo":
                 await context.bot.send_photo(
                     chat_id=chat_id,
                     photo=file_id,
-                    caption="📸 Here's your requested image! Thank you for being a member!"
+                    caption="📸 Here's your requested image! Thank you for being a member!",
+                    rate_limit_args=PRIORITY_CONTENT
                 )
-                logger.info(f"Successfully sent photo (ID: {image_id}) to user in chat {chat_id}")
+                logger.info("Successfully sent photo (ID: %s) to user in chat %s", image_id, chat_id)
             elif media_type == "video":
                 await context.bot.send_video(
                     chat_id=chat_id,
                     video=file_id,
-                    caption="🎥 Here's your requested video! Thank you for being a member!"
+                    caption="🎥 Here's your requested video! Thank you for being a member!",
+                    rate_limit_args=PRIORITY_CONTENT
                 )
-                logger.info(f"Successfully sent video (ID: {image_id}) to user in chat {chat_id}")
+                logger.info("Successfully sent video (ID: %s) to user in chat %s", image_id, chat_id)
+            elif media_type == "album":
+                # Albums store their items as JSON: [[media_type, file_id], ...]
+                items = []
+                for item_type, item_file_id in json.loads(file_id):
+                    # Only the first item's caption is shown under an album
+                    caption = None if items else "📚 Here's your requested content! Thank you for being a member!"
+                    media_class = InputMediaPhoto if item_type == "photo" else InputMediaVideo
+                    items.append(media_class(item_file_id, caption=caption))
+                for i in range(0, len(items), MEDIA_GROUP_LIMIT):
+                    await context.bot.send_media_group(
+                        chat_id=chat_id,
+                        media=items[i:i + MEDIA_GROUP_LIMIT],
+                        rate_limit_args=PRIORITY_CONTENT
+                    )
+                logger.info("Successfully sent album of %s items (ID: %s) to user in chat %s",
+                            len(items), image_id, chat_id)
             else:
                 await context.bot.send_message(chat_id=chat_id, text="❌ Unsupported media type.")
+                return
+            # Private chat, so the chat ID is the user's
+            delivery_analytics.record_delivery(image_id, chat_id)
         except TelegramError as e:
-            logger.error(f"Error sending media (ID: {image_id}): {e}")
+            logger.error("Error sending media (ID: %s): %s", image_id, e)
             await context.bot.send_message(
                 chat_id=chat_id,
                 text="❌ Error sending content. Please try again later or contact support."
             )
     else:
-        logger.warning(f"Content not found for ID: {image_id}")
+        logger.warning("Content not found for ID: %s", image_id)
         await context.bot.send_message(
             chat_id=chat_id,
             text="❌ Content not found or expired. Please get a new link from the channel."
@@ -218,97 +1584,141 @@ async def send_media_content(chat_id: int, image_id: str, context: ContextTypes.
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle callback queries from inline keyboards"""
     query = update.callback_query
+    if not request_throttle.allow(query.from_user.id, query.data):
+        # Flood or double tap: drop it without answering, Telegram stops the spinner by itself
+        logger.info("Throttled callback from user %s", query.from_user.id)
+        return
     await query.answer()
 
+    if query.data.startswith(("check_membership_", "force_check_")):
+        # Both prefixes contain exactly two underscores
+        link = query.data.split("_", 2)[2]
+        image_id = resolve_content_link(link, from_button=True)
+        if image_id is None:
+            await query.edit_message_text(MESSAGES["link_invalid"])
+            return
+        entry = await state_backend.get_media(image_id)
+        gate = policy_gate(entry[2] if entry else None)
+
     if query.data.startswith("check_membership_"):
-        image_id = query.data.replace("check_membership_", "")
         user_id = query.from_user.id
         chat_id = query.message.chat_id
 
-        logger.info(f"Rechecking membership for user {user_id} for content ID: {image_id}")
+        membership_logger.info("Rechecking membership for user %s for content ID: %s", user_id, image_id)
 
         # Show "checking..." message
-        await query.edit_message_text("🔄 **Checking membership...**\n\nPlease wait while we verify your status...",
-                                      parse_mode='Markdown')
-
-        # Wait a bit to let Telegram's systems update
-        await asyncio.sleep(3)
+        await query.edit_message_text(MESSAGES["checking"], parse_mode='Markdown')
 
-        # Force refresh cache and check membership
-        await force_membership_refresh(user_id)
-        is_member = await check_membership_with_fallback(user_id, context)
+        # Force refresh cache and check membership; the user says they joined, so a "left" in the index is re-checked
+        await force_membership_refresh(user_id, channels=gate[1])
+        is_member = await check_gate(user_id, context, gate, recheck_denied=True)
 
         if is_member:
-            await query.edit_message_text("✅ **Success!** Membership verified! Sending your content now...",
-                                          parse_mode='Markdown')
-            await send_media_content(chat_id, image_id, context)
+            await query.edit_message_text(MESSAGES["check_success"], parse_mode='Markdown')
+            await send_media_content(chat_id, image_id, context, entry)
         else:
-            keyboard = [
-                [InlineKeyboardButton("📢 Join Channel", url=f"https://t.me/{MAIN_CHANNEL_USERNAME.lstrip('@')}")],
-                [InlineKeyboardButton("✅ I Joined, Check Again", callback_data=f"check_membership_{image_id}")],
-                [InlineKeyboardButton("🔄 Force Refresh", callback_data=f"force_check_{image_id}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            await query.edit_message_text(
-                text=(
-                    f"❌ **Still Not Detected as Member**\n\n"
-                    f"This can happen due to Telegram's caching. Please:\n\n"
-                    f"1️⃣ Make sure you actually joined {MAIN_CHANNEL_USERNAME}\n"
-                    f"2️⃣ Wait 30 seconds after joining\n"
-                    f"3️⃣ Try 'Force Refresh' button\n"
-                    f"4️⃣ If still failing, leave and rejoin the channel\n\n"
-                    f"⚠️ **Note:** Telegram sometimes takes time to update membership status."
-                ),
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
+            # Telegram may not have caught up with the join yet, re-check in the background
+            schedule_membership_recheck(context, user_id, chat_id, query.message.message_id, link, gate, "check")
 
     elif query.data.startswith("force_check_"):
-        image_id = query.data.replace("force_check_", "")
         user_id = query.from_user.id
         chat_id = query.message.chat_id
 
-        logger.info(f"Force checking membership for user {user_id}")
+        membership_logger.info("Force checking membership for user %s", user_id)
 
-        await query.edit_message_text("🔄 **Force Refreshing...**\n\nClearing cache and doing deep verification...",
-                                      parse_mode='Markdown')
+        await query.edit_message_text(MESSAGES["force_refreshing"], parse_mode='Markdown')
 
         # Clear all cache for this user
-        await force_membership_refresh(user_id)
-
-        # Wait longer for force refresh
-        await asyncio.sleep(5)
+        await force_membership_refresh(user_id, drop_index=True, channels=gate[1])
 
         # Do comprehensive check
-        is_member = await check_membership_with_fallback(user_id, context)
+        is_member = await check_gate(user_id, context, gate)
 
         if is_member:
-            await query.edit_message_text("🎉 **Force Refresh Successful!** Sending content...", parse_mode='Markdown')
-            await send_media_content(chat_id, image_id, context)
+            await query.edit_message_text(MESSAGES["force_success"], parse_mode='Markdown')
+            await send_media_content(chat_id, image_id, context, entry)
         else:
-            # Last resort - show debug info
-            keyboard = [
-                [InlineKeyboardButton("📢 Join Channel", url=f"https://t.me/{MAIN_CHANNEL_USERNAME.lstrip('@')}")],
-                [InlineKeyboardButton("🆘 Contact Support", url="https://t.me/YOURSUPPORTUSERNAME")]
-                # Replace with your support
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            await query.edit_message_text(
-                text=(
-                    f"❌ **Force Refresh Failed**\n\n"
-                    f"We still can't detect your membership in {MAIN_CHANNEL_USERNAME}.\n\n"
-                    f"**Possible solutions:**\n"
-                    f"• Leave the channel completely\n"
-                    f"• Wait 2 minutes\n"
-                    f"• Join again\n"
-                    f"• Try again after 5 minutes\n\n"
-                    f"**Or contact support with your User ID:** `{user_id}`"
-                ),
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
+            schedule_membership_recheck(context, user_id, chat_id, query.message.message_id, link, gate, "force")
+
+
+def schedule_membership_recheck(context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int, message_id: int,
+                                link: str, gate: tuple, kind: str, attempt: int = 0) -> None:
+    """Queue a background membership re-check that updates the gate message when it resolves
+
+    gate is the content's (require_all, channels). kind is the flow that started it ("start",
+    "check" or "force") and decides the final message.
+    """
+    name = f"recheck_{user_id}_{message_id}"
+    if attempt == 0:
+        # A new tap on the same gate message replaces its pending re-checks; other gate messages keep theirs
+        for job in context.job_queue.get_jobs_by_name(name):
+            job.schedule_removal()
+
+    context.job_queue.run_once(
+        recheck_membership_job,
+        when=MEMBERSHIP_RECHECK_DELAYS[attempt],
+        data={
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "link": link,
+            "gate": gate,
+            "kind": kind,
+            "attempt": attempt,
+        },
+        name=name
+    )
+    membership_logger.info("Scheduled membership re-check %s for user %s in %ss",
+                           attempt + 1, user_id, MEMBERSHIP_RECHECK_DELAYS[attempt])
+
+
+async def recheck_membership_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job that re-checks membership and edits the gate message with the outcome"""
+    data = context.job.data
+    user_id = data["user_id"]
+    chat_id = data["chat_id"]
+    message_id = data["message_id"]
+    link = data["link"]
+    gate = data["gate"]
+
+    await force_membership_refresh(user_id, drop_index=data["kind"] == "force", channels=gate[1])
+    is_member = await check_gate(user_id, context, gate, recheck_denied=True)
+
+    if is_member:
+        text = MESSAGES["force_success"] if data["kind"] == "force" else MESSAGES["check_success"]
+        # The link was already accepted from /start or a button when the re-check was scheduled
+        image_id = resolve_content_link(link, from_button=True)
+        if image_id is None:
+            # The link expired while we were waiting
+            text = MESSAGES["link_invalid"]
+        await context.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, parse_mode='Markdown')
+        if image_id is not None:
+            await send_media_content(chat_id, image_id, context)
+        return
+
+    if data["attempt"] + 1 < len(MEMBERSHIP_RECHECK_DELAYS):
+        schedule_membership_recheck(context, user_id, chat_id, message_id, link, gate, data["kind"],
+                                    data["attempt"] + 1)
+        return
+
+    membership_logger.info("Giving up membership re-checks for user %s", user_id)
+    if data["kind"] == "check":
+        await context.bot.edit_message_text(
+            text=gate_text("still_not_member", gate),
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=gate_keyboard("gate", link, gate[1]),
+            parse_mode='Markdown'
+        )
+    elif data["kind"] == "force":
+        # Last resort - show debug info
+        await context.bot.edit_message_text(
+            text=gate_text("force_failed", gate).format(user_id=user_id),
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=gate_keyboard("support", channels=gate[1]),
+            parse_mode='Markdown'
+        )
 
 
 async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -318,29 +1728,68 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Only process messages from the content channel
     if chat.id != CONTENT_CHANNEL_ID:
-        logger.warning(f"Received media from unauthorized chat: {chat.id}")
+        logger.warning("Received media from unauthorized chat: %s", chat.id)
         return
 
-    # Generate unique media index
-    media_index = str(len(media_store) + 1)
-
-    # Store media information
     if message.photo:
-        file_id = message.photo[-1].file_id  # Get highest quality photo
-        media_store[media_index] = ("photo", file_id)
-        media_type = "📸 Photo"
-        logger.info(f"Stored photo with ID: {media_index}")
+        item = ("photo", message.photo[-1].file_id)  # Get highest quality photo
     elif message.video:
-        file_id = message.video.file_id
-        media_store[media_index] = ("video", file_id)
-        media_type = "🎥 Video"
-        logger.info(f"Stored video with ID: {media_index}")
+        item = ("video", message.video.file_id)
     else:
         logger.warning("Received unsupported media type")
         return  # Not a supported media type
 
+    # A "gate: all|any @channel ..." caption line gates the content by those channels
+    policy = parse_gate_policy(message.caption)
+
+    if message.media_group_id:
+        # Part of an album: collect all items and store them as one bundle with one link
+        group_id = message.media_group_id
+        if group_id not in pending_albums:
+            pending_albums[group_id] = {"items": [], "policy": None}
+            context.job_queue.run_once(store_album_job, when=ALBUM_COLLECT_DELAY, data=group_id)
+        pending_albums[group_id]["items"].append(item)
+        # The album caption is on whichever item it was typed under
+        pending_albums[group_id]["policy"] = pending_albums[group_id]["policy"] or policy
+        return
+
+    # Store media information (IDs are allocated by the store and never reused)
+    media_index = await state_backend.add_media(*item, policy)
+    media_type = "📸 Photo" if item[0] == "photo" else "🎥 Video"
+    logger.info("Stored %s with ID: %s", item[0], media_index)
+    await post_content_link(context, media_index, media_type, policy)
+
+
+async def store_album_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job that stores a collected album as a single entry and posts its link"""
+    album = pending_albums.pop(context.job.data)
+    items = album["items"]
+    media_index = await state_backend.add_media("album", json.dumps(items), album["policy"])
+    media_type = f"📚 Album ({len(items)} items)"
+    logger.info("Stored album of %s items with ID: %s", len(items), media_index)
+    await post_content_link(context, media_index, media_type, album["policy"])
+
+
+async def post_content_link(context: ContextTypes.DEFAULT_TYPE, media_index: str, media_type: str,
+                            policy: Optional[str] = None):
+    """Send the share link for stored content back to the content channel"""
     # Create link using your bot username
-    link = f"https://t.me/{BOT_USERNAME}?start=img{media_index}"
+    link = f"https://t.me/{BOT_USERNAME}?start={make_link_token(media_index)}"
+
+    require_all, channels = policy_gate(policy)
+    if channels:
+        # Usernames go into Markdown, where their underscores would start italics
+        names = {channel: escape_markdown(channel, version=1) for channel in channels}
+        gate = f"{'all' if require_all else 'any'} of {', '.join(names.values())}"
+        # Membership can only be checked in channels where the bot is an admin
+        results = await asyncio.gather(*(check_channel_access(context.bot, channel) for channel in channels),
+                                       return_exceptions=True)
+        unchecked = [names[channel] for channel, result in zip(channels, results)
+                     if isinstance(result, Exception) or not result[1]]
+        if unchecked:
+            gate += f"\n⚠️ Bot is not an admin in {', '.join(unchecked)}, members there will be denied"
+    else:
+        gate = escape_markdown(MAIN_CHANNEL_USERNAME, version=1)
 
     # Send the link back to content channel with better formatting
     await context.bot.send_message(
@@ -350,6 +1799,7 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"📋 **Details:**\n"
             f"• Type: {media_type}\n"
             f"• ID: `{media_index}`\n"
+            f"• Gate: {gate}\n"
             f"• Status: ✅ Ready\n"
             f"• Timestamp: {time.strftime('%H:%M:%S')}\n\n"
             f"🔗 **Share Link:**\n`{link}`\n\n"
@@ -358,7 +1808,7 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
-    logger.info(f"Generated and sent link for {media_type.lower()} (ID: {media_index}): {link}")
+    logger.info("Generated and sent link for %s (ID: %s): %s", media_type.lower(), media_index, link)
 
 
 async def debug(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -366,55 +1816,87 @@ async def debug(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     user = update.effective_user
 
-    debug_info = f"🔧 **Debug Information**\n\n"
-    debug_info += f"**Chat Details:**\n"
-    debug_info += f"• Chat ID: `{chat.id}`\n"
-    debug_info += f"• Chat Type: `{chat.type}`\n"
-    debug_info += f"• Chat Title: {getattr(chat, 'title', 'N/A')}\n\n"
-    debug_info += f"**User Details:**\n"
-    debug_info += f"• User ID: `{user.id}`\n"
-    debug_info += f"• Username: @{user.username or 'None'}\n"
-    debug_info += f"• First Name: {user.first_name}\n\n"
-    debug_info += f"**Bot Status:**\n"
-    debug_info += f"• Media Store Size: {len(media_store)}\n"
-    debug_info += f"• Cache Entries: {len(membership_cache)}\n"
-    debug_info += f"• Main Channel: {MAIN_CHANNEL_USERNAME}\n"
-    debug_info += f"• Content Channel ID: `{CONTENT_CHANNEL_ID}`\n"
+    lines = [
+        "🔧 **Debug Information**\n",
+        "**Chat Details:**",
+        f"• Chat ID: `{chat.id}`",
+        f"• Chat Type: `{chat.type}`",
+        f"• Chat Title: {getattr(chat, 'title', 'N/A')}\n",
+        "**User Details:**",
+        f"• User ID: `{user.id}`",
+        f"• Username: @{user.username or 'None'}",
+        f"• First Name: {user.first_name}\n",
+        "**Bot Status:**",
+        f"• Media Store Size: {await state_backend.media_count()}",
+        f"• Cache Entries: {len(membership_cache)}/{membership_cache.max_size}",
+        f"• Cache Hits/Misses: {membership_cache.hits}/{membership_cache.misses} ({membership_cache.hit_ratio():.0%})",
+        f"• Cache Evictions/Expirations: {membership_cache.evictions}/{membership_cache.expirations}",
+        f"• Indexed Members: {len(membership_index)}/{membership_index.max_size} ({membership_index.evictions} evicted)",
+        f"• API Queue Depth: {rate_limiter.queue_depth()} (max {rate_limiter.max_queue_depth}, "
+        f"{rate_limiter.requests} sent, {rate_limiter.retries} rate-limit retries)",
+        f"• Requests Allowed/Throttled/Deduplicated: {request_throttle.allowed}/{request_throttle.throttled}/"
+        f"{request_throttle.deduplicated}",
+        f"• Log Records Dropped/Sampled Out: {log_queue_handler.dropped}/{membership_log_filter.sampled_out}",
+        f"• Main Channel: {MAIN_CHANNEL_USERNAME}",
+        f"• Content Channel ID: `{CONTENT_CHANNEL_ID}`",
+    ]
 
     # Enhanced membership check for private chats
     if chat.type == 'private':
         try:
-            debug_info += f"\n**🔍 Membership Check:**\n"
+            lines.append("\n**🔍 Membership Check:**")
             start_time = time.time()
             is_member = await check_membership_with_fallback(user.id, context)
             check_time = time.time() - start_time
-            debug_info += f"• Status: {'✅ Member' if is_member else '❌ Not Member'}\n"
-            debug_info += f"• Check Time: {check_time:.2f}s\n"
+            lines.append(f"• Status: {'✅ Member' if is_member else '❌ Not Member'}")
+            lines.append(f"• Check Time: {check_time:.2f}s")
 
             # Show cache status
-            cache_key = f"user_{user.id}"
-            if cache_key in membership_cache:
-                cached_time, cached_result = membership_cache[cache_key]
-                age = time.time() - cached_time
-                debug_info += f"• Cache Status: ✅ Cached ({age:.1f}s old)\n"
+            age = membership_cache.age((MAIN_CHANNEL_ID, user.id))
+            if age is not None:
+                lines.append(f"• Cache Status: ✅ Cached ({age:.1f}s old)")
             else:
-                debug_info += f"• Cache Status: ❌ Not Cached\n"
+                lines.append("• Cache Status: ❌ Not Cached")
 
         except Exception as e:
-            debug_info += f"• Membership Check: ❌ Error - {str(e)}\n"
+            lines.append(f"• Membership Check: ❌ Error - {str(e)}")
+
+    debug_info = "\n".join(lines) + "\n"
+    await context.bot.send_message(chat_id=chat.id, text=debug_info, parse_mode='Markdown',
+                                   rate_limit_args=PRIORITY_ADMIN)
+
 
-    await update.message.reply_text(debug_info, parse_mode='Markdown')
+async def check_channel_access(bot: Bot, channel_id):
+    """Fetch a channel and whether the bot is one of its admins; raises TelegramError if it can't be read"""
+    chat_info, admins = await asyncio.gather(bot.get_chat(channel_id), bot.get_chat_administrators(channel_id))
+    return chat_info, any(admin.user.id == bot.id for admin in admins)
+
+
+async def verify_channels(bot: Bot):
+    """Resolve MAIN_CHANNEL_ID to its numeric ID and make sure the bot is an admin of both channels"""
+    global MAIN_CHANNEL_ID
+    channel_ids = (MAIN_CHANNEL_ID, CONTENT_CHANNEL_ID)
+    results = await asyncio.gather(*(check_channel_access(bot, channel_id) for channel_id in channel_ids),
+                                   return_exceptions=True)
+    problems = []
+    for channel_id, result in zip(channel_ids, results):
+        if isinstance(result, Exception):
+            problems.append(f"{channel_id}: {result}")
+        elif not result[1]:
+            problems.append(f"{channel_id}: bot is not an admin")
+    if problems:
+        raise RuntimeError(f"Channel check failed, fix the config or the bot's rights: {'; '.join(problems)}")
+
+    main_chat = results[0][0]
+    if MAIN_CHANNEL_ID != main_chat.id:
+        logger.info("📢 Resolved %s to channel ID %s", MAIN_CHANNEL_ID, main_chat.id)
+        MAIN_CHANNEL_ID = main_chat.id
 
 
 async def test_channel_access(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Test if bot can access the main channel"""
     try:
-        # Try to get channel info
-        chat_info = await context.bot.get_chat(MAIN_CHANNEL_ID)
-
-        # Try to get administrators
-        admins = await context.bot.get_chat_administrators(MAIN_CHANNEL_ID)
-        bot_is_admin = any(admin.user.id == context.bot.id for admin in admins)
+        chat_info, bot_is_admin = await check_channel_access(context.bot, MAIN_CHANNEL_ID)
 
         result = f"🔍 **Channel Access Test**\n\n"
         result += f"✅ **Channel Found!**\n"
@@ -424,54 +1906,555 @@ async def test_channel_access(update: Update, context: ContextTypes.DEFAULT_TYPE
         result += f"• Members: {getattr(chat_info, 'member_count', 'Unknown')}\n"
         result += f"• Bot is Admin: {'✅ Yes' if bot_is_admin else '❌ No'}\n"
 
-        await update.message.reply_text(result, parse_mode='Markdown')
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=result, parse_mode='Markdown',
+                                       rate_limit_args=PRIORITY_ADMIN)
 
     except BadRequest as e:
-        await update.message.reply_text(
+        await context.bot.send_message(
+            update.effective_chat.id,
             f"❌ **Channel Access Failed**\n\n"
             f"Error: `{str(e)}`\n\n"
             f"**Solutions:**\n"
             f"1. Add bot to {MAIN_CHANNEL_USERNAME} as admin\n"
             f"2. Give bot 'Read Messages' permission\n"
             f"3. Make sure channel username is correct",
-            parse_mode='Markdown'
+            parse_mode='Markdown',
+            rate_limit_args=PRIORITY_ADMIN
         )
     except Exception as e:
-        await update.message.reply_text(f"❌ Unexpected error: `{str(e)}`", parse_mode='Markdown')
+        await context.bot.send_message(update.effective_chat.id, f"❌ Unexpected error: `{str(e)}`",
+                                       parse_mode='Markdown', rate_limit_args=PRIORITY_ADMIN)
+
+
+async def prewarm_memberships(user_ids: list, context: ContextTypes.DEFAULT_TYPE, report=None) -> dict:
+    """Check membership of many users in concurrent batches so later requests hit the cache
+
+    report, if given, is awaited with the running totals at most every PREWARM_PROGRESS_INTERVAL seconds.
+    """
+    results = {"total": len(user_ids), "done": 0, "members": 0, "non_members": 0, "unknown": 0, "skipped": 0}
+    start_time = time.monotonic()
+    last_report = start_time
+
+    for i in range(0, len(user_ids), PREWARM_CONCURRENCY):
+        batch = []
+        for user_id in user_ids[i:i + PREWARM_CONCURRENCY]:
+            if membership_index.get(user_id) is not None or membership_cache.get((MAIN_CHANNEL_ID, user_id)) is not None:
+                results["skipped"] += 1
+            else:
+                batch.append(user_id)
+
+        outcomes = await asyncio.gather(
+            *(check_membership_with_fallback(user_id, context, PRIORITY_BACKGROUND) for user_id in batch),
+            return_exceptions=True
+        )
+        for outcome in outcomes:
+            if outcome is True:
+                results["members"] += 1
+            elif outcome is False:
+                results["non_members"] += 1
+            else:
+                results["unknown"] += 1
+        results["done"] = min(i + PREWARM_CONCURRENCY, len(user_ids))
+
+        if report is not None and time.monotonic() - last_report >= PREWARM_PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            await report(results)
+
+    results["seconds"] = time.monotonic() - start_time
+    logger.info("Pre-warmed membership of %s users in %.1fs: %s", results["total"], results["seconds"], results)
+    return results
+
+
+def format_prewarm_results(results: dict) -> str:
+    text = (
+        f"🔥 **Membership Pre-warm**\n\n"
+        f"• Progress: {results['done']}/{results['total']}\n"
+        f"• Members: {results['members']}\n"
+        f"• Not Members: {results['non_members']}\n"
+        f"• Inconclusive: {results['unknown']}\n"
+        f"• Already Known: {results['skipped']}\n"
+    )
+    if "seconds" in results:
+        text += f"• Time: {results['seconds']:.1f}s\n"
+    return text
+
+
+async def prewarm(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pre-warm membership for the given user IDs, or the most recent requesters"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+
+    try:
+        user_ids = [int(arg) for arg in context.args]
+    except ValueError:
+        await context.bot.send_message(update.effective_chat.id, "❌ Usage: `/prewarm [user_id ...]`",
+                                       parse_mode='Markdown', rate_limit_args=PRIORITY_ADMIN)
+        return
+    if not user_ids:
+        user_ids = await state_backend.recent_requesters(PREWARM_MAX_USERS)
+
+    status_message = await context.bot.send_message(
+        update.effective_chat.id,
+        f"🔥 **Pre-warming {len(user_ids)} users...**",
+        parse_mode='Markdown',
+        rate_limit_args=PRIORITY_ADMIN
+    )
+
+    async def report(results):
+        await status_message.edit_text(format_prewarm_results(results), parse_mode='Markdown')
+
+    async def run():
+        results = await prewarm_memberships(user_ids, context, report)
+        await report(results)
+
+    # Runs in the background so the handler returns right away
+    context.application.create_task(run(), update=update)
+
+
+async def prewarm_job(context: ContextTypes.DEFAULT_TYPE):
+    """Scheduled pre-warm of the most recent requesters"""
+    user_ids = await state_backend.recent_requesters(PREWARM_MAX_USERS)
+    # Every worker runs this job, so each one warms only the users routed to it
+    user_ids = [user_id for user_id in user_ids if user_id % WORKER_COUNT == worker_shard]
+    await prewarm_memberships(user_ids, context)
 
 
 async def clear_cache(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Clear membership cache"""
     cache_size = len(membership_cache)
+    index_size = len(membership_index)
     membership_cache.clear()
+    membership_index.clear()
 
-    await update.message.reply_text(
-        f"🗑️ **Cache Cleared!**\n\nRemoved {cache_size} cached entries.",
-        parse_mode='Markdown'
+    await context.bot.send_message(
+        update.effective_chat.id,
+        f"🗑️ **Cache Cleared!**\n\nRemoved {cache_size} cached entries and {index_size} indexed members.",
+        parse_mode='Markdown',
+        rate_limit_args=PRIORITY_ADMIN
     )
-    logger.info(f"Cleared {cache_size} cache entries")
+    logger.info("Cleared %s cache entries and %s index entries", cache_size, index_size)
 
 
-if __name__ == "__main__":
-    # Create application
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+def format_stats_period(title: str, counts: dict) -> str:
+    text = (
+        f"**{title}:**\n"
+        f"• Requests: {counts['requests']}\n"
+        f"• Denied: {counts['denials']}\n"
+        f"• Delivered: {counts['deliveries']}\n"
+    )
+    if counts["joins"]:
+        text += f"• Joined After Denial: {counts['joins']} (avg {counts['join_seconds'] / counts['joins']:.0f}s)\n"
+    else:
+        text += "• Joined After Denial: 0\n"
+    return text
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show delivery stats of a content ID or share link"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+
+    # Accept the ID, the start parameter or the whole share link
+    target = context.args[0].rsplit("start=", 1)[-1] if context.args else ""
+    image_id = target if re.fullmatch(r"[0-9]{1,18}", target) else resolve_content_link(target)
+    if image_id is None:
+        await context.bot.send_message(update.effective_chat.id, "❌ Usage: `/stats <content ID or link>`",
+                                       parse_mode='Markdown', rate_limit_args=PRIORITY_ADMIN)
+        return
+
+    results = await delivery_analytics.stats(image_id)
+    await context.bot.send_message(
+        update.effective_chat.id,
+        f"📈 **Stats for ID `{image_id}`**\n\n"
+        f"{format_stats_period('All Time', results['total'])}\n"
+        f"{format_stats_period('Last 24 Hours', results['last_24h'])}",
+        parse_mode='Markdown',
+        rate_limit_args=PRIORITY_ADMIN
+    )
+
+
+async def prune_membership_cache():
+    """Periodically drop expired cache and throttle entries so idle users don't hold memory"""
+    while True:
+        await asyncio.sleep(CACHE_PRUNE_INTERVAL)
+        request_throttle.prune()
+        pruned = membership_cache.prune_expired()
+        if pruned:
+            logger.info("Pruned %s expired cache entries", pruned)
+
+
+async def flush_analytics():
+    """Periodically write the delivery analytics rollups"""
+    while True:
+        await asyncio.sleep(ANALYTICS_FLUSH_INTERVAL)
+        await delivery_analytics.flush()
+
+
+background_tasks = []
+background_servers = []
+
+
+def render_metrics(application) -> str:
+    """Render all metrics in the Prometheus text format"""
+    gauges = [
+        ("membership_cache_hit_ratio", "Share of membership lookups answered by the cache",
+         membership_cache.hit_ratio()),
+        ("membership_cache_entries", "Entries in the membership cache", len(membership_cache)),
+        ("membership_index_entries", "Users in the membership index", len(membership_index)),
+        ("membership_index_evictions", "Users dropped from the full membership index", membership_index.evictions),
+        # The update queue is drained into handler tasks at once, so count the updates being handled
+        ("updates_in_progress", "Updates being handled right now",
+         application.update_processor.current_concurrent_updates),
+        ("api_queue_depth", "Bot API requests waiting for the rate limiter", rate_limiter.queue_depth()),
+        ("requests_allowed", "User requests let through the flood throttle", request_throttle.allowed),
+        ("requests_throttled", "User requests rejected by the per-user limit", request_throttle.throttled),
+        ("requests_deduplicated", "Repeated identical user requests dropped", request_throttle.deduplicated),
+        ("log_records_dropped", "Log records dropped because the buffer was full", log_queue_handler.dropped),
+        ("log_records_sampled_out", "Membership log records skipped by sampling",
+         membership_log_filter.sampled_out),
+        ("analytics_events", "Delivery analytics events recorded", delivery_analytics.events),
+        ("analytics_pending_rollups", "Analytics rollups waiting to be written", len(delivery_analytics.pending)),
+    ]
+    sections = [metric.render() for metric in (membership_check_seconds, media_delivery_seconds,
+                                               api_requests_total, api_errors_total)]
+    for name, help_text, value in gauges:
+        sections.append(f"# HELP {name} {help_text}\n# TYPE {name} gauge\n{name} {value}")
+    return "\n".join(sections) + "\n"
+
+
+async def handle_metrics_request(application, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Answer GET /metrics; anything else gets a 404"""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), WEBHOOK_READ_TIMEOUT)
+        if request_line.startswith(b"GET /metrics "):
+            body = render_metrics(application).encode()
+            header = "HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+        else:
+            body = b""
+            header = "HTTP/1.1 404 Not Found\r\n"
+        writer.write(f"{header}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def on_startup(application):
+    if VERIFY_CHANNELS_ON_STARTUP:
+        await verify_channels(application.bot)
+    background_tasks.append(asyncio.create_task(prune_membership_cache()))
+    background_tasks.append(asyncio.create_task(flush_analytics()))
+    if PREWARM_INTERVAL:
+        application.job_queue.run_repeating(prewarm_job, interval=PREWARM_INTERVAL, name="prewarm")
+    if METRICS_PORT:
+        port = METRICS_PORT + worker_shard
+        server = await asyncio.start_server(
+            lambda reader, writer: handle_metrics_request(application, reader, writer),
+            METRICS_LISTEN,
+            port
+        )
+        background_servers.append(server)
+        logger.info("📊 Metrics available on http://%s:%s/metrics", METRICS_LISTEN, port)
+
+
+async def on_shutdown(application):
+    for task in background_tasks:
+        task.cancel()
+    for server in background_servers:
+        server.close()
+    await state_backend.close()
+    await delivery_analytics.close()
+
+
+async def handle_webhook_request(dispatch, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Minimal HTTP/1.1 handler: validate the request and pass the update JSON to dispatch"""
+    status = "200 OK"
+
+    async def read_request():
+        """Read the whole request; returns the body, or None if the headers already ruled it out"""
+        nonlocal status
+        request_line = await reader.readline()
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+            if len(headers) > 100:
+                raise ValueError("too many headers")
+
+        content_length = int(headers.get("content-length", "0"))
+        secret = headers.get("x-telegram-bot-api-secret-token", "")
+
+        if method != "POST" or path != WEBHOOK_PATH:
+            status = "404 Not Found"
+        elif not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+            status = "403 Forbidden"
+            logger.warning("Rejected webhook request with invalid secret token")
+        elif content_length > WEBHOOK_MAX_BODY_SIZE:
+            status = "413 Payload Too Large"
+            logger.warning("Rejected webhook request with %s byte body", content_length)
+        else:
+            return await reader.readexactly(content_length)
+        return None
+
+    try:
+        # One deadline for the whole request, so a client trickling in a line at a time can't hold the connection
+        body = await asyncio.wait_for(read_request(), WEBHOOK_READ_TIMEOUT)
+        if body is not None:
+            await dispatch(json.loads(body))
+    except (ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+        logger.warning("Bad webhook request: %r", e)
+        status = "400 Bad Request"
+    except Exception as e:
+        logger.error("Error handling webhook request: %s", e)
+        status = "500 Internal Server Error"
+
+    try:
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def stop_on_signal() -> asyncio.Event:
+    """Event that is set on SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    return stop_event
+
+
+async def serve_webhook(bot: Bot, dispatch, stop_event: Optional[asyncio.Event] = None):
+    """Serve updates over a webhook until SIGINT/SIGTERM or until stop_event is set"""
+    if stop_event is None:
+        stop_event = stop_on_signal()
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_webhook_request(dispatch, reader, writer),
+        WEBHOOK_LISTEN,
+        WEBHOOK_PORT
+    )
+    await bot.set_webhook(
+        url=WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES
+    )
+    logger.info("🌐 Webhook server listening on %s:%s%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Shutting down webhook server...")
+        # Stop accepting requests first, the caller then lets queued updates finish processing
+        server.close()
+        await server.wait_closed()
+
+
+async def run_webhook(application):
+    """Run the application in webhook mode, then shut down gracefully"""
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+
+    async def dispatch(data):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    try:
+        await serve_webhook(application.bot, dispatch)
+    finally:
+        await application.stop()
+        await on_shutdown(application)
+        await application.shutdown()
+
+
+def shard_for_update(data: dict) -> int:
+    """Pick the worker for an update so all updates of a user land in the same process"""
+    for value in data.values():
+        if isinstance(value, dict):
+            # For chat_member updates "from" is whoever made the change, not the member
+            user = value.get("new_chat_member", {}).get("user") or value.get("from")
+            if user:
+                return user["id"] % WORKER_COUNT
+    # Channel posts have no user, they all go to the first worker
+    return 0
+
+
+def shards_for_update(data: dict) -> list:
+    """Workers an update is sent to"""
+    if "my_chat_member" in data:
+        # The bot's own status changed; every worker keeps a membership index that may have to be dropped
+        return list(range(WORKER_COUNT))
+    return [shard_for_update(data)]
+
+
+async def poll_updates(bot: Bot, dispatch, stop_event: Optional[asyncio.Event] = None):
+    """Long-poll getUpdates until SIGINT/SIGTERM or until stop_event is set, passing each update's JSON to dispatch"""
+    if stop_event is None:
+        stop_event = stop_on_signal()
+    await bot.delete_webhook()
+
+    async def poll():
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+            except TelegramError as e:
+                logger.error("Error fetching updates: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                try:
+                    await dispatch(update.to_dict())
+                except Exception as e:
+                    # Stop before the next getUpdates confirms the offset, so Telegram keeps the update
+                    logger.error("Stopped polling, update %s not delivered: %s", update.update_id, e)
+                    stop_event.set()
+                    return
+                offset = update.update_id + 1
+
+    poller = asyncio.create_task(poll())
+    await stop_event.wait()
+    poller.cancel()
+
+
+async def watch_workers(workers: list, stop_event: asyncio.Event):
+    """Set stop_event as soon as any worker process exits"""
+    while all(worker.is_alive() for worker in workers):
+        await asyncio.sleep(1)
+    stop_event.set()
+
+
+async def run_sharded():
+    """Receive updates in this process and route them to worker processes by user_id"""
+    async with Bot(BOT_TOKEN, base_url=BOT_API_BASE_URL, base_file_url=BOT_API_FILE_URL) as bot:
+        if VERIFY_CHANNELS_ON_STARTUP:
+            # Once for all workers, and before any update is taken from Telegram
+            await verify_channels(bot)
+
+        mp_context = multiprocessing.get_context("spawn")
+        queues = [mp_context.Queue() for _ in range(WORKER_COUNT)]
+        workers = [
+            mp_context.Process(target=run_worker, args=(shard, updates, MAIN_CHANNEL_ID))
+            for shard, updates in enumerate(queues)
+        ]
+        for worker in workers:
+            worker.start()
+
+        async def dispatch(data):
+            for shard in shards_for_update(data):
+                if not workers[shard].is_alive():
+                    # Refuse the update instead of queueing it for nobody; Telegram delivers it again
+                    raise RuntimeError(f"worker {shard} exited with code {workers[shard].exitcode}")
+                queues[shard].put(data)
+
+        stop_event = stop_on_signal()
+        watcher = asyncio.create_task(watch_workers(workers, stop_event))
+        try:
+            if BOT_MODE == "webhook":
+                await serve_webhook(bot, dispatch, stop_event)
+            else:
+                await poll_updates(bot, dispatch, stop_event)
+        finally:
+            watcher.cancel()
+            for updates in queues:
+                updates.put(None)
+            for worker in workers:
+                await asyncio.to_thread(worker.join)
+
+    exited = [f"worker {shard} (code {worker.exitcode})" for shard, worker in enumerate(workers) if worker.exitcode]
+    if exited:
+        raise RuntimeError(f"Stopped because {', '.join(exited)} exited")
+
+
+async def serve_worker(shard: int, updates):
+    application = build_application(with_updater=False)
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+    logger.info("👷 Worker %s started", shard)
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        await application.stop()
+        await on_shutdown(application)
+        await application.shutdown()
+        logger.info("👷 Worker %s stopped", shard)
+
+
+def run_worker(shard: int, updates, main_channel_id):
+    """Entry point of a worker process"""
+    global worker_shard, MAIN_CHANNEL_ID, VERIFY_CHANNELS_ON_STARTUP
+    worker_shard = shard
+    # The parent has already checked the channels and resolved an @username to its ID
+    MAIN_CHANNEL_ID = main_channel_id
+    VERIFY_CHANNELS_ON_STARTUP = False
+    # The parent handles Ctrl+C and stops workers by sending None
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve_worker(shard, updates))
+
+
+def build_application(with_updater: bool = True):
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .base_url(BOT_API_BASE_URL)
+        .base_file_url(BOT_API_FILE_URL)
+        .rate_limiter(rate_limiter)
+        .concurrent_updates(MAX_CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if not with_updater:
+        # Updates are fed in by the parent process
+        builder = builder.updater(None)
+    application = builder.build()
 
     # Add handlers
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CallbackQueryHandler(handle_callback_query))
-    app.add_handler(MessageHandler(
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CallbackQueryHandler(handle_callback_query))
+    application.add_handler(MessageHandler(
         filters.Chat(CONTENT_CHANNEL_ID) & (filters.PHOTO | filters.VIDEO),
         handle_media
     ))
-    app.add_handler(CommandHandler("debug", debug))
-    app.add_handler(CommandHandler("testchannel", test_channel_access))
-    app.add_handler(CommandHandler("clearcache", clear_cache))
+    application.add_handler(CommandHandler("debug", debug))
+    application.add_handler(CommandHandler("testchannel", test_channel_access))
+    application.add_handler(CommandHandler("clearcache", clear_cache))
+    application.add_handler(CommandHandler("prewarm", prewarm))
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(ChatMemberHandler(track_chat_member, ChatMemberHandler.CHAT_MEMBER))
+    application.add_handler(ChatMemberHandler(track_my_chat_member, ChatMemberHandler.MY_CHAT_MEMBER))
+    return application
+
 
+if __name__ == "__main__":
     logger.info("🤖 Enhanced Bot started successfully!")
-    logger.info(f"📢 Main Channel: {MAIN_CHANNEL_USERNAME} (ID: {MAIN_CHANNEL_ID})")
-    logger.info(f"📁 Content Channel ID: {CONTENT_CHANNEL_ID}")
-    logger.info(f"🔗 Bot Username: @{BOT_USERNAME}")
+    logger.info("📢 Main Channel: %s (ID: %s)", MAIN_CHANNEL_USERNAME, MAIN_CHANNEL_ID)
+    logger.info("📁 Content Channel ID: %s", CONTENT_CHANNEL_ID)
+    logger.info("🔗 Bot Username: @%s", BOT_USERNAME)
     logger.info("✅ Enhanced membership checking enabled!")
+    if LINK_SECRET == "change-me-too":
+        # Works, but should never reach production
+        logger.warning("⚠️ LINK_SECRET is still the default value; anyone can forge content links")
 
-    # Start polling
-    app.run_polling()
+    if WORKER_COUNT > 1:
+        asyncio.run(run_sharded())
+    else:
+        app = build_application()
+        if BOT_MODE == "webhook":
+            asyncio.run(run_webhook(app))
+        else:
+            # Start polling (chat_member updates are only delivered when requested explicitly)
+            app.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# main.py reads its settings at import; keep tests off the network and off disk
+os.environ["STUDY_BOT_CONFIG"] = os.path.join(os.path.dirname(__file__), "missing-config.json")
+os.environ["STUDY_BOT_STATE_BACKEND"] = "memory"
+os.environ["STUDY_BOT_ANALYTICS_DB_PATH"] = ":memory:"
+os.environ["STUDY_BOT_LOG_LEVEL"] = "WARNING"
+# main.py refuses to import with an invalid configuration
+os.environ["STUDY_BOT_BOT_TOKEN"] = "123456:" + "a" * 35
+os.environ["STUDY_BOT_MAIN_CHANNEL_ID"] = "-1001000000001"
+os.environ["STUDY_BOT_CONTENT_CHANNEL_ID"] = "-1001000000002"
+os.environ["STUDY_BOT_MAIN_CHANNEL_USERNAME"] = "@study_main"
+os.environ["STUDY_BOT_BOT_USERNAME"] = "study_test_bot"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "telegram_study_bot"))
+
+import main  # noqa: E402
+
+
+class FakeBot:
+    """Records every Bot API call; get_chat_member answers from statuses after an optional delay"""
+
+    id = 1000
+
+    def __init__(self, statuses=None, delay=0.0):
+        self.statuses = statuses or {}  # chat -> status, "member" if missing
+        self.delay = delay
+        self.calls = []
+        self.message_ids = iter(range(1, 1_000_000))
+
+    def count(self, method: str) -> int:
+        return sum(1 for call in self.calls if call[0] == method)
+
+    async def get_chat_member(self, chat_id, user_id, **kwargs):
+        self.calls.append(("get_chat_member", chat_id, user_id))
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(status=self.statuses.get(chat_id, "member"))
+
+    def __getattr__(self, method):
+        async def call(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+            return SimpleNamespace(message_id=next(self.message_ids))
+        return call
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, data=None, name=None):
+        job = SimpleNamespace(callback=callback, when=when, data=data, name=name, removed=False)
+        job.schedule_removal = lambda: setattr(job, "removed", True)
+        self.jobs.append(job)
+        return job
+
+    def get_jobs_by_name(self, name):
+        return [job for job in self.jobs if job.name == name and not job.removed]
+
+
+class VirtualClock:
+    """Stands in for time.monotonic and asyncio.sleep in main, so rate-limited runs take no real time"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, delay, result=None):
+        # A real sleep always lets some time pass; without it rounding can leave a bucket just short of a token
+        self.now += max(delay, 1e-6)
+        await real_sleep(0)
+        return result
+
+
+real_sleep = asyncio.sleep
+
+
+@pytest.fixture
+def virtual_clock(monkeypatch):
+    clock = VirtualClock()
+    monkeypatch.setattr(main, "time", SimpleNamespace(monotonic=clock.monotonic, perf_counter=clock.monotonic,
+                                                      time=time.time))
+    monkeypatch.setattr(main, "asyncio", SimpleNamespace(**{**vars(asyncio), "sleep": clock.sleep}))
+    return clock
+
+
+def make_context(bot, args=()):
+    return SimpleNamespace(bot=bot, args=list(args), job_queue=FakeJobQueue())
+
+
+def make_update(user_id, text_args=None, callback_data=None, message_id=1):
+    user = SimpleNamespace(id=user_id, username="tester", first_name="Test")
+    chat = SimpleNamespace(id=user_id, type="private")
+    update = SimpleNamespace(effective_user=user, effective_chat=chat, callback_query=None)
+    if callback_data is not None:
+        bot_calls = []
+
+        async def record(*args, **kwargs):
+            bot_calls.append((args, kwargs))
+
+        update.callback_query = SimpleNamespace(
+            data=callback_data, from_user=user, message=SimpleNamespace(chat_id=user_id, message_id=message_id),
+            answer=record, edit_message_text=record, calls=bot_calls
+        )
+    return update
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    """Module-level caches and counters are shared by every handler, start each test empty"""
+    main.membership_cache.clear()
+    main.membership_index.clear()
+    main.pending_membership_checks.clear()
+    main.pending_albums.clear()
+    main.request_throttle.requests.clear()
+    main.request_throttle.last_seen.clear()
+    main.state_backend = main.MemoryBackend()
+    yield
@@ -0,0 +1,48 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import main
+from conftest import FakeBot, make_context
+
+
+def channel_post(file_id, group_id=None):
+    message = SimpleNamespace(
+        photo=[SimpleNamespace(file_id=f"{file_id}_small"), SimpleNamespace(file_id=file_id)],
+        video=None, media_group_id=group_id, caption=None
+    )
+    return SimpleNamespace(effective_message=message, effective_chat=SimpleNamespace(id=main.CONTENT_CHANNEL_ID))
+
+
+def test_album_items_are_stored_once_with_one_link():
+    bot = FakeBot()
+    context = make_context(bot)
+
+    async def run():
+        for i in range(4):
+            await main.handle_media(channel_post(f"p{i}", group_id="g1"), context)
+        [job] = context.job_queue.jobs
+        context.job = job
+        await job.callback(context)
+
+    asyncio.run(run())
+    assert bot.count("send_message") == 1
+    media_type, file_id, _ = asyncio.run(main.state_backend.get_media("1"))
+    assert media_type == "album"
+    assert json.loads(file_id) == [["photo", f"p{i}"] for i in range(4)]
+
+
+def test_album_delivery_uses_one_call_per_ten_items():
+    bot = FakeBot()
+    context = make_context(bot)
+
+    async def run(count):
+        items = [["photo", f"p{i}"] for i in range(count)]
+        media_id = await main.state_backend.add_media("album", json.dumps(items))
+        await main.send_media_content(42, media_id, context)
+
+    asyncio.run(run(3))
+    assert bot.count("send_media_group") == 1
+    asyncio.run(run(12))
+    assert bot.count("send_media_group") == 3
+    assert bot.count("send_photo") == 0
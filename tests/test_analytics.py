@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+import main
+from conftest import FakeBot, make_context, make_update
+
+
+@pytest.fixture
+def analytics(monkeypatch):
+    analytics = main.DeliveryAnalytics(":memory:", 100)
+    monkeypatch.setattr(main, "delivery_analytics", analytics)
+    yield analytics
+    asyncio.run(analytics.close())
+
+
+def test_unknown_content_is_not_counted(analytics):
+    bot = FakeBot(statuses={main.MAIN_CHANNEL_ID: "left"})
+
+    async def run():
+        for link in ("img999999999999999999", main.make_link_token("424242")):
+            await main.start(make_update(42), make_context(bot, args=[link]))
+
+    asyncio.run(run())
+    assert analytics.pending == {}
+
+
+def test_request_denial_and_delivery_are_counted(analytics):
+    media_id = asyncio.run(main.state_backend.add_media("photo", "file1"))
+    link = main.make_link_token(media_id)
+    bot = FakeBot(statuses={main.MAIN_CHANNEL_ID: "left"})
+
+    async def run():
+        await main.start(make_update(42), make_context(bot, args=[link]))
+        # The user joins, as reported by the channel's chat_member update
+        main.membership_index.set(42, True)
+        await main.handle_callback_query(make_update(42, callback_data=f"check_membership_{link}"), make_context(bot))
+        return await analytics.stats(media_id)
+
+    total = asyncio.run(run())["total"]
+    assert (total["requests"], total["denials"], total["deliveries"], total["joins"]) == (1, 1, 1, 1)
+
+
+def test_failed_write_keeps_the_counts_for_the_next_flush(analytics, monkeypatch):
+    analytics.record_request("7")
+
+    def fail(batch):
+        raise OverflowError("Python int too large to convert to SQLite INTEGER")
+
+    monkeypatch.setattr(analytics, "write", fail)
+    asyncio.run(analytics.flush())
+    assert analytics.pending[next(iter(analytics.pending))][0] == 1
+
+    monkeypatch.undo()
+    analytics.record_request("7")
+    assert asyncio.run(analytics.stats("7"))["total"]["requests"] == 2
+
+
+@pytest.mark.parametrize("target", ["12³", "9" * 25, "img"])
+def test_stats_rejects_ids_that_are_not_plain_digits(monkeypatch, analytics, target):
+    monkeypatch.setattr(main, "ADMIN_USER_IDS", {42})
+    bot = FakeBot()
+    asyncio.run(main.stats(make_update(42), make_context(bot, args=[target])))
+    [(method, args, kwargs)] = bot.calls
+    assert "Usage" in args[1]
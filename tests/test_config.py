@@ -0,0 +1,138 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    """A valid configuration; load_config writes module globals, so every setting is restored afterwards"""
+    for name in main.SETTINGS:
+        monkeypatch.setattr(main, name, getattr(main, name))
+    monkeypatch.setattr(main, "BOT_TOKEN", "123456:" + "a" * 35)
+    monkeypatch.setattr(main, "MAIN_CHANNEL_ID", -1001234567890)
+    monkeypatch.setattr(main, "CONTENT_CHANNEL_ID", -1009876543210)
+    monkeypatch.setattr(main, "MAIN_CHANNEL_USERNAME", "@study_main")
+    monkeypatch.setattr(main, "BOT_USERNAME", "study_bot")
+    monkeypatch.setattr(main, "STATE_BACKEND", "sqlite")
+    return monkeypatch
+
+
+def test_valid_config_has_no_errors(settings):
+    assert main.validate_config() == []
+
+
+@pytest.mark.parametrize("value, default, expected", [
+    ("yes", False, True),
+    ("off", True, False),
+    ("42", 0, 42),
+    ("0.5", 1.0, 0.5),
+    ("1, 2,3", set(), {1, 2, 3}),
+    ('{"INFO": 0.5}', {}, {"INFO": 0.5}),
+    (7, "text", "7"),
+])
+def test_parse_setting_converts_to_the_default_type(value, default, expected):
+    assert main.parse_setting(value, default) == expected
+
+
+@pytest.mark.parametrize("value, default", [("maybe", True), ("ten", 0), ("1,x", set()), ("{", {})])
+def test_parse_setting_rejects_bad_values(value, default):
+    with pytest.raises(ValueError):
+        main.parse_setting(value, default)
+
+
+def test_environment_overrides_the_config_file(settings, tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"WORKER_COUNT": 2, "MAIN_CHANNEL_ID": "-1005"}))
+    main.load_config(str(path), {"STUDY_BOT_WORKER_COUNT": "4", "STUDY_BOT_LINK_TTL": "60"})
+    assert main.WORKER_COUNT == 4
+    assert main.LINK_TTL == 60
+    assert main.MAIN_CHANNEL_ID == -1005
+
+
+def test_unknown_setting_in_config_file_is_rejected(settings, tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"WORKERS": 2}))
+    with pytest.raises(ValueError, match="WORKERS"):
+        main.load_config(str(path), {})
+
+
+def test_bad_environment_value_names_the_setting(settings, tmp_path):
+    with pytest.raises(ValueError, match="Invalid value for WORKER_COUNT"):
+        main.load_config(str(tmp_path / "missing.json"), {"STUDY_BOT_WORKER_COUNT": "many"})
+
+
+@pytest.mark.parametrize("environ, problem", [
+    ({"STUDY_BOT_LOG_LEVEL": "LOUD"}, "LOG_LEVEL must be a logging level name"),
+    ({"STUDY_BOT_LANGUAGE": "xx"}, "LANGUAGE must be one of"),
+    ({"STUDY_BOT_STATE_BACKEND": "redis"}, "needs the redis package"),
+])
+def test_load_config_rejects_settings_before_they_are_used(settings, tmp_path, environ, problem):
+    settings.setattr(main, "redis", None)
+    with pytest.raises(ValueError, match="Invalid configuration") as error:
+        main.load_config(str(tmp_path / "missing.json"), environ)
+    assert problem in str(error.value)
+
+
+def test_import_with_an_invalid_setting_exits_with_the_problem():
+    bot_dir = os.path.join(os.path.dirname(__file__), "..", "telegram_study_bot")
+    result = subprocess.run([sys.executable, "-c", "import main"], cwd=bot_dir, capture_output=True, text=True,
+                            env={**os.environ, "STUDY_BOT_LANGUAGE": "xx"}, timeout=60)
+    assert result.returncode == 1
+    assert "LANGUAGE must be one of en, got 'xx'" in result.stderr
+    assert "Traceback" not in result.stderr
+
+
+@pytest.mark.parametrize("name, value, problem", [
+    ("BOT_TOKEN", "your ", "BOT_TOKEN"),
+    ("MAIN_CHANNEL_ID", "channel", "MAIN_CHANNEL_ID"),
+    ("CONTENT_CHANNEL_ID", 12345, "CONTENT_CHANNEL_ID"),
+    ("BOT_MODE", "push", "BOT_MODE"),
+    ("WEBHOOK_SECRET", "not allowed!", "WEBHOOK_SECRET"),
+    ("STATE_BACKEND", "postgres", "STATE_BACKEND"),
+    ("FLOOD_WINDOW", 0, "FLOOD_WINDOW"),
+    ("LINK_TTL", -1, "LINK_TTL"),
+    ("MEMBERSHIP_RECHECK_DELAYS", (3, 0), "MEMBERSHIP_RECHECK_DELAYS"),
+    ("LINK_SIGNATURE_BYTES", 4, "LINK_SIGNATURE_BYTES"),
+    ("LINK_SIGNATURE_BYTES", 32, "LINK_SIGNATURE_BYTES"),
+    ("LOG_LEVEL", "LOUD", "LOG_LEVEL"),
+    ("MEMBERSHIP_LOG_SAMPLE_RATES", {"INFO": 2.0}, "MEMBERSHIP_LOG_SAMPLE_RATES"),
+])
+def test_invalid_settings_are_reported(settings, name, value, problem):
+    settings.setattr(main, name, value)
+    errors = main.validate_config()
+    assert len(errors) == 1
+    assert problem in errors[0]
+
+
+def test_webhook_mode_needs_an_https_url(settings):
+    settings.setattr(main, "BOT_MODE", "webhook")
+    settings.setattr(main, "WEBHOOK_SECRET", "s3cret-token")
+    settings.setattr(main, "WEBHOOK_URL", "http://example.com/telegram")
+    assert ["WEBHOOK_URL must be an https:// URL"] == main.validate_config()
+
+
+def test_webhook_mode_rejects_the_default_secret(settings):
+    settings.setattr(main, "BOT_MODE", "webhook")
+    settings.setattr(main, "WEBHOOK_URL", "https://example.com/telegram")
+    assert ["WEBHOOK_SECRET must be changed from the default value in webhook mode"] == main.validate_config()
+
+
+def test_several_workers_need_a_shared_backend(settings):
+    settings.setattr(main, "WORKER_COUNT", 4)
+    settings.setattr(main, "STATE_BACKEND", "memory")
+    assert any("WORKER_COUNT" in error for error in main.validate_config())
+
+
+@pytest.mark.parametrize("ttl", [0, 3600, 365 * 24 * 3600])
+def test_gate_buttons_fit_telegrams_callback_data_limit(settings, ttl):
+    settings.setattr(main, "LINK_SIGNATURE_BYTES", 24)
+    settings.setattr(main, "LINK_TTL", ttl)
+    assert main.validate_config() == []
+    for data in (f"check_membership_{main.make_link_token(str(2**31 - 1))}",
+                 f"force_check_{main.make_link_token(str(2**31 - 1))}"):
+        assert len(data.encode()) <= main.CALLBACK_DATA_LIMIT
@@ -0,0 +1,138 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+from conftest import FakeBot, make_context
+
+NOTES, ARCHIVE, EXTRA = "@study_notes", "@study_archive", "@study_extra"
+
+
+class HeldBot(FakeBot):
+    """FakeBot whose answers for the held chats wait until release() is called"""
+
+    def __init__(self, statuses=None, held=()):
+        super().__init__(statuses)
+        self.held = set(held)
+        self.released = asyncio.Event()
+
+    async def get_chat_member(self, chat_id, user_id, **kwargs):
+        if chat_id in self.held:
+            await self.released.wait()
+        return await super().get_chat_member(chat_id, user_id, **kwargs)
+
+    def release(self):
+        self.released.set()
+
+
+def checked_chats(bot) -> list:
+    return sorted(str(call[1]) for call in bot.calls if call[0] == "get_chat_member")
+
+
+@pytest.mark.parametrize("statuses, expected", [
+    ({}, True),
+    ({ARCHIVE: "left"}, False),
+    ({ARCHIVE: "creator"}, True),
+])
+def test_all_of_gate_needs_every_channel(statuses, expected):
+    bot = FakeBot(statuses)
+    gate = (True, (NOTES, ARCHIVE, EXTRA))
+    assert asyncio.run(main.check_gate(42, make_context(bot), gate)) is expected
+
+
+@pytest.mark.parametrize("statuses, expected", [
+    ({}, True),
+    ({NOTES: "left", ARCHIVE: "kicked"}, True),
+    ({NOTES: "left", ARCHIVE: "kicked", EXTRA: "left"}, False),
+])
+def test_any_of_gate_needs_one_channel(statuses, expected):
+    bot = FakeBot(statuses)
+    gate = (False, (NOTES, ARCHIVE, EXTRA))
+    assert asyncio.run(main.check_gate(42, make_context(bot), gate)) is expected
+
+
+def test_all_of_gate_stops_at_the_first_failing_channel_and_caches_the_rest():
+    async def run():
+        bot = HeldBot({NOTES: "left"}, held=(ARCHIVE, EXTRA))
+        context = make_context(bot)
+        # The held checks have not answered yet, the outcome is already decided
+        assert await asyncio.wait_for(main.check_gate(42, context, (True, (NOTES, ARCHIVE, EXTRA))), 1) is False
+        bot.release()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return bot
+
+    bot = asyncio.run(run())
+    assert main.membership_cache.get((NOTES, 42)) is False
+    assert main.membership_cache.get((ARCHIVE, 42)) is True
+    assert main.membership_cache.get((EXTRA, 42)) is True
+    assert checked_chats(bot) == sorted([NOTES, ARCHIVE, EXTRA])
+
+
+def test_any_of_gate_stops_at_the_first_channel_the_user_is_in():
+    async def run():
+        bot = HeldBot({NOTES: "left"}, held=(NOTES, EXTRA))
+        result = await asyncio.wait_for(main.check_gate(42, make_context(bot), (False, (NOTES, ARCHIVE, EXTRA))), 1)
+        bot.release()
+        return result
+
+    assert asyncio.run(run()) is True
+
+
+@pytest.mark.parametrize("require_all, statuses, expected", [
+    (True, {NOTES: "unknown", ARCHIVE: "member"}, None),
+    (True, {NOTES: "unknown", ARCHIVE: "left"}, False),
+    (False, {NOTES: "unknown", ARCHIVE: "left"}, None),
+    (False, {NOTES: "unknown", ARCHIVE: "member"}, True),
+])
+def test_inconclusive_checks_only_matter_when_they_decide_the_outcome(require_all, statuses, expected):
+    bot = FakeBot({ARCHIVE: "left", **statuses})
+    gate = (require_all, (NOTES, ARCHIVE))
+    assert asyncio.run(main.check_gate(42, make_context(bot), gate)) is expected
+
+
+def test_each_channel_result_is_cached_separately():
+    bot = FakeBot()
+    context = make_context(bot)
+
+    async def run():
+        await main.check_gate(42, context, (True, (NOTES, ARCHIVE)))
+        await main.check_gate(42, context, (True, (ARCHIVE, EXTRA)))
+
+    asyncio.run(run())
+    # Only the channel the second gate adds is asked for
+    assert checked_chats(bot) == sorted([NOTES, ARCHIVE, EXTRA])
+
+
+def test_main_channel_in_a_policy_is_checked_by_id():
+    bot = FakeBot()
+    gate = (True, (main.MAIN_CHANNEL_USERNAME, NOTES))
+    assert asyncio.run(main.check_gate(42, make_context(bot), gate)) is True
+    assert checked_chats(bot) == sorted([str(main.MAIN_CHANNEL_ID), NOTES])
+
+
+@pytest.mark.parametrize("caption, expected", [
+    ("gate: all @study_notes @Study_Archive", {"mode": "all", "channels": [NOTES, ARCHIVE]}),
+    ("Week 3 notes\nGATE: Any @study_notes @study_notes", {"mode": "any", "channels": [NOTES]}),
+    ("gate: all @study_notes not-a-channel @abc", {"mode": "all", "channels": [NOTES]}),
+])
+def test_parse_gate_policy(caption, expected):
+    assert json.loads(main.parse_gate_policy(caption)) == expected
+
+
+@pytest.mark.parametrize("caption", [None, "", "Week 3 notes", "gate: some @study_notes", "gate: all", "gate: all x"])
+def test_captions_without_a_valid_gate_line_have_no_policy(caption):
+    assert main.parse_gate_policy(caption) is None
+
+
+def test_policy_round_trips_to_a_gate():
+    assert main.policy_gate(main.parse_gate_policy("gate: any @study_notes @study_archive")) == \
+        (False, (NOTES, ARCHIVE))
+    assert main.policy_gate(None) == main.MAIN_GATE
+
+
+def test_channel_names_are_escaped_for_markdown():
+    main.gate_text.cache_clear()
+    assert "@study\\_notes or @study\\_archive" in main.gate_text("access_denied", (False, (NOTES, ARCHIVE)))
+    assert "@study\\_main" in main.gate_text("access_denied")
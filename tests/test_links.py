@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+import main
+
+
+def test_signed_link_round_trip():
+    token = main.make_link_token("12345")
+    assert main.resolve_content_link(token) == "12345"
+
+
+@pytest.mark.parametrize("tamper", [
+    lambda token: token[:-1] + ("A" if token[-1] != "A" else "B"),  # signature
+    lambda token: "s" + main.to_base36(12346) + token[len("s" + main.to_base36(12345)):],  # media ID
+    lambda token: token.split("_")[0] + "_zzzzzz_" + token.split("_", 2)[2],  # expiry
+    lambda token: token[:10],  # truncated
+])
+def test_tampered_links_are_rejected(tamper):
+    assert main.resolve_content_link(tamper(main.make_link_token("12345", ttl=3600))) is None
+
+
+def test_expired_link_is_rejected(monkeypatch):
+    token = main.make_link_token("7", ttl=60)
+    assert main.resolve_content_link(token) == "7"
+    now = time.time()
+    monkeypatch.setattr(main.time, "time", lambda: now + 120)
+    assert main.resolve_content_link(token) is None
+
+
+def test_link_signed_with_another_secret_is_rejected(monkeypatch):
+    token = main.make_link_token("7")
+    monkeypatch.setattr(main, "LINK_SECRET", "rotated")
+    assert main.resolve_content_link(token) is None
+
+
+@pytest.mark.parametrize("link", ["img²", "img" + "9" * 25, "img", "img-1", "img 1"])
+def test_malformed_legacy_links_are_rejected(link):
+    assert main.resolve_content_link(link) is None
+
+
+def test_bare_ids_are_only_accepted_from_buttons():
+    assert main.resolve_content_link("img5") == "5"
+    assert main.resolve_content_link("5") is None
+    assert main.resolve_content_link("5", from_button=True) == "5"
+
+
+def test_legacy_links_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(main, "ACCEPT_LEGACY_LINKS", False)
+    assert main.resolve_content_link("img5") is None
+    assert main.resolve_content_link("5", from_button=True) is None
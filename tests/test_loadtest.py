@@ -0,0 +1,78 @@
+import asyncio
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+import main
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+
+@pytest.fixture
+def loadtest(monkeypatch):
+    with mock.patch.dict(os.environ):
+        import loadtest
+    # The harness sets the bot up like its own environment would
+    monkeypatch.setattr(main, "BOT_TOKEN", "123456:test-token")
+    monkeypatch.setattr(main, "MAIN_CHANNEL_ID", loadtest.MAIN_CHANNEL_ID)
+    monkeypatch.setattr(main, "CONTENT_CHANNEL_ID", loadtest.CONTENT_CHANNEL_ID)
+    for name in ("GLOBAL_RATE_LIMIT", "PER_CHAT_RATE_LIMIT", "PER_CHAT_BURST", "ALBUM_COLLECT_DELAY",
+                 "BOT_API_BASE_URL", "rate_limiter", "request_throttle"):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    return loadtest
+
+
+def run_profile(loadtest, profile, **settings):
+    args = loadtest.parse_args([profile, "--users", "20", "--latency", "0", "--jitter", "0"])
+    for name, value in settings.items():
+        setattr(args, name, value)
+    return asyncio.run(loadtest.run(args))[profile]
+
+
+def test_member_start_makes_one_check_and_one_send_per_update(loadtest):
+    result = run_profile(loadtest, "member_start")
+    assert result["updates"] == 20
+    assert result["calls_by_method"] == {"getChatMember": 20, "sendPhoto": 20}
+    assert result["amplification"] == 2.0
+
+
+def test_join_then_check_delivers_to_everyone_once_the_re_checks_ran(loadtest, monkeypatch):
+    # The first re-check comes after the join
+    monkeypatch.setattr(main, "MEMBERSHIP_RECHECK_DELAYS", (1, 1, 1))
+    # With outgoing rate limits the early taps could be held back until after the join
+    result = run_profile(loadtest, "join_then_check", lift_rate_limits=True)
+    # 20 /start, 20 taps and 20 chat_member updates
+    assert result["updates"] == 60
+    assert result["calls_by_method"]["sendPhoto"] == 20
+    # Only the /start checks and the 10 taps made before the join ask Telegram; the rest use the index
+    assert result["calls_by_method"]["getChatMember"] == 30
+
+
+def test_runs_keep_the_configured_rate_limits_and_put_settings_back(loadtest):
+    settings = {name: getattr(main, name) for name in loadtest.RUN_SETTINGS}
+    limits = []
+    original_reset = loadtest.reset_bot_state
+
+    def reset_bot_state(*args):
+        original_reset(*args)
+        limits.append(main.GLOBAL_RATE_LIMIT)
+
+    loadtest.reset_bot_state = reset_bot_state
+    try:
+        run_profile(loadtest, "member_start")
+        run_profile(loadtest, "member_start", lift_rate_limits=True)
+    finally:
+        loadtest.reset_bot_state = original_reset
+
+    assert limits == [settings["GLOBAL_RATE_LIMIT"], 1_000_000]
+    assert {name: getattr(main, name) for name in loadtest.RUN_SETTINGS} == settings
+
+
+def test_regressions_flag_more_api_calls_and_lower_throughput(loadtest):
+    baseline = {"member_start": {"throughput": 100.0, "p99_ms": 10.0, "amplification": 2.0}}
+    same = {"member_start": {"throughput": 95.0, "p99_ms": 11.0, "amplification": 2.0}}
+    worse = {"member_start": {"throughput": 50.0, "p99_ms": 10.0, "amplification": 3.0}}
+    assert loadtest.regressions(same, baseline, tolerance=0.2) == []
+    assert len(loadtest.regressions(worse, baseline, tolerance=0.2)) == 2
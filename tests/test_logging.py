@@ -0,0 +1,42 @@
+import io
+import json
+import logging
+import queue
+
+import main
+
+
+def record(message, *args, level=logging.INFO, **extra):
+    entry = logging.LogRecord("main", level, __file__, 1, message, args, None)
+    entry.__dict__.update(extra)
+    return entry
+
+
+def test_full_buffer_drops_records_and_still_stops_cleanly():
+    handler = main.DroppingQueueHandler(queue.Queue(3))
+    for number in range(5):
+        handler.handle(record("Update %s", number))
+    assert handler.dropped == 2
+
+    output = io.StringIO()
+    stream_handler = logging.StreamHandler(output)
+    stream_handler.setFormatter(main.JsonFormatter())
+    listener = main.DrainingQueueListener(handler.queue, stream_handler)
+    listener.start()
+    # The buffer is full, stopping has to wait for room instead of raising queue.Full
+    listener.stop()
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [line["message"] for line in lines] == ["Update 0", "Update 1", "Update 2"]
+
+
+def test_json_records_carry_extra_fields():
+    line = json.loads(main.JsonFormatter().format(record("Checked %s", 42, user_id=42)))
+    assert (line["level"], line["message"], line["user_id"]) == ("INFO", "Checked 42", 42)
+
+
+def test_sampling_only_thins_the_configured_levels():
+    sampling = main.SamplingFilter({"INFO": 0.0})
+    kept = [sampling.filter(record("Attempt")) for _ in range(10)]
+    assert not any(kept) and sampling.sampled_out == 10
+    assert sampling.filter(record("Failed", level=logging.WARNING))
@@ -0,0 +1,42 @@
+import asyncio
+
+import main
+from conftest import FakeBot, make_context
+
+
+def test_concurrent_callers_share_one_api_call():
+    bot = FakeBot(delay=0.05)
+    context = make_context(bot)
+
+    async def run():
+        return await asyncio.gather(*(main.check_membership_with_fallback(42, context) for _ in range(50)))
+
+    results = asyncio.run(run())
+    assert results == [True] * 50
+    assert bot.count("get_chat_member") == 1
+
+
+def test_cancelled_caller_does_not_cancel_shared_check():
+    bot = FakeBot(delay=0.05)
+    context = make_context(bot)
+
+    async def run():
+        first = asyncio.create_task(main.check_membership_with_fallback(42, context))
+        second = asyncio.create_task(main.check_membership_with_fallback(42, context))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) is True
+    assert bot.count("get_chat_member") == 1
+
+
+def test_separate_users_are_checked_separately():
+    bot = FakeBot()
+    context = make_context(bot)
+
+    async def run():
+        return await asyncio.gather(*(main.check_membership_with_fallback(user_id, context) for user_id in range(5)))
+
+    asyncio.run(run())
+    assert bot.count("get_chat_member") == 5
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(main, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = main.MembershipCache(2, 60, 10)
+    cache.set((1, 1), True)
+    cache.set((1, 2), True)
+    cache.get((1, 1))
+    cache.set((1, 3), True)
+    assert (cache.get((1, 1)), cache.get((1, 2)), cache.get((1, 3))) == (True, None, True)
+    assert cache.evictions == 1
+
+
+def test_members_and_non_members_expire_separately(clock):
+    cache = main.MembershipCache(10, 60, 10)
+    cache.set((1, 1), True)
+    cache.set((1, 2), False)
+    clock.now += 11
+    assert (cache.get((1, 1)), cache.get((1, 2))) == (True, None)
+    clock.now += 50
+    assert cache.get((1, 1)) is None
+    assert cache.expirations == 2
+
+
+def test_prune_drops_only_expired_entries(clock):
+    cache = main.MembershipCache(10, 60, 10)
+    cache.set((1, 1), True)
+    cache.set((1, 2), False)
+    clock.now += 30
+    assert cache.prune_expired() == 1
+    assert len(cache) == 1
+    assert cache.age((1, 1)) == 30
+
+
+def test_hit_ratio_counts_misses_and_expired_lookups(clock):
+    cache = main.MembershipCache(10, 60, 10)
+    cache.set((1, 1), False)
+    cache.get((1, 1))
+    cache.get((1, 2))
+    clock.now += 10
+    cache.get((1, 1))
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache.hit_ratio() == pytest.approx(1 / 3)
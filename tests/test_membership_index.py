@@ -0,0 +1,74 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import main
+from conftest import FakeBot, make_context, make_update
+
+
+def chat_member_update(user_id, status):
+    chat = SimpleNamespace(id=main.MAIN_CHANNEL_ID, username=None)
+    member = SimpleNamespace(user=SimpleNamespace(id=user_id), status=status)
+    return SimpleNamespace(chat_member=SimpleNamespace(chat=chat, new_chat_member=member))
+
+
+def test_polled_result_is_not_indexed():
+    bot = FakeBot(statuses={main.MAIN_CHANNEL_ID: "left"})
+    assert asyncio.run(main.check_membership_with_fallback(42, make_context(bot))) is False
+    assert main.membership_index.get(42) is None
+
+
+def test_check_again_asks_telegram_after_a_missed_join():
+    media_id = asyncio.run(main.state_backend.add_media("photo", "file1"))
+    link = main.make_link_token(media_id)
+    bot = FakeBot(statuses={main.MAIN_CHANNEL_ID: "left"})
+
+    async def run():
+        await main.track_chat_member(chat_member_update(42, "left"), make_context(bot))
+        await main.start(make_update(42), make_context(bot, args=[link]))
+        # The user joins, but the chat_member update never reaches this instance
+        bot.statuses[main.MAIN_CHANNEL_ID] = "member"
+        await main.handle_callback_query(make_update(42, callback_data=f"check_membership_{link}"), make_context(bot))
+
+    asyncio.run(run())
+    assert bot.count("get_chat_member") == 1
+    assert bot.count("send_photo") == 1
+
+
+def test_recheck_job_asks_telegram_after_a_missed_join():
+    bot = FakeBot()
+    context = make_context(bot)
+    asyncio.run(main.track_chat_member(chat_member_update(42, "left"), context))
+    main.schedule_membership_recheck(context, 42, 42, 1, main.make_link_token("7"), main.MAIN_GATE, "check")
+    job = context.job_queue.jobs[0]
+
+    asyncio.run(job.callback(SimpleNamespace(bot=bot, job=job, job_queue=context.job_queue)))
+    assert bot.count("get_chat_member") == 1
+
+
+def test_index_drops_least_recently_used_users():
+    index = main.MembershipIndex(2)
+    index.set(1, True)
+    index.set(2, False)
+    index.get(1)
+    index.set(3, True)
+    assert (index.get(1), index.get(2), index.get(3)) == (True, None, True)
+    assert index.evictions == 1
+
+
+def test_replayed_join_leave_stream_needs_no_api_calls():
+    bot = FakeBot()
+    context = make_context(bot)
+    rng = random.Random(1)
+    expected = {}
+
+    async def run():
+        for _ in range(2000):
+            user_id = rng.randrange(200)
+            status = rng.choice(("member", "left", "administrator", "kicked"))
+            expected[user_id] = status in main.MEMBER_STATUSES
+            await main.track_chat_member(chat_member_update(user_id, status), context)
+        return {user_id: await main.check_gate(user_id, context) for user_id in expected}
+
+    assert asyncio.run(run()) == expected
+    assert bot.count("get_chat_member") == 0
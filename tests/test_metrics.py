@@ -0,0 +1,80 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+from conftest import FakeBot, make_context
+
+
+def fake_application(in_progress=0):
+    return SimpleNamespace(update_processor=SimpleNamespace(current_concurrent_updates=in_progress))
+
+
+def test_histogram_counts_values_into_cumulative_buckets():
+    histogram = main.Histogram("check_seconds", "Check time", buckets=(0.01, 0.1, 1))
+    for value in (0.001, 0.01, 0.05, 0.5, 20):
+        histogram.observe(value)
+
+    assert histogram.render().splitlines() == [
+        "# HELP check_seconds Check time",
+        "# TYPE check_seconds histogram",
+        'check_seconds_bucket{le="0.01"} 2',
+        'check_seconds_bucket{le="0.1"} 3',
+        'check_seconds_bucket{le="1"} 4',
+        'check_seconds_bucket{le="+Inf"} 5',
+        "check_seconds_sum 20.561",
+        "check_seconds_count 5",
+    ]
+
+
+def test_counter_renders_one_line_per_label():
+    counter = main.Counter("api_total", "API calls", "method")
+    counter.inc("sendPhoto")
+    counter.inc("sendPhoto")
+    counter.inc("getChatMember")
+
+    assert counter.render().splitlines()[2:] == ['api_total{method="sendPhoto"} 2',
+                                                 'api_total{method="getChatMember"} 1']
+
+
+def test_render_metrics_reports_updates_in_progress(monkeypatch):
+    monkeypatch.setattr(main, "membership_check_seconds", main.Histogram("membership_check_seconds", "Check time"))
+    main.membership_check_seconds.observe(0.02)
+
+    lines = main.render_metrics(fake_application(in_progress=7)).splitlines()
+
+    assert "updates_in_progress 7" in lines
+    assert 'membership_check_seconds_bucket{le="0.05"} 1' in lines
+    assert "# TYPE bot_api_requests_total counter" in lines
+    # Every sample comes with its HELP and TYPE lines
+    gauges = [line.split()[2] for line in lines if line.startswith("# TYPE") and line.endswith("gauge")]
+    assert all(any(line.startswith(f"{name} ") for line in lines) for name in gauges)
+
+
+def test_membership_checks_are_timed(monkeypatch):
+    monkeypatch.setattr(main, "membership_check_seconds", main.Histogram("membership_check_seconds", "Check time"))
+
+    asyncio.run(main.check_membership_with_fallback(42, make_context(FakeBot(delay=0.02))))
+
+    assert sum(main.membership_check_seconds.counts) == 1
+    assert main.membership_check_seconds.sum >= 0.02
+
+
+def test_metrics_endpoint_serves_only_get_metrics():
+    async def fetch(request_line):
+        server = await asyncio.start_server(
+            lambda reader, writer: main.handle_metrics_request(fake_application(), reader, writer), "127.0.0.1", 0
+        )
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(request_line + b"Host: bot\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response
+
+    ok = asyncio.run(fetch(b"GET /metrics HTTP/1.1\r\n"))
+    missing = asyncio.run(fetch(b"GET / HTTP/1.1\r\n"))
+
+    assert ok.startswith(b"HTTP/1.1 200 OK\r\n")
+    assert b"\r\n\r\n# HELP membership_check_seconds" in ok
+    assert missing.startswith(b"HTTP/1.1 404 Not Found\r\n")
@@ -0,0 +1,71 @@
+import asyncio
+import collections
+from types import SimpleNamespace
+
+import main
+from conftest import FakeBot, make_context, make_update
+
+
+def test_prewarm_command_warms_every_requested_user(monkeypatch):
+    # The command reaches a single worker, which checks everyone; results are shared through the backend
+    monkeypatch.setattr(main, "WORKER_COUNT", 4)
+    bot = FakeBot()
+    results = asyncio.run(main.prewarm_memberships(list(range(8)), make_context(bot)))
+    assert results["total"] == 8
+    assert results["members"] == 8
+    assert bot.count("get_chat_member") == 8
+
+
+def test_scheduled_prewarm_only_warms_own_shard(monkeypatch):
+    monkeypatch.setattr(main, "WORKER_COUNT", 4)
+    monkeypatch.setattr(main, "worker_shard", 1)
+    bot = FakeBot()
+
+    async def run():
+        for user_id in range(8):
+            await main.state_backend.record_requester(user_id)
+        await main.prewarm_job(make_context(bot))
+
+    asyncio.run(run())
+    assert sorted(call[2] for call in bot.calls) == [1, 5]
+
+
+def test_start_uses_results_prewarmed_by_another_worker(monkeypatch, tmp_path):
+    bot = FakeBot()
+
+    async def run():
+        # Workers share only the SQLite file; each has its own cache and membership index
+        monkeypatch.setattr(main, "state_backend", main.SQLiteBackend(str(tmp_path / "store.db")))
+        media_id = await main.state_backend.add_media("photo", "file1")
+        await main.prewarm_memberships([42], make_context(bot))
+        await main.state_backend.flush()
+        main.membership_cache.clear()
+        main.membership_index.clear()
+        await main.start(make_update(42), make_context(bot, args=[main.make_link_token(media_id)]))
+        await main.state_backend.close()
+
+    asyncio.run(run())
+    assert bot.count("get_chat_member") == 1
+    assert bot.count("send_photo") == 1
+
+
+def test_time_to_warm_50k_users_stays_within_the_global_rate_limit(virtual_clock):
+    limiter = main.PriorityRateLimiter()
+    sent_at = []
+
+    class LimitedBot(FakeBot):
+        async def get_chat_member(self, chat_id, user_id, **kwargs):
+            async def call():
+                sent_at.append(virtual_clock.now)
+                return SimpleNamespace(status="member")
+            return await limiter.process_request(call, (), {}, "getChatMember", {}, kwargs.get("rate_limit_args"))
+
+    users = 50_000
+    results = asyncio.run(main.prewarm_memberships(list(range(users)), make_context(LimitedBot())))
+    assert results["members"] == users
+    # The bucket starts full, after that requests are paced at GLOBAL_RATE_LIMIT per second
+    assert results["seconds"] >= (users - main.GLOBAL_RATE_LIMIT) / main.GLOBAL_RATE_LIMIT
+    assert results["seconds"] < users / main.GLOBAL_RATE_LIMIT + 1
+    per_second = collections.Counter(int(t) for t in sent_at)
+    assert max(per_second.values()) <= 2 * main.GLOBAL_RATE_LIMIT
+    assert max(count for second, count in per_second.items() if second > 0) <= main.GLOBAL_RATE_LIMIT + 1
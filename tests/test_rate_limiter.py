@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+
+import main
+
+
+@pytest.fixture
+def limiter(monkeypatch, virtual_clock):
+    monkeypatch.setattr(main, "GLOBAL_RATE_LIMIT", 30)
+    monkeypatch.setattr(main, "PER_CHAT_RATE_LIMIT", 1)
+    monkeypatch.setattr(main, "PER_CHAT_BURST", 3)
+    monkeypatch.setattr(main, "MAX_RATE_LIMIT_RETRIES", 2)
+    return main.PriorityRateLimiter()
+
+
+def recorder(clock, sent, name=None, failures=()):
+    """API call stand-in that records its (virtual) send time and raises the given errors first"""
+    failures = list(failures)
+
+    async def call():
+        sent.append((clock.now, name))
+        if failures:
+            raise failures.pop(0)
+        return name
+    return call
+
+
+def test_requests_are_paced_at_the_global_rate(limiter, virtual_clock):
+    sent = []
+
+    async def run():
+        await asyncio.gather(*(limiter.process_request(recorder(virtual_clock, sent), (), {}, "getChatMember", {},
+                                                       None) for _ in range(90)))
+
+    asyncio.run(run())
+    # 30 from the full bucket, then 60 more at 30 per second
+    assert sent[-1][0] == pytest.approx(2.0, abs=0.01)
+    assert sum(1 for at, _ in sent if at < 1) <= 60
+
+
+def test_waiting_requests_are_released_by_priority(limiter, virtual_clock):
+    limiter.global_bucket.tokens = 0
+    sent = []
+
+    async def run():
+        calls = [(main.PRIORITY_BACKGROUND, "background"), (main.PRIORITY_ADMIN, "admin"),
+                 (main.PRIORITY_CONTENT, "content"), (main.PRIORITY_DEFAULT, "default")]
+        await asyncio.gather(*(limiter.process_request(recorder(virtual_clock, sent, name), (), {}, "getChatMember",
+                                                       {}, priority) for priority, name in calls))
+
+    asyncio.run(run())
+    assert [name for _, name in sent] == ["content", "default", "admin", "background"]
+
+
+def test_messages_to_one_chat_are_paced_per_chat(limiter, virtual_clock):
+    sent = []
+
+    async def run():
+        for chat_id in (1, 1, 1, 1, 1, 2):
+            await limiter.process_request(recorder(virtual_clock, sent, chat_id), (), {}, "sendMessage",
+                                          {"chat_id": chat_id}, None)
+
+    asyncio.run(run())
+    times = [round(at, 2) for at, _ in sent]
+    # A burst of 3, then one per second; another chat isn't held up by it
+    assert times == [0.0, 0.0, 0.0, 1.0, 2.0, 2.0]
+
+
+def test_retry_after_pauses_every_request_and_retries(limiter, virtual_clock):
+    sent = []
+
+    async def run():
+        flaky = recorder(virtual_clock, sent, "flaky", [RetryAfter(5)])
+        first = asyncio.create_task(limiter.process_request(flaky, (), {}, "sendPhoto", {}, None))
+        await asyncio.sleep(0)
+        other = limiter.process_request(recorder(virtual_clock, sent, "other"), (), {}, "getChatMember", {}, None)
+        return await asyncio.gather(first, other)
+
+    assert asyncio.run(run()) == ["flaky", "other"]
+    assert [name for _, name in sent] == ["flaky", "other", "flaky"]
+    assert sent[1][0] == pytest.approx(5.0, abs=0.01)
+    assert limiter.retries == 1
+
+
+def test_gives_up_after_max_retries(limiter, virtual_clock):
+    sent = []
+    call = recorder(virtual_clock, sent, failures=[RetryAfter(1)] * 5)
+    with pytest.raises(RetryAfter):
+        asyncio.run(limiter.process_request(call, (), {}, "sendMessage", {}, None))
+    assert len(sent) == main.MAX_RATE_LIMIT_RETRIES + 1
+
+
+def test_workers_share_the_global_rate(monkeypatch, virtual_clock):
+    monkeypatch.setattr(main, "GLOBAL_RATE_LIMIT", 30)
+    monkeypatch.setattr(main, "WORKER_COUNT", 3)
+    limiter = main.PriorityRateLimiter()
+    sent = []
+
+    async def run():
+        await asyncio.gather(*(limiter.process_request(recorder(virtual_clock, sent), (), {}, "getChatMember", {},
+                                                       None) for _ in range(90)))
+
+    asyncio.run(run())
+    # Three workers at 10 per second each stay within the bot's 30
+    assert sent[-1][0] == pytest.approx(8.0, abs=0.01)
@@ -0,0 +1,20 @@
+import main
+from conftest import FakeBot, make_context
+
+
+def test_new_gate_message_keeps_rechecks_of_the_first():
+    context = make_context(FakeBot())
+    main.schedule_membership_recheck(context, 42, 42, 1, "s1_0_x", main.MAIN_GATE, "check")
+    main.schedule_membership_recheck(context, 42, 42, 2, "s2_0_x", main.MAIN_GATE, "check")
+
+    pending = [job.data["message_id"] for job in context.job_queue.jobs if not job.removed]
+    assert pending == [1, 2]
+
+
+def test_new_tap_replaces_rechecks_of_the_same_message():
+    context = make_context(FakeBot())
+    main.schedule_membership_recheck(context, 42, 42, 1, "s1_0_x", main.MAIN_GATE, "check")
+    main.schedule_membership_recheck(context, 42, 42, 1, "s1_0_x", main.MAIN_GATE, "force")
+
+    pending = [job.data["kind"] for job in context.job_queue.jobs if not job.removed]
+    assert pending == ["force"]
@@ -0,0 +1,169 @@
+import asyncio
+import time
+
+import pytest
+
+import main
+
+pytest.importorskip("redis")
+
+
+class RedisStandIn:
+    """Just enough of a Redis server (in memory) for the commands RedisBackend sends"""
+
+    def __init__(self):
+        self.strings = {}  # key -> (value, expires_at or None)
+        self.hashes = {}
+        self.sorted_sets = {}
+        self.server = None
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return "redis://127.0.0.1:%d/0" % self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        resp3 = False  # RESP3 only changes how a missing value is sent, for the commands below
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                args = []
+                for _ in range(int(header[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                command = args[0].decode().upper()
+                if command == "HELLO":
+                    resp3 = args[1:2] == [b"3"]
+                writer.write(self.encode(self.run(command, args[1:]), resp3))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def encode(self, value, resp3: bool) -> bytes:
+        if value is None:
+            return b"_\r\n" if resp3 else b"$-1\r\n"
+        if isinstance(value, Exception):
+            return b"-ERR %s\r\n" % str(value).encode()
+        if value == "OK":
+            return b"+OK\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, dict):
+            return b"%%%d\r\n" % len(value) + b"".join(
+                self.encode(key, resp3) + self.encode(item, resp3) for key, item in value.items()
+            )
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(self.encode(item, resp3) for item in value)
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def get(self, key):
+        value, expires_at = self.strings.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.strings[key]
+            return None
+        return value
+
+    def run(self, command: str, args: list):
+        if command == "HELLO":
+            return {b"server": b"redis", b"version": b"7.2.0", b"proto": int(args[0]) if args else 2}
+        if command in ("CLIENT", "SELECT"):
+            return "OK"
+        if command in ("INCR", "INCRBY"):
+            value = int(self.get(args[0]) or 0) + (int(args[1]) if len(args) > 1 else 1)
+            self.strings[args[0]] = (b"%d" % value, None)
+            return value
+        if command == "GET":
+            return self.get(args[0])
+        if command == "SET":
+            expires_at = None
+            if len(args) == 4 and args[2].upper() == b"PX":
+                expires_at = time.monotonic() + int(args[3]) / 1000
+            self.strings[args[0]] = (args[1], expires_at)
+            return "OK"
+        if command == "DEL":
+            return sum(1 for key in args if self.strings.pop(key, None) is not None)
+        if command == "HSET":
+            fields = self.hashes.setdefault(args[0], {})
+            fields.update(zip(args[1::2], args[2::2]))
+            return len(args[1:]) // 2
+        if command == "HMGET":
+            fields = self.hashes.get(args[0], {})
+            return [fields.get(name) for name in args[1:]]
+        if command == "ZADD":
+            scores = self.sorted_sets.setdefault(args[0], {})
+            scores.update((member, float(score)) for score, member in zip(args[1::2], args[2::2]))
+            return len(args[1:]) // 2
+        if command == "ZREVRANGE":
+            members = sorted(self.sorted_sets.get(args[0], {}).items(), key=lambda item: -item[1])
+            return [member for member, _ in members[int(args[1]):int(args[2]) + 1]]
+        return Exception(f"unknown command '{command}'")
+
+
+def with_backends(count, scenario):
+    """Run scenario(backends) with `count` RedisBackends (one per worker) sharing a stand-in server"""
+    async def run():
+        server = RedisStandIn()
+        url = await server.start()
+        backends = [main.RedisBackend(url) for _ in range(count)]
+        try:
+            return await scenario(backends)
+        finally:
+            for backend in backends:
+                await backend.close()
+            await server.stop()
+    return asyncio.run(run())
+
+
+def test_media_round_trip():
+    async def scenario(backends):
+        backend = backends[0]
+        first = await backend.add_media("photo", "file1")
+        second = await backend.add_media("album", "[]", '{"all": true, "channels": ["@a"]}')
+        return (first, second, await backend.get_media(first), await backend.get_media(second),
+                await backend.get_media("99"), await backend.get_media("9" * 25), await backend.media_count())
+
+    first, second, photo, album, missing, too_long, count = with_backends(1, scenario)
+    assert (first, second) == ("1", "2")
+    assert photo == ("photo", "file1", None)
+    assert album == ("album", "[]", '{"all": true, "channels": ["@a"]}')
+    assert (missing, too_long, count) == (None, None, 2)
+
+
+def test_workers_never_hand_out_the_same_media_id():
+    async def scenario(backends):
+        return await asyncio.gather(*(backend.add_media("photo", f"file{i}")
+                                      for i in range(20) for backend in backends))
+
+    ids = with_backends(3, scenario)
+    assert sorted(map(int, ids)) == list(range(1, 61))
+
+
+def test_membership_is_shared_and_expires():
+    async def scenario(backends):
+        first, second = backends
+        await first.set_membership(42, "-100", True, 30)
+        await first.set_membership(43, "-100", False, 0.05)
+        shared = (await second.get_membership(42, "-100"), await second.get_membership(43, "-100"))
+        await asyncio.sleep(0.1)
+        expired = await second.get_membership(43, "-100")
+        await second.delete_membership(42, "-100")
+        return shared, expired, await first.get_membership(42, "-100")
+
+    assert with_backends(2, scenario) == ((True, False), None, None)
+
+
+def test_recent_requesters_newest_first():
+    async def scenario(backends):
+        for user_id in (1, 2, 3, 1):
+            await backends[0].record_requester(user_id)
+            await asyncio.sleep(0.001)
+        return await backends[0].recent_requesters(2)
+
+    assert with_backends(1, scenario) == [1, 3]
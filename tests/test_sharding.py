@@ -0,0 +1,76 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+
+original_sleep = asyncio.sleep
+
+
+def chat_member_update(key, member_id, actor_id):
+    return {
+        "update_id": 1,
+        key: {
+            "chat": {"id": -1001, "type": "channel"},
+            "from": {"id": actor_id},
+            "new_chat_member": {"status": "left", "user": {"id": member_id}},
+        },
+    }
+
+
+def test_user_updates_go_to_the_users_shard(monkeypatch):
+    monkeypatch.setattr(main, "WORKER_COUNT", 4)
+    assert main.shards_for_update({"update_id": 1, "message": {"from": {"id": 7}}}) == [3]
+    # The member decides, not the admin who made the change
+    assert main.shards_for_update(chat_member_update("chat_member", 6, 5)) == [2]
+
+
+def test_bot_status_changes_go_to_every_worker(monkeypatch):
+    monkeypatch.setattr(main, "WORKER_COUNT", 4)
+    assert main.shards_for_update(chat_member_update("my_chat_member", 1000, 5)) == [0, 1, 2, 3]
+
+
+def test_workers_are_watched_until_one_exits(monkeypatch):
+    # Poll without waiting the real second between checks
+    monkeypatch.setattr(main.asyncio, "sleep", lambda delay: original_sleep(0))
+    workers = [SimpleNamespace(alive=True), SimpleNamespace(alive=True)]
+    for worker in workers:
+        worker.is_alive = lambda worker=worker: worker.alive
+
+    async def run():
+        stop_event = asyncio.Event()
+        watcher = asyncio.create_task(main.watch_workers(workers, stop_event))
+        await original_sleep(0.01)
+        assert not stop_event.is_set()
+        workers[1].alive = False
+        await asyncio.wait_for(watcher, 1)
+        assert stop_event.is_set()
+
+    asyncio.run(run())
+
+
+def test_polling_stops_without_fetching_again_when_an_update_is_refused():
+    updates = [SimpleNamespace(update_id=i, to_dict=lambda i=i: {"update_id": i}) for i in (10, 11, 12)]
+    offsets = []
+
+    class Bot:
+        async def delete_webhook(self):
+            pass
+
+        async def get_updates(self, offset=None, **kwargs):
+            offsets.append(offset)
+            return updates
+
+    dispatched = []
+
+    async def dispatch(data):
+        if data["update_id"] == 11:
+            raise RuntimeError("worker 1 exited with code -9")
+        dispatched.append(data["update_id"])
+
+    async def run():
+        await asyncio.wait_for(main.poll_updates(Bot(), dispatch, asyncio.Event()), 1)
+
+    asyncio.run(run())
+    assert dispatched == [10]
+    # getUpdates is not called again, so Telegram has not been told update 11 was received
+    assert offsets == [None]
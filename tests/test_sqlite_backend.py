@@ -0,0 +1,76 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+import main
+
+
+def test_media_ids_and_membership_round_trip(tmp_path):
+    async def run():
+        backend = main.SQLiteBackend(str(tmp_path / "store.db"))
+        ids = await asyncio.gather(*(backend.add_media("photo", f"file{i}") for i in range(3)))
+        await backend.set_membership(1, "-100", True, 30)
+        assert await backend.get_membership(1, "-100") is True
+        await backend.flush()
+        assert await backend.get_membership(1, "-100") is True
+        # A deletion hides the committed row before it is committed itself
+        await backend.delete_membership(1, "-100")
+        assert await backend.get_membership(1, "-100") is None
+        media = await backend.get_media(ids[1])
+        too_long = await backend.get_media("9" * 25)
+        await backend.close()
+        return ids, media, too_long
+
+    ids, media, too_long = asyncio.run(run())
+    assert ids == ["1", "2", "3"]
+    assert media == ("photo", "file1", None)
+    assert too_long is None
+
+
+def test_commit_waiting_for_lock_does_not_block_loop(tmp_path):
+    path = str(tmp_path / "store.db")
+    backend = main.SQLiteBackend(path)
+    # Another worker holds the write lock for a while
+    other = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+
+    async def run():
+        await backend.set_membership(1, "-100", True, 30)
+        delays = []
+        for _ in range(20):
+            started = time.monotonic()
+            await asyncio.sleep(0.01)
+            delays.append(time.monotonic() - started)
+        other.execute("COMMIT")
+        await backend.close()
+        return max(delays)
+
+    assert asyncio.run(run()) < 0.1
+
+
+def test_failed_commit_resolves_media_and_keeps_the_rest(tmp_path, monkeypatch):
+    backend = main.SQLiteBackend(str(tmp_path / "store.db"))
+
+    def fail(*args):
+        raise ValueError("disk on fire")
+
+    async def run():
+        monkeypatch.setattr(backend, "write", fail)
+        await backend.record_requester(7)
+        await backend.set_membership(1, "-100", True, 30)
+        await backend.set_membership(2, "-100", True, 30)
+        with pytest.raises(ValueError):
+            await asyncio.wait_for(backend.add_media("photo", "file1"), 1)
+        # A newer result for user 2 arrives before the next commit
+        await backend.set_membership(2, "-100", False, 30)
+        monkeypatch.undo()
+        await backend.flush()
+        backend.pending_memberships.clear()
+        results = [await backend.get_membership(user_id, "-100") for user_id in (1, 2)]
+        requesters = await backend.recent_requesters(10)
+        await backend.close()
+        return results, requesters
+
+    assert asyncio.run(run()) == ([True, False], [7])
@@ -0,0 +1,73 @@
+import asyncio
+
+import main
+from conftest import FakeBot, make_context, make_update
+
+
+def add_media(count):
+    async def add():
+        return [await main.state_backend.add_media("photo", f"file{i}") for i in range(count)]
+    return asyncio.run(add())
+
+
+def send_starts(bot, user_id, links):
+    async def run():
+        for link in links:
+            await main.start(make_update(user_id), make_context(bot, args=[link]))
+    asyncio.run(run())
+
+
+def test_repeated_start_with_the_same_link_costs_one_check_and_one_send():
+    [media_id] = add_media(1)
+    bot = FakeBot()
+    send_starts(bot, 42, [main.make_link_token(media_id)] * 50)
+    assert bot.count("get_chat_member") == 1
+    assert bot.count("send_photo") == 1
+
+
+def test_flood_of_distinct_links_is_capped_per_user():
+    media_ids = add_media(20)
+    bot = FakeBot()
+    send_starts(bot, 42, [main.make_link_token(media_id) for media_id in media_ids])
+    # The member's cached status covers every allowed request
+    assert bot.count("get_chat_member") == 1
+    assert bot.count("send_photo") == main.FLOOD_MAX_REQUESTS
+    assert len(bot.calls) == 1 + main.FLOOD_MAX_REQUESTS
+
+
+def test_one_users_flood_does_not_throttle_others():
+    media_ids = add_media(20)
+    bot = FakeBot()
+    send_starts(bot, 42, [main.make_link_token(media_id) for media_id in media_ids])
+    for user_id in range(100, 110):
+        send_starts(bot, user_id, [main.make_link_token(media_ids[0])])
+    assert bot.count("send_photo") == main.FLOOD_MAX_REQUESTS + 10
+
+
+def test_button_mashing_is_answered_once():
+    [media_id] = add_media(1)
+    bot = FakeBot()
+    update = make_update(42, callback_data=f"force_check_{main.make_link_token(media_id)}")
+
+    async def run():
+        for _ in range(30):
+            await main.handle_callback_query(update, make_context(bot))
+
+    asyncio.run(run())
+    answers = [call for call in update.callback_query.calls if not call[0] and not call[1]]
+    assert len(answers) == 1
+    assert bot.count("get_chat_member") == 1
+    assert bot.count("send_photo") == 1
+
+
+def test_requests_are_allowed_again_after_the_window(monkeypatch):
+    media_ids = add_media(6)
+    bot = FakeBot()
+    now = main.time.monotonic()
+    monkeypatch.setattr(main.time, "monotonic", lambda: now)
+    send_starts(bot, 42, [main.make_link_token(media_id) for media_id in media_ids])
+    assert bot.count("send_photo") == main.FLOOD_MAX_REQUESTS
+
+    monkeypatch.setattr(main.time, "monotonic", lambda: now + main.FLOOD_WINDOW + 1)
+    send_starts(bot, 42, [main.make_link_token(media_ids[-1])])
+    assert bot.count("send_photo") == main.FLOOD_MAX_REQUESTS + 1
@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def webhook(monkeypatch):
+    monkeypatch.setattr(main, "WEBHOOK_PATH", "/telegram")
+    monkeypatch.setattr(main, "WEBHOOK_SECRET", "s3cret")
+    monkeypatch.setattr(main, "WEBHOOK_MAX_BODY_SIZE", 1000)
+    monkeypatch.setattr(main, "WEBHOOK_READ_TIMEOUT", 0.5)
+    return monkeypatch
+
+
+def post(path="/telegram", secret="s3cret", body=b'{"update_id": 1}', length=None) -> list:
+    head = (f"POST {path} HTTP/1.1\r\nHost: bot\r\nContent-Type: application/json\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\nContent-Length: {len(body) if length is None else length}"
+            f"\r\n\r\n")
+    return [head.encode() + body]
+
+
+def send(chunks: list, pause: float = 0.0) -> tuple:
+    """Send the request in chunks, pausing between them; returns the status line and the dispatched updates"""
+    dispatched = []
+
+    async def dispatch(data):
+        dispatched.append(data)
+
+    async def run():
+        server = await asyncio.start_server(
+            lambda reader, writer: main.handle_webhook_request(dispatch, reader, writer), "127.0.0.1", 0
+        )
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        response = asyncio.create_task(reader.readline())
+        for chunk in chunks:
+            if response.done():
+                # Answered early; writing more would only reset the connection
+                break
+            writer.write(chunk)
+            await writer.drain()
+            await asyncio.sleep(pause)
+        status_line = await response
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return status_line.decode().strip()
+
+    return asyncio.run(run()), dispatched
+
+
+def test_valid_update_is_dispatched(webhook):
+    status, dispatched = send(post())
+    assert status == "HTTP/1.1 200 OK"
+    assert dispatched == [{"update_id": 1}]
+
+
+@pytest.mark.parametrize("request_chunks, expected", [
+    (post(secret="guess"), "403 Forbidden"),
+    (post(path="/other"), "404 Not Found"),
+    (post(body=b"", length=5000), "413 Payload Too Large"),
+    (post(body=b"{not json"), "400 Bad Request"),
+])
+def test_bad_requests_are_rejected(webhook, request_chunks, expected):
+    status, dispatched = send(request_chunks)
+    assert status == f"HTTP/1.1 {expected}"
+    assert dispatched == []
+
+
+def test_slow_client_gets_one_deadline_for_the_whole_request(webhook):
+    # Every line arrives well within the timeout, the whole request doesn't
+    head = post()[0].split(b"\r\n\r\n")[0]
+    chunks = [line + b"\r\n" for line in head.split(b"\r\n")] + [b"\r\n", b'{"update_id": 1}']
+    status, dispatched = send(chunks, pause=0.2)
+    assert status == "HTTP/1.1 400 Bad Request"
+    assert dispatched == []
+
+
+def test_dispatched_body_is_the_update_json(webhook):
+    update = {"update_id": 7, "message": {"text": "/start"}}
+    _, dispatched = send(post(body=json.dumps(update).encode()))
+    assert dispatched == [update]